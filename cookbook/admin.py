@@ -1,8 +1,11 @@
 __author__ = 'Luca'
 
 from django.contrib import admin
+from django.utils.translation import ugettext_lazy as _
 from models import *
 import cookbook_settings
+import forking
+from admin_helpers import InitialListFilter, PerformanceModelAdmin, range_filter
 
 
 class CategoryInline(admin.TabularInline):
@@ -28,7 +31,8 @@ class RecipeStepInline(admin.TabularInline):
 
 
 class UnitAdmin(admin.ModelAdmin):
-    list_display = ('unit_name', 'code',)
+    list_display = ('unit_name', 'code', 'type', 'system', 'factor',)
+    list_filter = ('type', 'system',)
 
 
 class GrapeTypeAdmin(admin.ModelAdmin):
@@ -36,9 +40,12 @@ class GrapeTypeAdmin(admin.ModelAdmin):
     list_filter = ('name', 'origin',)
 
 
-class WineAdmin(admin.ModelAdmin):
+class WineAdmin(PerformanceModelAdmin, admin.ModelAdmin):
     list_display = ('name', 'year', 'alcohol_percentage', )
     list_filter = ('year', 'name', 'alcohol_percentage', )
+    #see cookbook.admin_helpers
+    performance_list_filter = (('year', range_filter(10)), ('name', InitialListFilter),
+                               ('alcohol_percentage', range_filter(2)), )
     filter_horizontal = ('grape_type', )
 
 
@@ -51,16 +58,19 @@ class CountryAdmin(admin.ModelAdmin):
     list_display = ('name', 'continent', )
 
 
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(PerformanceModelAdmin, admin.ModelAdmin):
     list_display = ('title', 'summary', 'preparation_time', 'is_for_vegan', 'is_for_vegetarian',
                     'country')
     list_filter = ('title', 'is_for_vegan', 'is_for_vegetarian', )
+    #see cookbook.admin_helpers
+    performance_list_filter = (('title', InitialListFilter), 'is_for_vegan', 'is_for_vegetarian', )
     search_fields = ('title',)
     filter_horizontal = ('suggested_wine', )
     save_on_top = True
     save_as = True
     model = Recipe
     inlines = [IngredientInline, RecipeStepInline, ]
+    actions = ['fork_selected_recipes']
 
 
     def save_model(self, request, obj, form, change):
@@ -72,6 +82,15 @@ class RecipeAdmin(admin.ModelAdmin):
             obj.author = request.user
         obj.save()
 
+    def fork_selected_recipes(self, request, queryset):
+        """
+        This action forks the selected recipes for the current user
+        All forks are created in a single transaction (see cookbook.forking)
+        """
+        forks = forking.fork_recipes(queryset, request.user)
+        self.message_user(request, _(u'%d recipe(s) forked') % len(forks))
+    fork_selected_recipes.short_description = _(u'Fork selected recipes')
+
 
 
 admin.site.register(Category, CategoryAdmin)
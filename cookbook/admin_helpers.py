@@ -0,0 +1,225 @@
+# coding=utf-8
+"""
+Admin changelist performance mode.
+
+With DJANGO_CUISINE_ADMIN_PERFORMANCE_MODE set, the admins using
+PerformanceModelAdmin:
+- select_related() exactly the foreign keys shown in list_display,
+- use performance_list_filter, where high cardinality fields are filtered
+  by bucket (value ranges, initial letters) instead of by distinct value,
+  the buckets being cached,
+- show estimated counts instead of running COUNT(*) on the whole table
+  (see cookbook.pagination.approximate_count); counts of filtered lists
+  stay exact. The estimate is only displayed: pages are sliced without
+  it, so a low estimate hides no rows and a high one gives empty pages.
+"""
+from django.contrib.admin import FieldListFilter
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import EmptyPage, InvalidPage, Page, PageNotAnInteger, Paginator
+from django.db.models import FieldDoesNotExist, ManyToOneRel, Max, Min
+from django.utils.encoding import smart_unicode
+from django.utils.translation import ugettext_lazy as _
+
+import cookbook_settings
+from cookbook import caching, pagination
+
+
+def _cached_choices(model, field_path, kind, func):
+    """
+    Returns the choices of a filter, cached for DJANGO_CUISINE_ADMIN_FILTER_TIMEOUT seconds
+    """
+    return caching.get_or_set('admin', '%s:%s:%s' % (model._meta.db_table, field_path, kind), func,
+                              cookbook_settings.DJANGO_CUISINE_ADMIN_FILTER_TIMEOUT)
+
+
+class InitialListFilter(FieldListFilter):
+    """
+    Filters a text field by its initial letter, e.g. ('title', InitialListFilter)
+    """
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = '%s__istartswith' % field_path
+        self.lookup_val = request.GET.get(self.lookup_kwarg)
+        column = model._meta.get_field(field_path).column
+        queryset = model._default_manager.extra(select={'initial': 'UPPER(SUBSTR(%s, 1, 1))' % column})
+        self.lookup_choices = _cached_choices(model, field_path, 'initials', lambda: sorted(
+            initial for initial in queryset.values_list('initial', flat=True).distinct().order_by() if initial))
+        super(InitialListFilter, self).__init__(field, request, params, model, model_admin, field_path)
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, cl):
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': cl.get_query_string({}, [self.lookup_kwarg]),
+            'display': _('All'),
+        }
+        for initial in self.lookup_choices:
+            yield {
+                'selected': self.lookup_val is not None and self.lookup_val.upper() == initial,
+                'query_string': cl.get_query_string({self.lookup_kwarg: initial}),
+                'display': initial,
+            }
+
+
+class RangeListFilter(FieldListFilter):
+    """
+    Filters a numeric field by ranges of bucket_size values,
+    see range_filter()
+    """
+    bucket_size = 10
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg_since = '%s__gte' % field_path
+        self.lookup_kwarg_until = '%s__lt' % field_path
+        self.lookup_val_since = request.GET.get(self.lookup_kwarg_since)
+        self.lookup_val_until = request.GET.get(self.lookup_kwarg_until)
+        bounds = _cached_choices(model, field_path, 'bounds', lambda: model._default_manager.aggregate(
+            low=Min(field_path), high=Max(field_path)))
+        self.lookup_choices = []
+        if bounds['low'] is not None:
+            start = int(bounds['low'] // self.bucket_size) * self.bucket_size
+            while start <= bounds['high']:
+                self.lookup_choices.append((start, start + self.bucket_size))
+                start += self.bucket_size
+        super(RangeListFilter, self).__init__(field, request, params, model, model_admin, field_path)
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg_since, self.lookup_kwarg_until]
+
+    def choices(self, cl):
+        yield {
+            'selected': self.lookup_val_since is None and self.lookup_val_until is None,
+            'query_string': cl.get_query_string({}, [self.lookup_kwarg_since, self.lookup_kwarg_until]),
+            'display': _('All'),
+        }
+        for since, until in self.lookup_choices:
+            since, until = smart_unicode(since), smart_unicode(until)
+            yield {
+                'selected': self.lookup_val_since == since and self.lookup_val_until == until,
+                'query_string': cl.get_query_string({self.lookup_kwarg_since: since,
+                                                     self.lookup_kwarg_until: until}),
+                'display': u'%s - %s' % (since, until),
+            }
+
+
+def range_filter(bucket_size):
+    """
+    Returns a RangeListFilter with buckets of bucket_size values,
+    e.g. ('year', range_filter(10)) filters by decade
+    """
+    return type('RangeListFilter%s' % bucket_size, (RangeListFilter,), {'bucket_size': bucket_size})
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator estimating the count of unfiltered querysets. The count
+    (and num_pages) are only shown: page() does not check the page
+    number against them, it slices the queryset
+    """
+
+    def _get_count(self):
+        if self._count is None and not self.object_list.query.where:
+            self._count = pagination.approximate_count(self.object_list.model)
+        return super(EstimatedCountPaginator, self)._get_count()
+    count = property(_get_count)
+
+    def page(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        bottom = (number - 1) * self.per_page
+        object_list = list(self.object_list[bottom:bottom + self.per_page])
+        if not object_list and number > 1:
+            raise EmptyPage('That page contains no results')
+        return Page(object_list, number, self)
+
+
+class EstimatedCountChangeList(ChangeList):
+    """
+    ChangeList estimating the total number of objects and
+    using the performance_list_filter of its ModelAdmin
+    """
+
+    def __init__(self, request, model, list_display, list_display_links, list_filter, date_hierarchy,
+                 search_fields, list_select_related, list_per_page, list_max_show_all, list_editable, model_admin):
+        if getattr(model_admin, 'performance_list_filter', None) is not None:
+            list_filter = model_admin.performance_list_filter
+        super(EstimatedCountChangeList, self).__init__(request, model, list_display, list_display_links,
+                                                       list_filter, date_hierarchy, search_fields,
+                                                       list_select_related, list_per_page, list_max_show_all,
+                                                       list_editable, model_admin)
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.query_set, self.list_per_page)
+        result_count = paginator.count
+        if not self.query_set.query.where:
+            full_result_count = result_count
+        else:
+            full_result_count = pagination.approximate_count(self.model)
+
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
+
+        #the count may be estimated: the list is always sliced by the paginator
+        if self.show_all and can_show_all:
+            result_list = self.query_set._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num + 1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+
+class PerformanceModelAdmin(object):
+    """
+    ModelAdmin mixin switching the changelist to the performance mode when
+    performance_mode (DJANGO_CUISINE_ADMIN_PERFORMANCE_MODE by default) is set
+    """
+    performance_mode = cookbook_settings.DJANGO_CUISINE_ADMIN_PERFORMANCE_MODE
+    performance_list_filter = None
+
+    def get_list_select_related(self):
+        """
+        Returns the names of the foreign keys shown in list_display
+        """
+        names = []
+        for name in self.list_display:
+            try:
+                field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if isinstance(field.rel, ManyToOneRel):
+                names.append(name)
+        return names
+
+    def queryset(self, request):
+        queryset = super(PerformanceModelAdmin, self).queryset(request)
+        if self.performance_mode:
+            names = self.get_list_select_related()
+            if names:
+                queryset = queryset.select_related(*names)
+        return queryset
+
+    def get_changelist(self, request, **kwargs):
+        if self.performance_mode:
+            return EstimatedCountChangeList
+        return super(PerformanceModelAdmin, self).get_changelist(request, **kwargs)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.performance_mode:
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super(PerformanceModelAdmin, self).get_paginator(request, queryset, per_page, orphans,
+                                                                allow_empty_first_page)
@@ -0,0 +1,273 @@
+# coding=utf-8
+"""
+Benchmark suite of the cookbook hot paths.
+
+Each case (list views, search, pantry, shopping list, template tags,
+managers, forking, admin changelists, per-object save against the bulk
+operations of GenericBaseQuerySet) runs a number of times against the
+current database, e.g. one filled by generate_cookbook_data; pages are
+requested with the Django test client, so middleware and templates are
+included. For each case the p50/p95 latencies and the queries run are
+recorded; results are saved as JSON so that two runs (e.g. two commits)
+can be compared with compare().
+"""
+import datetime
+import math
+import os
+import random
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection, reset_queries
+from django.template import Context, Template
+from django.test.client import Client
+from tagging.models import TaggedItem
+
+from cookbook import facets, forking
+from cookbook.models import Category, Food, Recipe, RecipeStep
+
+BENCHMARK_USER = 'benchmark'
+
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank percentile of values
+    """
+    values = sorted(values)
+    return values[max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)] if values else None
+
+
+class Suite(object):
+    """
+    The benchmark cases, built from a sample of the current data
+    """
+
+    def __init__(self, seed=42):
+        self.rng = random.Random(seed)
+        self.client = Client()
+        self.admin_client = Client()
+        user, created = User.objects.get_or_create(username=BENCHMARK_USER, defaults={
+            'is_staff': True, 'is_superuser': True, 'email': 'benchmark@example.com'})
+        password = '%x' % self.rng.getrandbits(64)
+        #an existing account gets its password back on close()
+        self.user_created, self.old_password = created, user.password
+        user.set_password(password)
+        user.save()
+        self.user = user
+        self.admin_client.login(username=BENCHMARK_USER, password=password)
+        #the samples are loaded beforehand, out of the measures
+        self.sample_ids = self.sample_recipe_ids(200)
+        self.categories = list(Category.objects.all()[:200])
+        self.food_ids = list(Food.objects.values_list('id', flat=True)[:200])
+        words = Recipe.objects.values_list('title', flat=True)[:50]
+        self.words = [title.split()[0] for title in words if title.split()] or [u'risotto']
+        self.steps = list(RecipeStep.objects.filter(recipe__in=self.sample_ids)[:100])
+
+    def close(self):
+        """
+        Deletes the benchmark user created by the suite (restores the password of an existing one)
+        """
+        self.admin_client.logout()
+        if self.user_created:
+            self.user.delete()
+        else:
+            User.objects.filter(id=self.user.id).update(password=self.old_password)
+
+    def sample_recipe_ids(self, count):
+        """
+        Returns up to count ids of existing recipes, picked at random
+        """
+        last_id = Recipe.objects.order_by('-id').values_list('id', flat=True)[:1]
+        ids = set()
+        for attempt in range(count * 2 if last_id else 0):
+            ids.update(Recipe.objects.filter(id__gte=self.rng.randint(1, last_id[0])).order_by(
+                'id').values_list('id', flat=True)[:1])
+            if len(ids) >= count:
+                break
+        return sorted(ids)
+
+    def recipe_ids(self, count):
+        return self.rng.sample(self.sample_ids, min(count, len(self.sample_ids)))
+
+    def get(self, url, data=None, client=None):
+        response = (client or self.client).get(url, data or {})
+        if response.status_code != 200:
+            raise AssertionError('%s returned %d' % (url, response.status_code))
+        return response
+
+    def render(self, source):
+        return Template('{% load cooktags %}' + source).render(Context())
+
+    def fork(self):
+        forks = forking.fork_recipes(self.recipe_ids(10), self.user)
+        fork_ids = [fork.id for fork in forks.values()]
+
+        def cleanup():
+            #deleted through the ORM, so that signals restore the counters;
+            #the tags are not deleted with the recipes and ids can be reused
+            Recipe.objects.filter(id__in=fork_ids).delete()
+            TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Recipe),
+                                      object_id__in=fork_ids).delete()
+        return cleanup
+
+    def create_steps(self, bulk):
+        """
+        Adds 100 steps to a recipe, saving them one by one or with bulk_create
+        """
+        recipe_id = self.recipe_ids(1)[0]
+        steps = [RecipeStep(recipe_id=recipe_id, order=1000 + i, text=u'Benchmark step %d' % i) for i in range(100)]
+        if bulk:
+            RecipeStep.objects.bulk_create(steps)
+        else:
+            for step in steps:
+                step.save()
+
+        def cleanup():
+            RecipeStep.objects.filter(recipe=recipe_id, order__gte=1000, text__startswith=u'Benchmark step').delete()
+        return cleanup
+
+    def save_steps(self):
+        for step in self.steps:
+            step.save()
+
+    def cases(self):
+        """
+        Returns the [(name, callable)] cases
+        """
+        rng = self.rng
+        return [
+            ('view.recipe_list', lambda: self.get(reverse('cookbook_list:recipe_list'))),
+            ('view.wine_list', lambda: self.get(reverse('cookbook_list:wine_list'))),
+            ('view.recipe_detail', lambda: self.get(reverse('cookbook_list:recipe_detail',
+                                                            args=(self.recipe_ids(1)[0],)))),
+            ('view.search', lambda: self.get(reverse('cookbook_list:recipe_search'), {'q': rng.choice(self.words)})),
+            ('view.pantry', lambda: self.get(reverse('cookbook_list:recipe_pantry'), {
+                'food': rng.sample(self.food_ids, min(len(self.food_ids), 10))})),
+            ('view.shopping_list', lambda: self.get(reverse('cookbook_list:recipe_shopping_list'), {
+                'recipe': self.recipe_ids(5), 'format': 'json'})),
+            ('view.browse', lambda: self.get(reverse('cookbook_list:recipe_browse'), {
+                'category': rng.choice(self.categories).id})),
+            ('tags.recipes_by_category', lambda: self.render(
+                '{%% show_recipes_by_category %d 20 %%}' % rng.choice(self.categories).id)),
+            ('tags.vegan_recipes', lambda: self.render('{% show_vegan_recipes 20 %}')),
+            ('tags.vegetarian_recipes', lambda: self.render('{% show_vegetarian_recipes 20 %}')),
+            ('managers.published', lambda: list(Recipe.pub_objects.all()[:50])),
+            ('managers.vegan', lambda: list(Recipe.veg_objects.vegan_friendly()[:50])),
+            ('managers.category_subtree', lambda: list(Recipe.objects.in_category_subtree(
+                rng.choice(self.categories))[:50])),
+            ('managers.recipe_detail', lambda: Recipe.objects.get_detail(self.recipe_ids(1)[0])),
+            ('managers.history_50_recipes', lambda: [recipe.get_history() for recipe in Recipe.objects.filter(
+                id__in=self.recipe_ids(50)).with_history()]),
+            ('facets.count_facets', lambda: facets.count_facets({'difficulty': rng.randint(1, 5)})),
+            ('forking.fork_10_recipes', self.fork),
+            ('timestamps.save_100_steps', self.save_steps),
+            ('timestamps.bulk_update_100_steps', lambda: RecipeStep.objects.bulk_update(self.steps, ['text'])),
+            ('timestamps.touch_100_steps', lambda: RecipeStep.objects.filter(
+                id__in=[step.id for step in self.steps]).touch()),
+            ('timestamps.create_100_steps', lambda: self.create_steps(bulk=False)),
+            ('timestamps.bulk_create_100_steps', lambda: self.create_steps(bulk=True)),
+            ('admin.recipe_changelist', lambda: self.get(reverse('admin:cookbook_recipe_changelist'),
+                                                         client=self.admin_client)),
+            ('admin.wine_changelist', lambda: self.get(reverse('admin:cookbook_wine_changelist'),
+                                                       client=self.admin_client)),
+        ]
+
+
+def measure(func, iterations, cold=False):
+    """
+    Runs func iterations times (after a warm up run), returns its statistics.
+    func can return a cleanup function, run out of the measure
+    """
+    timings, queries = [], []
+    for i in range(iterations + 1):
+        if cold:
+            cache.clear()
+        reset_queries()
+        start = time.time()
+        result = func()
+        elapsed = (time.time() - start) * 1000
+        count = len(connection.queries)
+        if callable(result):
+            result()
+        if i:
+            timings.append(elapsed)
+            queries.append(count)
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': percentile(queries, 50),
+        'queries_max': max(queries),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).communicate()[0].strip() or None
+    except OSError:
+        return None
+
+
+def run(iterations=20, only=None, cold=False, seed=42, progress=None):
+    """
+    Runs the cases whose name contains only (all if None).
+    Returns the results as a JSON serializable dict
+    """
+    old_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    suite = None
+    try:
+        suite = Suite(seed)
+        results = {}
+        for name, func in suite.cases():
+            if only and only not in name:
+                continue
+            try:
+                results[name] = measure(func, iterations, cold)
+            except Exception as e:
+                results[name] = {'error': '%s: %s' % (e.__class__.__name__, e)}
+            if progress:
+                progress(name, results[name])
+    finally:
+        if suite is not None:
+            suite.close()
+        connection.use_debug_cursor = old_debug_cursor
+    return {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(),
+            'revision': git_revision(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'cache': settings.CACHES['default']['BACKEND'],
+            'recipes': Recipe.objects.count(),
+            'iterations': iterations,
+            'cold_cache': cold,
+        },
+        'cases': results,
+    }
+
+
+def compare(old, new, threshold=0.2):
+    """
+    Returns the (name, old p50, new p50, change, old queries, new queries, regression)
+    rows of the cases of two runs; a regression is a p50 growing more than
+    threshold or more queries
+    """
+    rows = []
+    for name in sorted(set(old['cases']) & set(new['cases'])):
+        before, after = old['cases'][name], new['cases'][name]
+        if 'error' in before or 'error' in after:
+            continue
+        change = (after['p50_ms'] - before['p50_ms']) / before['p50_ms'] if before['p50_ms'] else 0
+        rows.append((name, before['p50_ms'], after['p50_ms'], change, before['queries'], after['queries'],
+                     change > threshold or after['queries'] > before['queries']))
+    return rows
@@ -0,0 +1,229 @@
+# coding=utf-8
+"""
+Bulk fixture loader.
+
+A faster loaddata for big JSON fixtures (e.g. the geo ones): the file is
+parsed incrementally, one object at a time, and rows are inserted with
+bulk_create in batches, all inside one transaction. Natural key references
+(e.g. "country": ["IT"]) are resolved through in-memory lookups, loaded once
+per model and filled with the inserted rows, so memory stays flat whatever
+the size of the file.
+Rows whose primary key already exists are skipped, not updated, and no
+model signal is sent: caches and indexes fed by signals must be rebuilt.
+"""
+import io
+import json
+import os
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import get_apps
+
+from geo.models import AdministrativeArea, AdministrativeAreaType, Country
+
+#fields making the natural key of the models which can be referenced by one
+NATURAL_KEYS = {
+    Country: ('iso_code',),
+    AdministrativeAreaType: ('country', 'name'),
+    AdministrativeArea: ('country', 'name'),
+}
+
+
+def iter_json_array(stream, chunk_size=64 * 1024):
+    """
+    Yields the items of the JSON array read from stream (a text stream)
+    one at a time, reading chunk_size characters at once
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof, started = u'', 0, False, False
+    while True:
+        while pos < len(buf) and buf[pos] in u' \t\r\n,':
+            pos += 1
+        if pos < len(buf) and not started:
+            if buf[pos] != u'[':
+                raise ValueError('A JSON array was expected')
+            started = True
+            pos += 1
+            continue
+        if pos < len(buf) and buf[pos] == u']':
+            return
+        if pos < len(buf):
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            #an item ending with the buffer could go on in the next chunk
+            if end is not None and (end < len(buf) or eof):
+                yield item
+                pos = end
+                continue
+        if eof:
+            raise ValueError('Unexpected end of the JSON array')
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+
+class NaturalKeys(object):
+    """
+    In-memory natural key -> primary key lookups, one per model
+    """
+
+    def __init__(self):
+        self.lookups = {}
+
+    def size(self, model):
+        return sum(self.size(model._meta.get_field(name).rel.to) if model._meta.get_field(name).rel else 1
+                   for name in NATURAL_KEYS[model])
+
+    def lookup(self, model):
+        if model not in self.lookups:
+            fields = [model._meta.get_field(name).attname for name in NATURAL_KEYS[model]]
+            self.lookups[model] = dict((tuple(row[:-1]), row[-1]) for row in
+                                       model._default_manager.values_list(*(fields + ['pk'])).order_by().iterator())
+        return self.lookups[model]
+
+    def add(self, obj):
+        """
+        Makes an object just built from a fixture resolvable
+        """
+        model = obj.__class__
+        if model in NATURAL_KEYS:
+            key = tuple(getattr(obj, model._meta.get_field(name).attname) for name in NATURAL_KEYS[model])
+            self.lookup(model)[key] = obj.pk
+
+    def resolve(self, model, natural_key):
+        """
+        Returns the primary key of the model object with the given natural key
+        """
+        if model not in NATURAL_KEYS:
+            raise ValueError('Natural keys of %s are not supported' % model._meta.object_name)
+        natural_key, values = list(natural_key), []
+        for name in NATURAL_KEYS[model]:
+            rel = model._meta.get_field(name).rel
+            if rel:
+                size = self.size(rel.to)
+                values.append(self.resolve(rel.to, natural_key[:size]))
+                natural_key = natural_key[size:]
+            else:
+                values.append(natural_key.pop(0))
+        try:
+            return self.lookup(model)[tuple(values)]
+        except KeyError:
+            raise ValueError('%s matching %r does not exist' % (model._meta.object_name, values))
+
+
+def build(item, keys):
+    """
+    Returns the model object of a fixture item and the rows of its m2m
+    through tables, resolving natural keys
+    """
+    model = models.get_model(*item['model'].split('.'))
+    if model is None:
+        raise ValueError('Unknown model %s' % item['model'])
+    if item.get('pk') is None:
+        raise ValueError('%s rows without a primary key are not supported' % item['model'])
+    fields = item['fields']
+    values = {model._meta.pk.attname: model._meta.pk.to_python(item['pk'])}
+    for field in model._meta.fields:
+        if field.name not in fields:
+            continue
+        value = fields[field.name]
+        if field.rel and isinstance(value, (list, tuple)):
+            value = keys.resolve(field.rel.to, value)
+        elif field.rel and value is not None:
+            value = field.rel.to._meta.pk.to_python(value)
+        elif not field.rel:
+            value = field.to_python(value)
+        values[field.attname] = value
+    obj = model(**values)
+    through_rows = []
+    for field in model._meta.many_to_many:
+        through = field.rel.through
+        if field.name not in fields or not through._meta.auto_created:
+            continue
+        for value in fields[field.name]:
+            if isinstance(value, (list, tuple)):
+                value = keys.resolve(field.rel.to, value)
+            through_rows.append(through(**{field.m2m_column_name(): obj.pk, field.m2m_reverse_name(): value}))
+    return obj, through_rows
+
+
+def find_fixture(name):
+    """
+    Returns the path of a fixture given its path or its name
+    (looked up in the fixtures directories like loaddata does)
+    """
+    if os.path.exists(name):
+        return name
+    names = [name] if name.endswith('.json') else [name, name + '.json']
+    #models.py modules, or the models/ packages
+    paths = [getattr(app, '__path__', [app.__file__])[0] for app in get_apps()]
+    dirs = [os.path.join(os.path.dirname(path), 'fixtures') for path in paths]
+    for directory in dirs + list(getattr(settings, 'FIXTURE_DIRS', ())):
+        for fixture in names:
+            path = os.path.join(directory, fixture)
+            if os.path.exists(path):
+                return path
+    raise ValueError('No fixture named %s' % name)
+
+
+def _insert(batch):
+    """
+    Inserts a batch of built objects, skipping the existing ones.
+    Returns the number of rows inserted
+    """
+    inserted = 0
+    #models are inserted in the order they appear, referenced rows usually come first
+    order, by_model = [], {}
+    for obj, through_rows in batch:
+        if obj.__class__ not in by_model:
+            order.append(obj.__class__)
+        by_model.setdefault(obj.__class__, []).append((obj, through_rows))
+    for model in order:
+        items = by_model[model]
+        existing = set(model._default_manager.filter(pk__in=[obj.pk for obj, rows in items]).values_list(
+            'pk', flat=True))
+        new = [(obj, rows) for obj, rows in items if obj.pk not in existing]
+        model._default_manager.bulk_create([obj for obj, rows in new])
+        through_rows = {}
+        for obj, rows in new:
+            for row in rows:
+                through_rows.setdefault(row.__class__, []).append(row)
+        for through, rows in through_rows.iteritems():
+            through._default_manager.bulk_create(rows)
+        inserted += len(new)
+    return inserted
+
+
+@transaction.commit_on_success
+def load_fixture(path, batch_size=500):
+    """
+    Loads the JSON fixture at path, batch_size rows at a time.
+    Returns the number of rows read, the number of rows inserted
+    and the set of the models loaded
+    """
+    keys = NaturalKeys()
+    loaded = set()
+    read = inserted = 0
+    batch = []
+    with io.open(path, encoding='utf-8') as stream:
+        for item in iter_json_array(stream):
+            obj, through_rows = build(item, keys)
+            keys.add(obj)
+            loaded.add(obj.__class__)
+            batch.append((obj, through_rows))
+            read += 1
+            if len(batch) >= batch_size:
+                inserted += _insert(batch)
+                batch = []
+    if batch:
+        inserted += _insert(batch)
+    #explicit primary keys were inserted: sequences (if any) must go past them
+    cursor = connection.cursor()
+    for sql in connection.ops.sequence_reset_sql(no_style(), list(loaded)):
+        cursor.execute(sql)
+    return read, inserted, loaded
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+Versioned cache helpers.
+Cached values are stored under a namespace whose version is part of every key:
+bumping the version (see cookbook.signals) invalidates the whole namespace
+at once, without having to know or delete every single key.
+
+The versions are what the processes use to notice each other's changes
+(process-local indexes and snapshots are reloaded when they move): that
+takes a cache backend shared by the processes, e.g. memcached. With the
+per-process LocMemCache every process only sees its own bumps.
+"""
+import time
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+import cookbook_settings
+
+VERSION_KEY = 'cookbook:version:%s'
+VALUE_KEY = 'cookbook:%s:%s:%s'
+#Django 1.4 caches have no timeout meaning "never": the versions are kept for a year
+VERSION_TIMEOUT = 60 * 60 * 24 * 365
+
+
+def _new_version():
+    #a time based value: a version key evicted from the cache never resurrects old entries
+    return int(time.time() * 1000)
+
+
+def get_version(namespace):
+    """
+    Returns the current version of a cache namespace
+    """
+    key = VERSION_KEY % namespace
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        cache.add(key, version, VERSION_TIMEOUT)
+    return version
+
+
+def get_versions(*namespaces):
+    """
+    Returns the current versions of several cache namespaces, with a single cache request
+    """
+    keys = [VERSION_KEY % namespace for namespace in namespaces]
+    found = cache.get_many(keys)
+    return tuple(found[key] if key in found else get_version(namespace) for key, namespace in zip(keys, namespaces))
+
+
+def bump_version(*namespaces):
+    """
+    Invalidates all the values cached in the given namespaces
+    """
+    #not incr(): apart from memcached, it would store the version with the default timeout
+    keys = [VERSION_KEY % namespace for namespace in namespaces]
+    found = cache.get_many(keys)
+    cache.set_many(dict((key, max(_new_version(), found.get(key, 0) + 1)) for key in keys), VERSION_TIMEOUT)
+
+
+def is_shared():
+    """
+    Tells whether the cache is shared by the processes, i.e. whether
+    they see the versions bumped by each other
+    """
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def get_or_set(namespace, key, func, timeout=None):
+    """
+    Returns the value cached in namespace for key, computing
+    (and caching) it with func() when it is missing
+    """
+    full_key = VALUE_KEY % (namespace, get_version(namespace), key)
+    value = cache.get(full_key)
+    if value is None:
+        value = func()
+        cache.set(full_key, value, timeout or cookbook_settings.DJANGO_CUISINE_CACHE_TIMEOUT)
+    return value
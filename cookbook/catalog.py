@@ -0,0 +1,163 @@
+# coding=utf-8
+"""
+Process-local snapshot of the reference tables.
+
+Units, food types, foods, grape types, categories and countries are small
+and almost never change, but forms, ingredient strings and recipe lists
+keep resolving foreign keys to them. Each process keeps a snapshot of
+these tables: every table is loaded with one query the first time it is
+used, as namedtuple records (the id and the CATALOG_MODELS fields) in an
+id -> record dict, plus the ids in the default ordering of the model.
+Any save or delete of these models bumps the 'catalog' cache version (see
+cookbook.signals), and the bulk writers bump it themselves: every process
+notices it and reloads the tables lazily. The version is only seen by the
+other processes through a shared cache backend: with LocMemCache a process
+keeps its snapshot until it changes the catalog itself, and the catalog
+form fields (cookbook.forms) validate the submitted keys in the database.
+
+The model instances returned by instance() and related() are rebuilt from
+the records: only the snapshot fields are set, they are meant to be read.
+"""
+import threading
+from array import array
+from collections import namedtuple
+
+from django.db import DEFAULT_DB_ALIAS
+from geo.models import Country
+
+from cookbook import caching
+from cookbook.models import Category, Food, FoodType, GrapeType, Unit
+
+#model -> the fields of its records, the first one being the name
+CATALOG_MODELS = (
+    (Unit, ('unit_name', 'code', 'type', 'system', 'factor')),
+    (FoodType, ('type_name',)),
+    (Food, ('name', 'food_type')),
+    (GrapeType, ('name', 'origin')),
+    (Category, ('name', 'parent', 'order', 'level')),
+    (Country, ('name', 'fullname', 'iso_code', 'iso3_code', 'continent')),
+)
+
+MODELS = tuple(model for model, field_names in CATALOG_MODELS)
+
+
+class Table(object):
+    """
+    The records of a model, by id and in the default ordering
+    """
+    __slots__ = ('model', 'record', 'rows', 'ids', 'labels')
+
+    def __init__(self, model, field_names):
+        self.model = model
+        attnames = tuple(model._meta.get_field(name).attname for name in field_names)
+        self.record = namedtuple('%sRecord' % model._meta.object_name, ('id',) + attnames)
+        self.rows = {}
+        self.ids = array('l')
+        self.labels = {}
+        for row in model._default_manager.values_list('id', *field_names).iterator():
+            record = self.record._make(row)
+            self.rows[record.id] = record
+            self.ids.append(record.id)
+
+
+class Snapshot(object):
+    """
+    The tables of CATALOG_MODELS of a catalog version, loaded on first use
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def table(self, model):
+        table = self.tables.get(model)
+        if table is None:
+            with self.lock:
+                table = self.tables.get(model)
+                if table is None:
+                    table = self.tables[model] = Table(model, dict(CATALOG_MODELS)[model])
+        return table
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    Returns the process catalog snapshot, replaced after any change of the catalog models
+    """
+    global _snapshot
+    version = caching.get_version('catalog')
+    if _snapshot is None or _snapshot.version != version:
+        with _lock:
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = Snapshot(version)
+    return _snapshot
+
+
+def get(model, obj_id):
+    """
+    Returns the record of the model row with obj_id, None if there is no such row
+    """
+    return get_snapshot().table(model).rows.get(obj_id)
+
+
+def records(model):
+    """
+    Returns the records of all the rows of model, in its default ordering
+    """
+    table = get_snapshot().table(model)
+    return [table.rows[obj_id] for obj_id in table.ids]
+
+
+def name(model, obj_id):
+    """
+    Returns the name of the model row with obj_id, u'' if there is no such row
+    """
+    record = get(model, obj_id)
+    return (record[1] or u'') if record is not None else u''
+
+
+def _instance(table, obj_id):
+    record = table.rows.get(obj_id)
+    if record is None:
+        return None
+    obj = table.model(**record._asdict())
+    #like a fetched instance, so that it can be related to the fetched ones
+    obj._state.adding, obj._state.db = False, DEFAULT_DB_ALIAS
+    return obj
+
+
+def instance(model, obj_id):
+    """
+    Returns a model instance built from the record of obj_id, None if there is no such row
+    """
+    return _instance(get_snapshot().table(model), obj_id)
+
+
+def label(model, obj_id):
+    """
+    Returns the unicode() of the model row with obj_id, computed once per snapshot
+    """
+    table = get_snapshot().table(model)
+    if obj_id not in table.labels:
+        obj = _instance(table, obj_id)
+        table.labels[obj_id] = unicode(obj) if obj is not None else u''
+    return table.labels[obj_id]
+
+
+def related(obj, field_name):
+    """
+    Returns the object referenced by the field_name foreign key of obj:
+    the one already loaded on obj (e.g. by select_related) or an instance
+    built from the snapshot; None for a null key
+    """
+    field = obj._meta.get_field(field_name)
+    value = getattr(obj, field.attname)
+    if value is None:
+        return None
+    if hasattr(obj, field.get_cache_name()):
+        return getattr(obj, field_name)
+    return instance(field.rel.to, value) or getattr(obj, field_name)
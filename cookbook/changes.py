@@ -0,0 +1,113 @@
+# coding=utf-8
+"""
+Deferred refresh of the data derived from the recipes.
+
+The receivers of Recipe, RecipeStep and Ingredient saves and deletes (see
+cookbook.signals) do not refresh the total duration, search index, pantry
+index, wine pairings and cached details of the recipe themselves: they
+record its id with recipes_changed(). The recorded recipes are refreshed
+together, with the batched helpers of those modules, when the outermost
+collect() block ends; outside of any block they are refreshed at once.
+ChangesMiddleware runs every request in such a block, so saving a recipe
+with its 100 steps and ingredients in the admin costs one refresh of that
+recipe instead of one per row.
+"""
+import threading
+from contextlib import contextmanager
+
+from cookbook import caching
+
+#the derived data, in refresh order
+KINDS = ('duration', 'index', 'pantry', 'pairing', 'detail')
+
+_state = threading.local()
+
+
+def _pending():
+    if getattr(_state, 'pending', None) is None:
+        _state.pending = dict((kind, set()) for kind in KINDS)
+    return _state.pending
+
+
+def _depth():
+    return getattr(_state, 'depth', 0)
+
+
+def recipes_changed(recipe_ids, kinds=KINDS):
+    """
+    Records that the kinds of data derived from the given recipes (ids,
+    None are ignored) must be refreshed
+    """
+    pending = _pending()
+    recipe_ids = set(recipe_id for recipe_id in recipe_ids if recipe_id)
+    for kind in kinds:
+        pending[kind].update(recipe_ids)
+    if not _depth():
+        flush()
+
+
+def flush():
+    """
+    Refreshes the data of the recorded recipes, 500 recipes at a time
+    """
+    from cookbook import counters, pairing, pantry, recipe_cache, search
+    pending, _state.pending = _pending(), None
+    batches = dict((kind, sorted(pending[kind])) for kind in KINDS)
+    if batches['duration'] and counters.refresh_total_durations(batches['duration']):
+        #the facet counts of the recipe lists
+        caching.bump_version('recipes')
+    for start in range(0, len(batches['index']), 500):
+        search.index_recipes(batches['index'][start:start + 500])
+    if batches['pantry']:
+        pantry.recipes_changed(batches['pantry'])
+    for start in range(0, len(batches['pairing']), 500):
+        pairing.refresh_recipes(batches['pairing'][start:start + 500])
+    recipe_cache.recipes_changed(batches['detail'])
+
+
+def begin():
+    """
+    Starts deferring the refreshes, until the matching end()
+    """
+    _state.depth = _depth() + 1
+
+
+def end():
+    """
+    Ends a begin() block: the recorded recipes are refreshed by the outermost one
+    """
+    _state.depth = max(_depth() - 1, 0)
+    if not _state.depth:
+        flush()
+
+
+@contextmanager
+def collect():
+    """
+    Refreshes the recipes changed within the block once, when it ends
+    (e.g. with changes.collect(): ... around a loop of saves)
+    """
+    begin()
+    try:
+        yield
+    finally:
+        end()
+
+
+class ChangesMiddleware(object):
+    """
+    Refreshes the recipes changed by a request once, before the response is returned
+    """
+
+    def process_request(self, request):
+        if _depth():
+            #left by a request whose response middleware did not run
+            _state.depth = 1
+            end()
+        begin()
+        return None
+
+    def process_response(self, request, response):
+        if _depth():
+            end()
+        return response
@@ -5,3 +5,22 @@ DJANGO_CUISINE_INGREDIENT_EXTRA = getattr(settings, 'DJANGO_CUISINE_INGREDIENT_E
 DJANGO_CUISINE_INGREDIENT_MAX_NUM = getattr(settings, 'DJANGO_CUISINE_INGREDIENT_MAX_NUM', 20)
 DJANGO_CUISINE_RECIPE_STEPS_EXTRA = getattr(settings, 'DJANGO_CUISINE_RECIPE_STEPS_EXTRA',3)
 DJANGO_CUISINE_RECIPE_STEPS_MAX_NUM = getattr(settings, 'DJANGO_CUISINE_RECIPE_STEPS_MAX_NUM', 15)
+DJANGO_CUISINE_CACHE_TIMEOUT = getattr(settings, 'DJANGO_CUISINE_CACHE_TIMEOUT', 60 * 60)
+DJANGO_CUISINE_TAG_RECIPES_LIMIT = getattr(settings, 'DJANGO_CUISINE_TAG_RECIPES_LIMIT', 20)
+DJANGO_CUISINE_SEARCH_BACKEND = getattr(settings, 'DJANGO_CUISINE_SEARCH_BACKEND', 'auto')
+DJANGO_CUISINE_SEARCH_RESULTS_PER_PAGE = getattr(settings, 'DJANGO_CUISINE_SEARCH_RESULTS_PER_PAGE', 20)
+DJANGO_CUISINE_TAGGED_PER_PAGE = getattr(settings, 'DJANGO_CUISINE_TAGGED_PER_PAGE', 20)
+DJANGO_CUISINE_BROWSE_PER_PAGE = getattr(settings, 'DJANGO_CUISINE_BROWSE_PER_PAGE', 20)
+DJANGO_CUISINE_PANTRY_MIN_COVERAGE = getattr(settings, 'DJANGO_CUISINE_PANTRY_MIN_COVERAGE', 0.5)
+DJANGO_CUISINE_WINE_PAIRINGS = getattr(settings, 'DJANGO_CUISINE_WINE_PAIRINGS', 10)
+DJANGO_CUISINE_ADMIN_PERFORMANCE_MODE = getattr(settings, 'DJANGO_CUISINE_ADMIN_PERFORMANCE_MODE', False)
+DJANGO_CUISINE_ADMIN_FILTER_TIMEOUT = getattr(settings, 'DJANGO_CUISINE_ADMIN_FILTER_TIMEOUT', 5 * 60)
+DJANGO_CUISINE_INSTRUMENTATION_SAMPLE_RATE = getattr(settings, 'DJANGO_CUISINE_INSTRUMENTATION_SAMPLE_RATE',
+                                                     1.0 if settings.DEBUG else 0.01)
+DJANGO_CUISINE_INSTRUMENTATION_HEADER = getattr(settings, 'DJANGO_CUISINE_INSTRUMENTATION_HEADER', settings.DEBUG)
+DJANGO_CUISINE_INSTRUMENTATION_MAX_QUERIES = getattr(settings, 'DJANGO_CUISINE_INSTRUMENTATION_MAX_QUERIES', 50)
+DJANGO_CUISINE_INSTRUMENTATION_MAX_SIMILAR = getattr(settings, 'DJANGO_CUISINE_INSTRUMENTATION_MAX_SIMILAR', 5)
+DJANGO_CUISINE_THUMBNAIL_WORKERS = getattr(settings, 'DJANGO_CUISINE_THUMBNAIL_WORKERS', 2)
+DJANGO_CUISINE_RECIPE_CACHE_TIMEOUT = getattr(settings, 'DJANGO_CUISINE_RECIPE_CACHE_TIMEOUT', 15 * 60)
+DJANGO_CUISINE_RECIPE_CACHE_STALE_TIMEOUT = getattr(settings, 'DJANGO_CUISINE_RECIPE_CACHE_STALE_TIMEOUT', 60 * 60)
+DJANGO_CUISINE_IMPORT_WORKERS = getattr(settings, 'DJANGO_CUISINE_IMPORT_WORKERS', 2)
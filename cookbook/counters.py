@@ -0,0 +1,164 @@
+# coding=utf-8
+"""
+Denormalized counters: forks per recipe (Recipe.forks_count), recipes
+per author (AuthorStats.recipes_count), tagged objects per tag and
+model (TagStats.items_count) and minutes per recipe, the sum of its step
+durations (Recipe.total_duration).
+Counters are updated with F() expressions by the signal receivers in
+cookbook.signals and by the forking service, and can be rebuilt from
+scratch with the rebuild_counters management command.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import Count, F
+from tagging.models import TaggedItem
+
+from cookbook.models import AuthorStats, Recipe, RecipeStep, TagStats
+
+
+def update_forks_count(recipe_ids, delta):
+    """
+    Adds delta to the forks counter of the given recipes
+    """
+    recipe_ids = [recipe_id for recipe_id in recipe_ids if recipe_id]
+    if recipe_ids:
+        Recipe.objects.filter(id__in=recipe_ids).update(forks_count=F('forks_count') + delta)
+
+
+def update_recipes_count(user_id, delta):
+    """
+    Adds delta to the recipes counter of the given author.
+    The first time the stats row is created with the actual count
+    """
+    if not AuthorStats.objects.filter(user=user_id).update(recipes_count=F('recipes_count') + delta):
+        AuthorStats.objects.get_or_create(user_id=user_id, defaults={
+            'recipes_count': Recipe.objects.filter(author=user_id).count()})
+
+
+def update_tag_count(content_type_id, tag_id, delta):
+    """
+    Adds delta to the counter of a tag for a content type.
+    The first time the stats row is created with the actual count,
+    so the counters are updated after the TaggedItem rows
+    """
+    stats = TagStats.objects.filter(tag=tag_id, content_type=content_type_id)
+    if delta < 0:
+        stats = stats.filter(items_count__gte=-delta)
+    if not stats.update(items_count=F('items_count') + delta):
+        refresh_tag_counts(content_type_id, [tag_id])
+
+
+def refresh_tag_counts(content_type_id, tag_ids):
+    """
+    Recomputes the counters of the given tags for a content type
+    from the TaggedItem rows, e.g. after a bulk_create of them
+    """
+    tag_ids = sorted(set(tag_ids))
+    if not tag_ids:
+        return
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute('UPDATE %(stats)s SET %(count)s = (SELECT COUNT(*) FROM %(items)s WHERE %(items)s.%(tag)s = '
+                   '%(stats)s.%(tag)s AND %(items)s.%(ctype)s = %(stats)s.%(ctype)s) '
+                   'WHERE %(ctype)s = %%s AND %(tag)s IN (%(placeholders)s)' % {
+                       'stats': qn(TagStats._meta.db_table),
+                       'items': qn(TaggedItem._meta.db_table),
+                       'count': qn('items_count'),
+                       'tag': qn(TagStats._meta.get_field('tag').column),
+                       'ctype': qn(TagStats._meta.get_field('content_type').column),
+                       'placeholders': ', '.join(['%s'] * len(tag_ids))}, [content_type_id] + tag_ids)
+    if cursor.rowcount < len(tag_ids):
+        existing = set(TagStats.objects.filter(tag__in=tag_ids, content_type=content_type_id).values_list(
+            'tag', flat=True))
+        for tag_id in tag_ids:
+            if tag_id not in existing:
+                TagStats.objects.get_or_create(tag_id=tag_id, content_type_id=content_type_id, defaults={
+                    'items_count': TaggedItem.objects.filter(tag=tag_id, content_type=content_type_id).count()})
+    transaction.commit_unless_managed()
+
+
+def total_duration_sql(connection=connection):
+    """
+    Returns the UPDATE setting Recipe.total_duration from the steps, and its value subquery
+    """
+    qn = connection.ops.quote_name
+    names = {'recipes': qn(Recipe._meta.db_table),
+             'steps': qn(RecipeStep._meta.db_table),
+             'total': qn('total_duration'),
+             'duration': qn('duration'),
+             'recipe': qn(RecipeStep._meta.get_field('recipe').column),
+             'id': qn(Recipe._meta.pk.column)}
+    value = ('COALESCE((SELECT SUM(%(steps)s.%(duration)s) FROM %(steps)s '
+             'WHERE %(steps)s.%(recipe)s = %(recipes)s.%(id)s), 0)' % names)
+    return 'UPDATE %(recipes)s SET %(total)s = ' % names + value, value
+
+
+def refresh_total_durations(recipe_ids):
+    """
+    Recomputes the total duration of the given recipes from their steps,
+    500 recipes per UPDATE. Returns the number of recipes whose total changed
+    """
+    recipe_ids = sorted(set(recipe_id for recipe_id in recipe_ids if recipe_id))
+    qn = connection.ops.quote_name
+    update, value = total_duration_sql()
+    cursor = connection.cursor()
+    changed = 0
+    for start in range(0, len(recipe_ids), 500):
+        batch = recipe_ids[start:start + 500]
+        #only the recipes whose total differs are written (and counted)
+        cursor.execute('%s WHERE %s IN (%s) AND %s <> %s' % (
+            update, qn(Recipe._meta.pk.column), ', '.join(['%s'] * len(batch)), qn('total_duration'), value), batch)
+        changed += cursor.rowcount
+    transaction.commit_unless_managed()
+    return changed
+
+
+def get_forks_count(recipe):
+    """
+    Returns the stored forks counter for a recipe (instance or id)
+    """
+    if isinstance(recipe, Recipe):
+        return recipe.forks_count
+    counts = Recipe.objects.filter(id=recipe).values_list('forks_count', flat=True)
+    return counts[0] if counts else 0
+
+
+def get_recipes_count(user):
+    """
+    Returns the stored recipes counter for an author (instance or id)
+    """
+    counts = AuthorStats.objects.filter(user=user).values_list('recipes_count', flat=True)
+    return counts[0] if counts else 0
+
+
+def get_tag_counts(model):
+    """
+    Returns the stored {tag name: tagged objects} counters of a model
+    """
+    return dict(TagStats.objects.filter(content_type=ContentType.objects.get_for_model(model),
+                                        items_count__gt=0).values_list('tag__name', 'items_count'))
+
+
+@transaction.commit_on_success
+def rebuild_counters():
+    """
+    Recomputes all the counters from the Recipe table
+    """
+    qn = connection.ops.quote_name
+    table = qn(Recipe._meta.db_table)
+    cursor = connection.cursor()
+    cursor.execute('UPDATE %(table)s SET %(count)s = (SELECT COUNT(*) FROM %(table)s forks '
+                   'WHERE forks.%(origin)s = %(table)s.%(id)s)' % {
+                       'table': table,
+                       'count': qn('forks_count'),
+                       'origin': qn(Recipe._meta.get_field('fork_origin').column),
+                       'id': qn(Recipe._meta.pk.column)})
+    cursor.execute(total_duration_sql()[0])
+    AuthorStats.objects.all().delete()
+    AuthorStats.objects.bulk_create([AuthorStats(user_id=row['author'], recipes_count=row['count'])
+                                     for row in Recipe.objects.values('author').annotate(count=Count('id')).order_by()])
+    TagStats.objects.all().delete()
+    TagStats.objects.bulk_create([TagStats(tag_id=row['tag'], content_type_id=row['content_type'],
+                                           items_count=row['count'])
+                                  for row in TaggedItem.objects.values('tag', 'content_type').annotate(
+                                      count=Count('id')).order_by()])
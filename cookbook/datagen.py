@@ -0,0 +1,288 @@
+# coding=utf-8
+"""
+Synthetic data generator.
+
+Builds a realistic cookbook of any size (10k to 1M recipes and more) for
+benchmarks: a category tree, food types and foods, wines with their grape
+types, authors, recipes with steps, ingredients, suggested wines and tags,
+and forks of existing recipes. The RNG is seeded, so a given seed and size
+always produce the same data. Rows are written with executemany in batches
+(explicit primary keys, following the existing rows), without model
+signals: the denormalized counters are computed while generating, caches
+are invalidated at the end, the search index and the wine pairings are left
+to reindex_recipes and rebuild_wine_pairings.
+"""
+import datetime
+import itertools
+import random
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import AutoField, Max
+from geo.models import AdministrativeArea, AdministrativeAreaType, Country
+from tagging.models import Tag, TaggedItem
+
+from cookbook import caching, counters
+from cookbook.models import (AuthorStats, Category, Food, FoodType, GrapeType, Ingredient, Recipe, RecipeStep,
+                             TagStats, Unit, Wine, METRIC, VOLUME, WEIGHT, WINE_KIND_LIST)
+
+WORDS = (u'risotto', u'tajarin', u'bagna', u'cauda', u'polenta', u'brasato', u'vitello', u'tonnato', u'agnolotti',
+         u'plin', u'bollito', u'misto', u'fritto', u'panna', u'cotta', u'torta', u'nocciole', u'zuppa', u'insalata',
+         u'frittata', u'crostata', u'salsa', u'verde', u'minestra', u'arrosto', u'funghi', u'tartufo', u'zucca',
+         u'porri', u'castagne', u'ragù', u'pesto', u'limone', u'mandorle', u'ceci', u'lenticchie', u'fave')
+FOOD_TYPES = (u'Cereals', u'Vegetables', u'Fruit', u'Meat', u'Fish', u'Dairy', u'Spices', u'Legumes', u'Nuts',
+              u'Oils')
+GRAPES = (u'Nebbiolo', u'Barbera', u'Dolcetto', u'Moscato', u'Arneis', u'Cortese', u'Freisa', u'Grignolino',
+          u'Sangiovese', u'Montepulciano', u'Aglianico', u'Primitivo', u'Vermentino', u'Trebbiano', u'Glera')
+TAGS = WORDS[:20] + (u'quick', u'winter', u'summer', u'party', u'light', u'traditional', u'spicy', u'kids')
+#the units used when the Unit table is empty: (name, code, type, factor)
+UNITS = ((u'gram', u'g', WEIGHT, 1), (u'kilogram', u'kg', WEIGHT, 1000), (u'millilitre', u'ml', VOLUME, 1),
+         (u'litre', u'l', VOLUME, 1000), (u'piece', u'', 3, None))
+
+
+class DataGenerator(object):
+    """
+    Generates a cookbook in the database aliased using
+    """
+
+    def __init__(self, seed=42, using=DEFAULT_DB_ALIAS, batch_size=5000):
+        self.rng = random.Random(seed)
+        self.using = using
+        self.batch_size = batch_size
+        self.now = datetime.datetime.now()
+        self.counts = {}
+
+    def next_id(self, model):
+        return (model._default_manager.db_manager(self.using).aggregate(Max('pk'))['pk__max'] or 0) + 1
+
+    def insert(self, model, rows):
+        """
+        Inserts rows, dicts of {attname: value}, into the table of model:
+        missing values are the field defaults. Returns the number of rows
+        """
+        connection = connections[self.using]
+        rows = iter(rows)
+        try:
+            first = rows.next()
+        except StopIteration:
+            return 0
+        rows = itertools.chain([first], rows)
+        #rows without a primary key get it from the database
+        fields = [field for field in model._meta.local_fields
+                  if not (isinstance(field, AutoField) and field.attname not in first)]
+        defaults = dict((field.attname, field.get_default()) for field in fields)
+        if 'created' in defaults:
+            defaults['created'] = defaults['updated'] = self.now
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)))
+        prepare = [(field.attname, field.get_db_prep_save) for field in fields]
+        cursor = connection.cursor()
+        batch, count = [], 0
+        for row in rows:
+            batch.append([prep(row.get(name, defaults[name]), connection=connection) for name, prep in prepare])
+            if len(batch) >= self.batch_size:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            count += len(batch)
+        self.counts[model._meta.object_name] = self.counts.get(model._meta.object_name, 0) + count
+        return count
+
+    def words(self, count):
+        return u' '.join(self.rng.choice(WORDS) for i in range(count))
+
+    def categories(self, count):
+        """
+        A two levels tree: count // 10 roots (at least one), the other categories being their children
+        """
+        roots = max(count // 10, 1)
+        first_id = self.next_id(Category)
+        first_tree = (Category.objects.db_manager(self.using).aggregate(Max('tree_id'))['tree_id__max'] or 0) + 1
+        children = [[] for i in range(roots)]
+        for i in range(roots, count):
+            children[self.rng.randrange(roots)].append(first_id + i)
+        rows = []
+        for root in range(roots):
+            root_id = first_id + root
+            rows.append({'id': root_id, 'name': self.words(1).title(), 'tree_id': first_tree + root, 'level': 0,
+                         'lft': 1, 'rght': 2 * len(children[root]) + 2, 'order': root})
+            for position, child_id in enumerate(children[root]):
+                rows.append({'id': child_id, 'name': self.words(2).capitalize(), 'parent_id': root_id,
+                             'tree_id': first_tree + root, 'level': 1, 'lft': 2 * position + 2,
+                             'rght': 2 * position + 3, 'order': position})
+        self.insert(Category, rows)
+        #recipes go to the leaves
+        return [row['id'] for row in rows if row['level'] == 1] or [row['id'] for row in rows]
+
+    def foods(self, count):
+        first_type = self.next_id(FoodType)
+        self.insert(FoodType, ({'id': first_type + i, 'type_name': name} for i, name in enumerate(FOOD_TYPES)))
+        first_id = self.next_id(Food)
+        self.insert(Food, ({'id': first_id + i, 'name': u'%s %d' % (self.words(1).capitalize(), i),
+                            'food_type_id': first_type + self.rng.randrange(len(FOOD_TYPES))} for i in range(count)))
+        return range(first_id, first_id + count)
+
+    def units(self):
+        unit_ids = list(Unit.objects.db_manager(self.using).values_list('id', flat=True))
+        if not unit_ids:
+            first_id = self.next_id(Unit)
+            self.insert(Unit, ({'id': first_id + i, 'unit_name': name, 'code': code, 'type': unit_type,
+                                'system': METRIC if factor else 3, 'factor': factor}
+                               for i, (name, code, unit_type, factor) in enumerate(UNITS)))
+            unit_ids = range(first_id, first_id + len(UNITS))
+        return unit_ids
+
+    def geo(self):
+        """
+        Returns the ids of the countries and of the areas (an area per country at most),
+        creating a country and an area if there are none
+        """
+        areas = dict(AdministrativeArea.objects.db_manager(self.using).values_list('country', 'id').order_by())
+        if not areas:
+            country = Country.objects.db_manager(self.using).get_or_create(
+                iso_code='ZZ', defaults={'iso3_code': 'ZZZ', 'num_code': '999', 'name': 'Cookland',
+                                         'fullname': 'Cookland', 'continent': 'EU'})[0]
+            area_type = AdministrativeAreaType.objects.db_manager(self.using).create(name='Region', country=country)
+            area = AdministrativeArea.objects.db_manager(self.using).create(name='Cookland Hills', country=country,
+                                                                             type=area_type)
+            areas = {country.id: area.id}
+        return areas.keys(), areas.values()
+
+    def authors(self, count):
+        first_id = self.next_id(User)
+        self.insert(User, ({'id': first_id + i, 'username': u'cook%d' % (first_id + i), 'password': '!',
+                            'date_joined': self.now, 'last_login': self.now} for i in range(count)))
+        return range(first_id, first_id + count)
+
+    def tags(self, model, tagged):
+        """
+        Creates the tagging rows of the {object id: tags string} of model
+        """
+        manager = Tag.objects.db_manager(self.using)
+        tag_ids = dict(manager.filter(name__in=TAGS).values_list('name', 'id'))
+        missing = [name for name in TAGS if name not in tag_ids]
+        if missing:
+            first_id = self.next_id(Tag)
+            self.insert(Tag, ({'id': first_id + i, 'name': name} for i, name in enumerate(missing)))
+            tag_ids.update((name, first_id + i) for i, name in enumerate(missing))
+        content_type = ContentType.objects.db_manager(self.using).get_for_model(model)
+        first_id = self.next_id(TaggedItem)
+        self.insert(TaggedItem, ({'id': first_id + i, 'tag_id': tag_ids[name], 'content_type_id': content_type.id,
+                                  'object_id': object_id} for i, (object_id, name) in enumerate(
+            (object_id, name) for object_id, tags in sorted(tagged.iteritems()) for name in tags.split())))
+        items_count = dict((tag_ids[name], 0) for name in TAGS)
+        for tags in tagged.itervalues():
+            for name in tags.split():
+                items_count[tag_ids[name]] += 1
+        for stat in TagStats.objects.db_manager(self.using).filter(content_type=content_type,
+                                                                   tag__in=items_count.keys()):
+            stat.items_count += items_count.pop(stat.tag_id)
+            stat.save(using=self.using)
+        self.insert(TagStats, ({'tag_id': tag_id, 'content_type_id': content_type.id,
+                                'items_count': items_count[tag_id]} for tag_id in sorted(items_count)))
+
+    def wines(self, count, area_ids):
+        first_grape = self.next_id(GrapeType)
+        self.insert(GrapeType, ({'id': first_grape + i, 'name': name, 'origin': u'Italy'}
+                                for i, name in enumerate(GRAPES)))
+        first_id = self.next_id(Wine)
+        tagged = {}
+        rows = []
+        for i in range(count):
+            wine_id = first_id + i
+            tagged[wine_id] = u' '.join(sorted(set(self.rng.sample(TAGS, self.rng.randint(1, 3)))))
+            rows.append({'id': wine_id, 'name': u'%s %d' % (self.words(2).title(), i), 'code': u'W%d' % wine_id,
+                         'area_id': self.rng.choice(area_ids), 'alcohol_percentage': self.rng.randint(110, 150) / 10.0,
+                         'year': self.rng.randint(1990, 2020), 'kind': self.rng.choice(WINE_KIND_LIST)[0],
+                         'rating': self.rng.randint(1, 5), 'tags': tagged[wine_id]})
+        self.insert(Wine, rows)
+        through = Wine.grape_type.through
+        self.insert(through, ({'wine_id': wine_id, 'grapetype_id': first_grape + grape}
+                              for wine_id in range(first_id, first_id + count)
+                              for grape in self.rng.sample(range(len(GRAPES)), self.rng.randint(1, 2))))
+        self.tags(Wine, tagged)
+        return range(first_id, first_id + count)
+
+    def recipes(self, count, category_ids, country_ids, area_ids, author_ids, fork_ratio):
+        """
+        Inserts count recipes, fork_ratio of them being forks of the recipes generated before them
+        """
+        rng = self.rng
+        first_id = self.next_id(Recipe)
+        origins = [None] * count
+        forks_count = [0] * count
+        for i in range(1, count):
+            if rng.random() < fork_ratio:
+                origins[i] = rng.randrange(i)
+                forks_count[origins[i]] += 1
+        recipes_count = {}
+        tagged = {}
+
+        def rows():
+            for i in xrange(count):
+                recipe_id = first_id + i
+                author_id = rng.choice(author_ids)
+                recipes_count[author_id] = recipes_count.get(author_id, 0) + 1
+                vegan = rng.random() < 0.05
+                tagged[recipe_id] = u' '.join(sorted(set(rng.sample(TAGS, rng.randint(1, 3)))))
+                yield {'id': recipe_id, 'title': u'%s %d' % (self.words(3).capitalize(), i),
+                       'summary': self.words(12), 'preparation_time': u'%d min' % rng.randint(10, 180),
+                       'difficulty': rng.randint(1, 5), 'category_id': rng.choice(category_ids),
+                       'is_published': rng.random() < 0.9, 'is_for_vegan': vegan,
+                       'is_for_vegetarian': vegan or rng.random() < 0.15, 'country_id': rng.choice(country_ids),
+                       'area_id': rng.choice(area_ids) if rng.random() < 0.5 else None, 'author_id': author_id,
+                       'fork_origin_id': None if origins[i] is None else first_id + origins[i],
+                       'forks_count': forks_count[i], 'tags': tagged[recipe_id]}
+
+        self.insert(Recipe, rows())
+        stats = AuthorStats.objects.db_manager(self.using)
+        for stat in stats.filter(user__in=recipes_count.keys()):
+            stat.recipes_count += recipes_count.pop(stat.user_id)
+            stat.save(using=self.using)
+        self.insert(AuthorStats, ({'user_id': user_id, 'recipes_count': recipes_count[user_id]}
+                                  for user_id in sorted(recipes_count)))
+        self.tags(Recipe, tagged)
+        return range(first_id, first_id + count)
+
+    def children(self, recipe_ids, steps, ingredients, food_ids, unit_ids, wine_ids, wine_ratio):
+        rng = self.rng
+        first_id = self.next_id(RecipeStep)
+        self.insert(RecipeStep, ({'id': first_id + i * steps + order, 'recipe_id': recipe_id, 'order': order,
+                                  'text': self.words(15).capitalize(), 'duration': rng.randint(1, 60)}
+                                 for i, recipe_id in enumerate(recipe_ids) for order in range(steps)))
+        first_id = self.next_id(Ingredient)
+        self.insert(Ingredient, ({'id': first_id + i * ingredients + order, 'recipe_id': recipe_id, 'order': order,
+                                  'food_id': rng.choice(food_ids), 'unit_id': rng.choice(unit_ids),
+                                  'quantity': rng.randint(1, 50) * 10}
+                                 for i, recipe_id in enumerate(recipe_ids) for order in range(ingredients)))
+        if recipe_ids:
+            connection = connections[self.using]
+            qn = connection.ops.quote_name
+            connection.cursor().execute('%s WHERE %s BETWEEN %%s AND %%s' % (
+                counters.total_duration_sql(connection)[0], qn(Recipe._meta.pk.column)), [recipe_ids[0], recipe_ids[-1]])
+        if wine_ids:
+            self.insert(Recipe.suggested_wine.through, ({'recipe_id': recipe_id, 'wine_id': rng.choice(wine_ids)}
+                                                        for recipe_id in recipe_ids if rng.random() < wine_ratio))
+
+    def generate(self, recipes, steps=3, ingredients=5, categories=50, foods=1000, wines=500, authors=None,
+                 fork_ratio=0.1, wine_ratio=0.3):
+        """
+        Generates the whole cookbook in a single transaction.
+        Returns the {model name: rows inserted}
+        """
+        with transaction.commit_on_success(using=self.using):
+            country_ids, area_ids = self.geo()
+            category_ids = self.categories(categories)
+            food_ids = self.foods(foods)
+            unit_ids = self.units()
+            wine_ids = self.wines(wines, area_ids)
+            author_ids = self.authors(authors or max(recipes // 50, 10))
+            recipe_ids = self.recipes(recipes, category_ids, country_ids, area_ids, author_ids, fork_ratio)
+            self.children(recipe_ids, steps, ingredients, food_ids, unit_ids, wine_ids, wine_ratio)
+        caching.bump_version('recipes', 'units', 'wines', 'geo', 'pantry', 'tags', 'recipe_details', 'catalog')
+        return self.counts
@@ -0,0 +1,422 @@
+# coding=utf-8
+"""
+Recipe import and export as JSON Lines.
+
+Each line is a recipe with its steps, ingredients, suggested wines and
+tags; related objects are referenced by natural key:
+
+  {"id": 12, "title": "Tajarin", "category": ["Pasta", "Egg pasta"],
+   "country": "IT", "area": ["IT", "Piemonte"], "author": "cook",
+   "fork_origin": 3, "tags": "pasta piemonte", ...,
+   "steps": [{"order": 0, "text": "...", "duration": 5}],
+   "ingredients": [{"quantity": 100.0, "unit": "gram", "food": ["flour", "Cereals"], "order": 0}],
+   "wines": [["DOCG-1", "Barolo", 2008]]}
+
+The category is its path from the root of the tree, foods are (name, food
+type name), units their name and wines (code, name, year). Step images are
+not exported.
+
+export_recipes() reads the recipes in primary key order, batch_size at a
+time, and writes them as they are read. import_recipes() parses the lines
+in a pool of DJANGO_CUISINE_IMPORT_WORKERS processes, a batch ahead of the
+one being inserted; recipes, steps and ingredients get their primary keys
+in the importer and are inserted with bulk_create, then counters, search
+index, pantry, pairings and tag index are updated batch by batch, as
+fork_recipes does. Missing authors, categories, food types and foods are
+created; unknown units and countries are errors; unknown areas and wines
+are dropped. The "id" and "fork_origin" of the file are remapped to the
+new primary keys: forks keep their origin when it is imported before them.
+Both directions keep a batch in memory (plus the catalog lookups and the
+old -> new recipe id map), whatever the size of the file.
+"""
+import datetime
+import json
+import multiprocessing
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+from geo.models import AdministrativeArea, Country
+from tagging.models import Tag, TaggedItem
+from tagging.utils import parse_tag_input
+
+import cookbook_settings
+from cookbook import caching, counters, pairing, pantry, recipe_cache, search, tagcloud
+from cookbook.models import Category, Food, FoodType, Ingredient, Recipe, RecipeStep, Unit, Wine
+
+#fields of the recipe lines which cannot be empty
+REQUIRED_FIELDS = ('title', 'difficulty', 'category', 'country', 'author')
+
+
+def category_paths():
+    """
+    Returns the {category id: [names from the root]} of all the categories
+    """
+    rows = dict((category_id, (name or u'', parent_id)) for category_id, name, parent_id in
+                Category.objects.values_list('id', 'name', 'parent').order_by())
+    paths = {}
+
+    def path(category_id):
+        if category_id not in paths:
+            name, parent_id = rows[category_id]
+            paths[category_id] = (path(parent_id) if parent_id else []) + [name]
+        return paths[category_id]
+
+    for category_id in rows:
+        path(category_id)
+    return paths
+
+
+def _group(rows):
+    """
+    Returns the {first value: [rest of the row]} of rows
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row[0]].append(row[1:])
+    return groups
+
+
+def recipe_lines(queryset=None, batch_size=500):
+    """
+    Yields the JSON lines of the recipes of queryset (all of them if None),
+    by primary key, loading batch_size recipes at a time
+    """
+    if queryset is None:
+        queryset = Recipe.objects.all()
+    queryset = queryset.select_related('country', 'area', 'area__country', 'author').order_by('id')
+    categories = category_paths()
+    through = Recipe.suggested_wine.through
+    last_id = 0
+    while True:
+        recipes = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not recipes:
+            return
+        ids = [recipe.id for recipe in recipes]
+        last_id = ids[-1]
+        steps = _group(RecipeStep.objects.filter(recipe__in=ids).order_by('recipe', 'order', 'id').values_list(
+            'recipe', 'order', 'text', 'duration'))
+        ingredients = _group(Ingredient.objects.filter(recipe__in=ids).order_by('recipe', 'order', 'id').values_list(
+            'recipe', 'quantity', 'unit__unit_name', 'food__name', 'food__food_type__type_name', 'order'))
+        wines = _group(through.objects.filter(recipe__in=ids).order_by('recipe', 'wine').values_list(
+            'recipe', 'wine__code', 'wine__name', 'wine__year'))
+        for recipe in recipes:
+            yield json.dumps({
+                'id': recipe.id,
+                'title': recipe.title,
+                'summary': recipe.summary,
+                'preparation_time': recipe.preparation_time,
+                'difficulty': recipe.difficulty,
+                'category': categories[recipe.category_id],
+                'is_published': recipe.is_published,
+                'is_for_vegan': recipe.is_for_vegan,
+                'is_for_vegetarian': recipe.is_for_vegetarian,
+                'country': recipe.country.iso_code,
+                'area': [recipe.area.country.iso_code, recipe.area.name] if recipe.area_id else None,
+                'author': recipe.author.username,
+                'fork_origin': recipe.fork_origin_id,
+                'tags': recipe.tags,
+                'created': recipe.created.isoformat(),
+                'updated': recipe.updated.isoformat(),
+                'steps': [{'order': order, 'text': text, 'duration': duration}
+                          for order, text, duration in steps[recipe.id]],
+                'ingredients': [{'quantity': quantity, 'unit': unit, 'food': [food, food_type], 'order': order}
+                                for quantity, unit, food, food_type, order in ingredients[recipe.id]],
+                'wines': [list(wine) for wine in wines[recipe.id]],
+            }, sort_keys=True) + '\n'
+
+
+def export_recipes(stream, queryset=None, batch_size=500, progress=None):
+    """
+    Writes the recipes of queryset (all of them if None) to stream, a
+    binary file, as JSON Lines. Returns the number of recipes written;
+    progress(count) is called after each batch
+    """
+    count = 0
+    for count, line in enumerate(recipe_lines(queryset, batch_size), 1):
+        stream.write(line)
+        if progress and not count % batch_size:
+            progress(count)
+    return count
+
+
+def check_names(value, name, length=None):
+    """
+    Raises ValueError unless value is a non-empty list of strings (of length items if given)
+    """
+    if (not isinstance(value, list) or not value or not all(isinstance(v, basestring) for v in value) or
+            length is not None and len(value) != length):
+        raise ValueError('%s must be a list of %s strings' % (name, length or 'one or more'))
+
+
+def parse(numbered_line):
+    """
+    Returns the recipe of a (line number, JSON line), with its dates parsed.
+    It runs in the pool processes
+    """
+    line_number, line = numbered_line
+    try:
+        item = json.loads(line)
+        if not isinstance(item, dict):
+            raise ValueError('a JSON object was expected')
+        for name in REQUIRED_FIELDS:
+            if item.get(name) in (None, '', []):
+                raise ValueError('%s is missing' % name)
+        item['difficulty'] = int(item['difficulty'])
+        check_names(item['category'], 'category')
+        if item.get('area'):
+            check_names(item['area'], 'area', 2)
+        ingredients = item.get('ingredients') or []
+        if not isinstance(ingredients, list):
+            raise ValueError('ingredients must be a list')
+        for ingredient in ingredients:
+            if not isinstance(ingredient, dict):
+                raise ValueError('an ingredient must be a JSON object')
+            if ingredient.get('quantity') is None:
+                raise ValueError('ingredient quantity is missing')
+            ingredient['quantity'] = float(ingredient['quantity'])
+            check_names(ingredient.get('food'), 'ingredient food', 2)
+        for name in ('created', 'updated'):
+            if item.get(name):
+                value = parse_datetime(item[name])
+                if value is None:
+                    raise ValueError('%s is not a date: %s' % (name, item[name]))
+                item[name] = value
+    except (TypeError, ValueError) as e:
+        raise ValueError('Line %d: %s' % (line_number, e))
+    return item
+
+
+def init_worker():
+    """
+    Pool process initializer: the database connections inherited from the
+    parent process are dropped (not closed, they are still the parent's)
+    """
+    for alias in connections:
+        connections[alias].connection = None
+
+
+class Importer(object):
+    """
+    Inserts parsed recipes, one batch at a time, resolving their natural keys
+    """
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.now = datetime.datetime.now()
+        self.content_type = ContentType.objects.get_for_model(Recipe)
+        #file id -> new primary key of the imported recipes
+        self.recipe_ids = {}
+        self.next_ids = {}
+        self.counts = defaultdict(int)
+        self.authors = dict(User.objects.values_list('username', 'id'))
+        self.categories = dict((tuple(path), category_id) for category_id, path in category_paths().iteritems())
+        self.countries = dict(Country.objects.values_list('iso_code', 'id'))
+        self.areas = dict(((iso_code, name), area_id) for iso_code, name, area_id in
+                          AdministrativeArea.objects.values_list('country__iso_code', 'name', 'id'))
+        self.units = dict(Unit.objects.order_by('-id').values_list('unit_name', 'id'))
+        self.food_types = dict(FoodType.objects.order_by('-id').values_list('type_name', 'id'))
+        self.foods = dict(((name, type_name), food_id) for name, type_name, food_id in
+                          Food.objects.order_by('-id').values_list('name', 'food_type__type_name', 'id'))
+        self.wines = dict(((code, name, year), wine_id) for code, name, year, wine_id in
+                          Wine.objects.order_by('-id').values_list('code', 'name', 'year', 'id'))
+        self.tags = dict(Tag.objects.values_list('name', 'id'))
+
+    def allocate(self, model, count):
+        """
+        Returns the first of count new primary keys of model
+        """
+        if model not in self.next_ids:
+            self.next_ids[model] = (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+        first_id = self.next_ids[model]
+        self.next_ids[model] += count
+        return first_id
+
+    def author_id(self, username):
+        if username not in self.authors:
+            self.authors[username] = User.objects.create_user(username).id
+            self.counts['authors'] += 1
+        return self.authors[username]
+
+    def category_id(self, path):
+        path = tuple(path)
+        if path not in self.categories:
+            parent_id = self.category_id(path[:-1]) if len(path) > 1 else None
+            self.categories[path] = Category.objects.create(name=path[-1], parent_id=parent_id).id
+            self.counts['categories'] += 1
+        return self.categories[path]
+
+    def food_id(self, key):
+        name, type_name = key
+        if (name, type_name) not in self.foods:
+            if type_name not in self.food_types:
+                self.food_types[type_name] = FoodType.objects.create(type_name=type_name).id
+            self.foods[(name, type_name)] = Food.objects.create(name=name,
+                                                                food_type_id=self.food_types[type_name]).id
+            self.counts['foods'] += 1
+        return self.foods[(name, type_name)]
+
+    def tag_id(self, name):
+        if name not in self.tags:
+            self.tags[name] = Tag.objects.create(name=name).id
+        return self.tags[name]
+
+    def lookup(self, lookups, key, kind):
+        try:
+            return lookups[key]
+        except KeyError:
+            raise ValueError('%s %s does not exist' % (kind, key))
+
+    def insert(self, items):
+        """
+        Inserts a batch of parsed recipes
+        """
+        first_id = self.allocate(Recipe, len(items))
+        through = Recipe.suggested_wine.through
+        recipes, steps, ingredients, wines, tagged_items = [], [], [], [], []
+        forks, authors = defaultdict(int), defaultdict(int)
+        for recipe_id, item in enumerate(items, first_id):
+            fork_origin_id = self.recipe_ids.get(item.get('fork_origin'))
+            if item.get('id') is not None:
+                self.recipe_ids[item['id']] = recipe_id
+            author_id = self.author_id(item['author'])
+            recipes.append(Recipe(
+                id=recipe_id, title=item['title'], summary=item.get('summary'),
+                preparation_time=item.get('preparation_time'), difficulty=item['difficulty'],
+                category_id=self.category_id(item['category']), is_published=item.get('is_published', True),
+                is_for_vegan=item.get('is_for_vegan', False), is_for_vegetarian=item.get('is_for_vegetarian', False),
+                country_id=self.lookup(self.countries, item['country'], 'Country'),
+                area_id=self.areas.get(tuple(item['area'])) if item.get('area') else None,
+                author_id=author_id, fork_origin_id=fork_origin_id, tags=item.get('tags') or '',
+                total_duration=sum(step.get('duration') or 0 for step in item.get('steps') or ()),
+                created=item.get('created') or self.now, updated=item.get('updated') or self.now))
+            authors[author_id] += 1
+            if fork_origin_id:
+                forks[fork_origin_id] += 1
+            for step in item.get('steps') or ():
+                steps.append(RecipeStep(recipe_id=recipe_id, order=step.get('order'), text=step.get('text'),
+                                        duration=step.get('duration')))
+            for ingredient in item.get('ingredients') or ():
+                unit = ingredient.get('unit')
+                ingredients.append(Ingredient(
+                    recipe_id=recipe_id, quantity=ingredient['quantity'], order=ingredient.get('order'),
+                    unit_id=self.lookup(self.units, unit, 'Unit') if unit else None,
+                    food_id=self.food_id(ingredient['food'])))
+            wine_ids = set()
+            for wine in item.get('wines') or ():
+                wine_id = self.wines.get(tuple(wine))
+                if wine_id is None:
+                    self.counts['unknown wines'] += 1
+                elif wine_id not in wine_ids:
+                    wine_ids.add(wine_id)
+                    wines.append(through(recipe_id=recipe_id, wine_id=wine_id))
+            for name in parse_tag_input(item.get('tags') or ''):
+                tagged_items.append(TaggedItem(content_type=self.content_type, object_id=recipe_id,
+                                               tag_id=self.tag_id(name)))
+        #steps and ingredients get their primary keys here too: bulk_create
+        #would merge identical rows on sqlite otherwise
+        for first_child_id, children in ((self.allocate(RecipeStep, len(steps)), steps),
+                                         (self.allocate(Ingredient, len(ingredients)), ingredients)):
+            for child_id, child in enumerate(children, first_child_id):
+                child.id = child_id
+        #the recipes keep the timestamps of the file, steps and ingredients get the current one
+        Recipe.objects.bulk_create(recipes, batch_size=self.batch_size, timestamps=False)
+        RecipeStep.objects.bulk_create(steps, batch_size=self.batch_size)
+        Ingredient.objects.bulk_create(ingredients, batch_size=self.batch_size)
+        through.objects.bulk_create(wines, batch_size=self.batch_size)
+        TaggedItem.objects.bulk_create(tagged_items, batch_size=self.batch_size)
+
+        #bulk_create does not send post_save: counters and indexes are updated here
+        recipe_ids = [recipe.id for recipe in recipes]
+        by_delta = defaultdict(list)
+        for origin_id, delta in forks.iteritems():
+            by_delta[delta].append(origin_id)
+        for delta, origin_ids in by_delta.iteritems():
+            counters.update_forks_count(origin_ids, delta)
+        for author_id, delta in authors.iteritems():
+            counters.update_recipes_count(author_id, delta)
+        counters.refresh_tag_counts(self.content_type.id, [item.tag_id for item in tagged_items])
+        caching.bump_version('recipes')
+        search.index_recipes(recipe_ids)
+        pantry.recipes_changed(recipe_ids)
+        pairing.refresh_recipes(recipe_ids)
+        tagcloud.objects_changed(Recipe, recipe_ids)
+        recipe_cache.recipes_changed(forks.keys())
+        self.counts['recipes'] += len(recipes)
+        self.counts['steps'] += len(steps)
+        self.counts['ingredients'] += len(ingredients)
+        self.counts['wines'] += len(wines)
+        self.counts['tags'] += len(tagged_items)
+
+    def reset_sequences(self):
+        """
+        Explicit primary keys were inserted: sequences (if any) must go past them
+        """
+        cursor = connection.cursor()
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Recipe, RecipeStep, Ingredient]):
+            cursor.execute(sql)
+
+
+def numbered_batches(stream, size):
+    """
+    Yields the non blank lines of stream, as (line number, line) lists of size items
+    """
+    batch = []
+    for line_number, line in enumerate(stream, 1):
+        if line.strip():
+            batch.append((line_number, line))
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+@transaction.commit_on_success
+def import_recipes(stream, batch_size=500, workers=None, progress=None):
+    """
+    Imports the JSON Lines recipes read from stream, in a single
+    transaction: nothing is imported if a line is invalid. Returns the
+    {kind: number of rows created} counts; progress(counts) is called
+    after each batch. Lines are parsed by a pool of workers processes
+    (DJANGO_CUISINE_IMPORT_WORKERS if None, in this process if 0)
+    """
+    if workers is None:
+        workers = cookbook_settings.DJANGO_CUISINE_IMPORT_WORKERS
+    importer = Importer(batch_size)
+
+    def insert(items):
+        importer.insert(items)
+        if progress:
+            progress(importer.counts)
+
+    pool = multiprocessing.Pool(workers, initializer=init_worker) if workers else None
+    try:
+        pending = None
+        for lines in numbered_batches(stream, batch_size):
+            if pool is None:
+                insert(map(parse, lines))
+                continue
+            #the next batch is parsed while the current one is inserted
+            parsed = pool.map_async(parse, lines, chunksize=max(len(lines) // (workers * 4), 1))
+            if pending is not None:
+                insert(pending.get())
+            pending = parsed
+        if pending is not None:
+            insert(pending.get())
+    except Exception:
+        #the batches inserted so far are rolled back, the process indexes have loaded them
+        pantry.reset()
+        tagcloud.reset()
+        caching.bump_version('recipes', 'pantry', 'tags')
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    importer.reset_sequences()
+    return dict(importer.counts)
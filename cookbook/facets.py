@@ -0,0 +1,184 @@
+# coding=utf-8
+"""
+Faceted browsing of the published recipes.
+
+The recipes are filtered by total duration bucket (Recipe.total_duration,
+the sum of the step durations maintained by cookbook.counters), difficulty,
+category, country and vegan / vegetarian flags. The counts of every facet
+within the filtered recipes are computed with a single statement (one
+GROUP BY per facet, joined with UNION ALL) and cached, per filters, in the
+'recipes' namespace: recipe, category and step duration changes bump it
+(see cookbook.signals). Category and country names are cached with them,
+the 'geo' version being part of the key.
+"""
+from django.db import connection
+from django.utils.http import urlencode
+from django.utils.translation import ugettext_lazy as _
+from geo.models import Country
+
+from cookbook import caching
+from cookbook.models import DIFFICULTY_CHOICES, Category, Recipe
+
+#(key, label, minimum minutes, maximum minutes or None); recipes without step durations are in none of them
+DURATION_BUCKETS = (
+    ('15', _(u'Up to 15 min.'), 1, 15),
+    ('30', _(u'15 to 30 min.'), 16, 30),
+    ('60', _(u'30 min. to 1 hour'), 31, 60),
+    ('120', _(u'1 to 2 hours'), 61, 120),
+    ('more', _(u'More than 2 hours'), 121, None),
+)
+
+#facet name -> label, in display order
+FACETS = (
+    ('duration', _(u'Duration')),
+    ('difficulty', _(u'Difficulty')),
+    ('category', _(u'Category')),
+    ('country', _(u'Country')),
+    ('vegan', _(u'Vegan Friendly')),
+    ('vegetarian', _(u'Vegetarian Friendly')),
+)
+
+
+def parse_filters(data):
+    """
+    Returns the valid filters of data (e.g. request.GET) as {facet name: value}
+    """
+    filters = {}
+    if data.get('duration') in [key for key, label, low, high in DURATION_BUCKETS]:
+        filters['duration'] = data['duration']
+    for name in ('difficulty', 'category', 'country'):
+        value = data.get(name, '')
+        if value.isdigit():
+            filters[name] = int(value)
+    if 'difficulty' in filters and filters['difficulty'] not in dict(DIFFICULTY_CHOICES):
+        del filters['difficulty']
+    for name in ('vegan', 'vegetarian'):
+        if data.get(name) == '1':
+            filters[name] = True
+    return filters
+
+
+def _bounds(key):
+    return [(low, high) for bucket_key, label, low, high in DURATION_BUCKETS if bucket_key == key][0]
+
+
+def _lookups(filters):
+    """
+    Returns the field lookups of the recipes matching filters
+    """
+    lookups = {}
+    if 'duration' in filters:
+        low, high = _bounds(filters['duration'])
+        lookups['total_duration__gte'] = low
+        if high is not None:
+            lookups['total_duration__lte'] = high
+    for name in ('difficulty', 'category', 'country'):
+        if name in filters:
+            lookups[name] = filters[name]
+    for name in ('vegan', 'vegetarian'):
+        if filters.get(name):
+            lookups['is_for_%s' % name] = True
+    return lookups
+
+
+def filter_recipes(filters, queryset=None):
+    """
+    Returns the published recipes of queryset (all of them by default) matching filters
+    """
+    queryset = Recipe.pub_objects.all() if queryset is None else queryset.filter(is_published=True)
+    return queryset.filter(**_lookups(filters))
+
+
+def count_facets(filters):
+    """
+    Returns the {facet name: {value: count}} of the published recipes
+    matching filters, with a single query
+    """
+    qn = connection.ops.quote_name
+    operators = {'gte': '>=', 'lte': '<='}
+    conditions = [('is_published', '=', True)]
+    for lookup, value in sorted(_lookups(filters).items()):
+        name, operator = (lookup.split('__') + ['='])[:2]
+        conditions.append((Recipe._meta.get_field(name).column, operators.get(operator, operator), value))
+    where = ' AND '.join('%s %s %%s' % (qn(column), operator) for column, operator, value in conditions)
+    params = [value for column, operator, value in conditions]
+    bucket = 'CASE %s END' % ' '.join(
+        'WHEN %s BETWEEN %d AND %d THEN %d' % (qn('total_duration'), low, high, i) if high is not None else
+        'WHEN %s >= %d THEN %d' % (qn('total_duration'), low, i)
+        for i, (key, label, low, high) in enumerate(DURATION_BUCKETS))
+    #every value is an integer, so that the GROUP BYs can be joined on any database
+    values = (bucket, qn('difficulty'), qn(Recipe._meta.get_field('category').column),
+              qn(Recipe._meta.get_field('country').column),
+              'CASE WHEN %s THEN 1 ELSE 0 END' % qn('is_for_vegan'),
+              'CASE WHEN %s THEN 1 ELSE 0 END' % qn('is_for_vegetarian'))
+    sql = ' UNION ALL '.join('SELECT %d, %s, COUNT(*) FROM %s WHERE %s GROUP BY %s' % (
+        i, value, qn(Recipe._meta.db_table), where, value) for i, value in enumerate(values))
+    cursor = connection.cursor()
+    cursor.execute(sql, params * len(values))
+    counts = dict((name, {}) for name, label in FACETS)
+    for facet, value, count in cursor.fetchall():
+        if value is not None:
+            counts[FACETS[facet][0]][int(value)] = count
+    counts['duration'] = dict((DURATION_BUCKETS[i][0], count) for i, count in counts['duration'].items())
+    counts['vegan'] = {True: counts['vegan'].get(1, 0)}
+    counts['vegetarian'] = {True: counts['vegetarian'].get(1, 0)}
+    return counts
+
+
+def urlencode_filters(filters):
+    """
+    Returns the query string of filters, the parse_filters() reverse
+    """
+    return urlencode(sorted((name, '1' if value is True else value) for name, value in filters.items()))
+
+
+def _toggle(filters, name, value):
+    """
+    Returns the query string of filters with the name facet set to value, or removed if it is already set to it
+    """
+    filters = dict(filters)
+    if filters.get(name) == value:
+        del filters[name]
+    else:
+        filters[name] = value
+    return urlencode_filters(filters)
+
+
+def get_facets(filters):
+    """
+    Returns the [{name, label, choices}] facets of the published recipes
+    matching filters; every choice is a {value, label, count, selected,
+    query} dict, query being the query string selecting (or deselecting) it
+    """
+
+    def load():
+        counts = count_facets(filters)
+        names = {
+            'category': dict(Category.objects.filter(id__in=counts['category'].keys()).values_list('id', 'name')),
+            'country': dict(Country.objects.filter(id__in=counts['country'].keys()).values_list('id', 'name')),
+        }
+        return counts, names
+
+    key = 'facets:%s:%s' % (caching.get_version('geo'), urlencode_filters(filters))
+    counts, names = caching.get_or_set('recipes', key, load)
+    labels = {
+        'duration': dict((key, label) for key, label, low, high in DURATION_BUCKETS),
+        'difficulty': dict(DIFFICULTY_CHOICES),
+        'category': names['category'],
+        'country': names['country'],
+        'vegan': {True: _(u'Vegan Friendly')},
+        'vegetarian': {True: _(u'Vegetarian Friendly')},
+    }
+    facets = []
+    for name, label in FACETS:
+        if name == 'duration':
+            order = [key for key, bucket_label, low, high in DURATION_BUCKETS if key in counts[name]]
+        elif name in ('category', 'country'):
+            order = sorted(counts[name], key=lambda value: labels[name].get(value, u''))
+        else:
+            order = sorted(counts[name])
+        facets.append({'name': name, 'label': label, 'choices': [
+            {'value': value, 'label': labels[name].get(value, value), 'count': counts[name][value],
+             'selected': filters.get(name) == value, 'query': _toggle(filters, name, value)}
+            for value in order if counts[name][value]]})
+    return facets
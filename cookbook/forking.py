@@ -0,0 +1,113 @@
+# coding=utf-8
+"""
+Recipe forking service.
+
+A fork is a copy of a Recipe owned by another author, with its steps,
+ingredients, suggested wines and tags. Forks are created with bulk inserts
+inside a single transaction, so the number of queries does not depend on
+the size of the recipes (or on how many recipes are forked at once).
+It is used by the fork_recipe view, the RecipeAdmin action and the
+fork_recipes management command.
+
+bulk_create does not give primary keys back: the forks are inserted with
+explicit ones, following the highest existing one. A concurrent fork taking
+the same keys fails with an IntegrityError and its transaction is rolled back.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from tagging.models import TaggedItem
+
+from cookbook import caching, counters, pairing, pantry, recipe_cache, search, tagcloud
+from cookbook.models import Recipe, RecipeStep, Ingredient
+
+
+def _copy_values(obj, exclude=()):
+    """
+    utility function: returns a dict with the concrete field values
+    of obj (primary key and excluded attributes left out)
+    """
+    return dict((f.attname, getattr(obj, f.attname)) for f in obj._meta.local_fields
+                if not f.primary_key and f.attname not in exclude)
+
+
+def _clone_children(model, origins, fork_ids):
+    """
+    utility function: copy all the model rows (RecipeStep or Ingredient)
+    belonging to the origins recipes, pointing them to the forks
+    """
+    children = []
+    for el in model.objects.filter(recipe__in=origins):
+        values = _copy_values(el, exclude=('recipe_id', 'created', 'updated'))
+        children.append(model(recipe_id=fork_ids[el.recipe_id], **values))
+    #the children get the timestamp of the bulk insert (see GenericBaseQuerySet)
+    model.objects.bulk_create(children)
+    return children
+
+
+def _allocate_ids(model, count):
+    """
+    utility function: returns count new primary keys of model
+    """
+    first_id = (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+    return range(first_id, first_id + count)
+
+
+@transaction.commit_on_success
+def fork_recipes(recipes, author):
+    """
+    Forks many recipes at once for the given author.
+    recipes  - Recipe instances or ids (duplicates are forked once)
+    author   - the User owning the new recipes
+    return   - a dict {origin recipe id: forked Recipe}
+    """
+    ids = set(getattr(rec, 'pk', rec) for rec in recipes)
+    origins = list(Recipe.objects.filter(id__in=ids))
+    if not origins:
+        return {}
+    ids = [rec.id for rec in origins]
+    forks = [Recipe(id=fork_id, author=author, fork_origin_id=rec.id,
+                    **_copy_values(rec, exclude=('created', 'updated', 'author_id', 'fork_origin_id', 'forks_count')))
+             for fork_id, rec in zip(_allocate_ids(Recipe, len(origins)), origins)]
+    Recipe.objects.bulk_create(forks)
+    #sequences (if any) must go past the explicit primary keys
+    cursor = connection.cursor()
+    for sql in connection.ops.sequence_reset_sql(no_style(), [Recipe]):
+        cursor.execute(sql)
+    fork_ids = dict((fork.fork_origin_id, fork.id) for fork in forks)
+
+    _clone_children(RecipeStep, ids, fork_ids)
+    _clone_children(Ingredient, ids, fork_ids)
+
+    through = Recipe.suggested_wine.through
+    through.objects.bulk_create([through(recipe_id=fork_ids[recipe_id], wine_id=wine_id) for recipe_id, wine_id in
+                                 through.objects.filter(recipe__in=ids).values_list('recipe_id', 'wine_id')])
+
+    #TagField saves its TaggedItem rows on post_save, which bulk_create does not send
+    ctype = ContentType.objects.get_for_model(Recipe)
+    tagged_items = [TaggedItem(content_type=ctype, object_id=fork_ids[object_id], tag_id=tag_id)
+                    for object_id, tag_id in TaggedItem.objects.filter(
+                        content_type=ctype, object_id__in=ids).values_list('object_id', 'tag_id')]
+    TaggedItem.objects.bulk_create(tagged_items)
+
+    #bulk_create does not send post_save either: counters and caches are updated here
+    counters.update_forks_count(ids, 1)
+    counters.update_recipes_count(author.id, len(forks))
+    counters.refresh_tag_counts(ctype.id, [item.tag_id for item in tagged_items])
+    caching.bump_version('recipes')
+    search.index_recipes(fork_ids.values())
+    pantry.recipes_changed(fork_ids.values())
+    pairing.refresh_recipes(fork_ids.values())
+    tagcloud.objects_changed(Recipe, fork_ids.values())
+    recipe_cache.recipes_changed(ids)
+    return dict((fork.fork_origin_id, fork) for fork in forks)
+
+
+def fork_recipe(recipe, author):
+    """
+    Forks a single recipe (instance or id) for the given author.
+    return   - the forked Recipe
+    """
+    return fork_recipes([recipe], author)[int(getattr(recipe, 'pk', recipe))]
@@ -1,6 +1,106 @@
 __author__ = 'luca'
-from django.forms import ModelForm
+from django.core.exceptions import ValidationError
+from django.core.validators import EMPTY_VALUES
+from django.db.models import ManyToManyField
+from django.forms import ModelChoiceField, ModelForm, ModelMultipleChoiceField
+from django.forms.fields import ChoiceField
 from models import Recipe , Wine
+from widgets import GeoLookupWidget
+from cookbook import caching, catalog
+
+
+class CatalogChoiceIterator(object):
+    """
+    The (id, label) choices of a catalog field, read from the snapshot when iterated
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield (u'', self.field.empty_label)
+        model = self.field.queryset.model
+        for record in catalog.records(model):
+            yield (record.id, catalog.label(model, record.id))
+
+    def __len__(self):
+        return len(catalog.records(self.field.queryset.model)) + (self.field.empty_label is not None)
+
+
+class CatalogChoiceField(ModelChoiceField):
+    """
+    ModelChoiceField of a catalog model (see cookbook.catalog): the choices
+    come from the process snapshot, without queries. So does the cleaned
+    instance when the cache is shared by the processes; otherwise, and for
+    the keys missing from the snapshot, it is read from the queryset: the
+    snapshot of a process may miss the rows deleted by the others
+    """
+
+    def _get_choices(self):
+        return CatalogChoiceIterator(self)
+
+    choices = property(_get_choices, ChoiceField._set_choices)
+
+    def to_python(self, value):
+        if value in EMPTY_VALUES:
+            return None
+        obj = None
+        if caching.is_shared():
+            try:
+                obj = catalog.instance(self.queryset.model, int(value))
+            except (TypeError, ValueError):
+                raise ValidationError(self.error_messages['invalid_choice'])
+        return obj if obj is not None else super(CatalogChoiceField, self).to_python(value)
+
+
+class CatalogMultipleChoiceField(ModelMultipleChoiceField):
+    """
+    ModelMultipleChoiceField of a catalog model, see CatalogChoiceField
+    """
+
+    def _get_choices(self):
+        return CatalogChoiceIterator(self)
+
+    choices = property(_get_choices, ChoiceField._set_choices)
+
+    def clean(self, value):
+        if not value:
+            if self.required:
+                raise ValidationError(self.error_messages['required'])
+            return []
+        if not isinstance(value, (list, tuple)):
+            raise ValidationError(self.error_messages['list'])
+        if not caching.is_shared():
+            return super(CatalogMultipleChoiceField, self).clean(value)
+        ids, objs = [], {}
+        for pk in value:
+            try:
+                ids.append(int(pk))
+            except (TypeError, ValueError):
+                raise ValidationError(self.error_messages['invalid_pk_value'] % pk)
+            obj = catalog.instance(self.queryset.model, ids[-1])
+            if obj is not None:
+                objs[obj.id] = obj
+        missing = [pk for pk in ids if pk not in objs]
+        if missing:
+            objs.update(self.queryset.in_bulk(missing))
+            for pk in missing:
+                if pk not in objs:
+                    raise ValidationError(self.error_messages['invalid_choice'] % pk)
+        self.run_validators(value)
+        return [objs[pk] for pk in ids]
+
+
+def catalog_formfield(field, **kwargs):
+    """
+    formfield_callback of the cookbook forms: the foreign keys (and many to
+    many) to the catalog models, without choice limits, get catalog fields
+    """
+    if field.rel and field.rel.to in catalog.MODELS and not field.rel.limit_choices_to:
+        kwargs['form_class'] = (CatalogMultipleChoiceField if isinstance(field, ManyToManyField)
+                                else CatalogChoiceField)
+    return field.formfield(**kwargs)
 
 class FrontendRecipeEditForm(ModelForm):
 
@@ -12,21 +112,39 @@ class FrontendRecipeEditForm(ModelForm):
     These parameters (fields) are:
     """
 
+    formfield_callback = catalog_formfield
+
     def __init__(self, *args, **kwargs):
         super(FrontendRecipeEditForm,self).__init__(*args, **kwargs)
 
     class Meta:
         model = Recipe
         exclude = ('fork_origin', 'is_published',)
+        widgets = {
+            'country': GeoLookupWidget('country'),
+            'area': GeoLookupWidget('area'),
+        }
 
 
 class RecipeForm(ModelForm):
+    formfield_callback = catalog_formfield
+
     class Meta:
         model = Recipe
+        widgets = {
+            'country': GeoLookupWidget('country'),
+            'area': GeoLookupWidget('area'),
+        }
 
 class WineForm(ModelForm):
+    formfield_callback = catalog_formfield
+
     class Meta:
         model = Wine
+        widgets = {
+            'place': GeoLookupWidget('location'),
+            'area': GeoLookupWidget('area'),
+        }
 
 
 
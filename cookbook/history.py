@@ -0,0 +1,56 @@
+# coding=utf-8
+"""
+Edit history (admin LogEntry rows) of the cookbook objects.
+
+attach_history() loads the history of many objects, of any models, with
+one query per content type and stores it on the objects, where
+GenericBaseModel.get_history() finds it; GenericBaseQuerySet.with_history()
+does it for the objects of a queryset as they are fetched. The rows are
+read through the (content_type, object_id, action_time) composite index
+(see cookbook.indexes).
+
+history_page() pages the history of a single object with a long edit
+trail by keyset cursor (see cookbook.pagination), newest first.
+"""
+from django.contrib.admin.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
+
+from cookbook.pagination import KeysetPaginator
+
+
+def entries(obj):
+    """
+    Returns the LogEntry queryset of obj, newest first
+    """
+    return LogEntry.objects.filter(content_type=ContentType.objects.get_for_model(obj),
+                                   object_id=unicode(obj.pk)).select_related('user')
+
+
+def attach_history(objects, limit=None):
+    """
+    Loads the history of objects (newest first, at most limit entries each)
+    with one query per content type; obj.get_history() then returns it
+    without querying
+    """
+    by_type = {}
+    for obj in objects:
+        by_type.setdefault(ContentType.objects.get_for_model(obj).id, []).append(obj)
+    for content_type_id, typed in by_type.iteritems():
+        history = dict((unicode(obj.pk), []) for obj in typed)
+        for start in range(0, len(typed), 500):
+            for entry in LogEntry.objects.filter(content_type=content_type_id, object_id__in=[
+                    unicode(obj.pk) for obj in typed[start:start + 500]]).select_related('user').order_by(
+                    '-action_time', '-id'):
+                history[entry.object_id].append(entry)
+        for obj in typed:
+            obj._history_cache = history[unicode(obj.pk)][:limit]
+    return objects
+
+
+def history_page(obj, per_page=20, after=None, before=None):
+    """
+    Returns the KeysetPage of the history of obj following the after
+    cursor (or preceding the before cursor), newest first.
+    Raises pagination.InvalidCursor
+    """
+    return KeysetPaginator(entries(obj), per_page).page(after=after, before=before)
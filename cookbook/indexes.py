@@ -0,0 +1,116 @@
+# coding=utf-8
+"""
+Composite indexes of the cookbook tables.
+
+Django 1.4 only creates single column indexes (db_index, foreign keys):
+the composite indexes matching the hot access paths are declared here and
+created after syncdb (see cookbook.signals), so running syncdb adds them
+to existing databases too. They follow the filters of the managers and
+template tags, ending with the default ordering columns so that
+"first n rows" queries are read in index order instead of being sorted:
+- PublishedManager: is_published, ordered by title,
+- VegManager: is_published and is_for_vegan or is_for_vegetarian,
+- recipes of a category (published or not),
+- published recipes by total duration (see cookbook.facets),
+- steps and ingredients of a recipe, ordered by (order, id),
+- the edit history (admin LogEntry rows) of an object, newest first
+  (see cookbook.history).
+The benchmark_indexes command measures them.
+"""
+from django.contrib.admin.models import LogEntry
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+
+from cookbook.models import Ingredient, Recipe, RecipeStep
+
+#(model, field names)
+INDEXES = (
+    (Recipe, ('is_published', 'title')),
+    (Recipe, ('is_published', 'is_for_vegan', 'title')),
+    (Recipe, ('is_published', 'is_for_vegetarian', 'title')),
+    (Recipe, ('category', 'is_published', 'title')),
+    (Recipe, ('is_published', 'total_duration')),
+    (RecipeStep, ('recipe', 'order', 'id')),
+    (Ingredient, ('recipe', 'order', 'id')),
+    (LogEntry, ('content_type', 'object_id', 'action_time')),
+)
+
+
+def columns(model, field_names):
+    return [model._meta.get_field(name).column for name in field_names]
+
+
+def index_name(model, field_names):
+    return '%s_%s_idx' % (model._meta.db_table, '_'.join(columns(model, field_names)))
+
+
+def create_sql(model, field_names, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the CREATE INDEX statement of an index
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    quoted = []
+    for name in field_names:
+        field = model._meta.get_field(name)
+        #MySQL only indexes a prefix of text columns (e.g. LogEntry.object_id)
+        prefix = '(191)' if connection.vendor == 'mysql' and isinstance(field, models.TextField) else ''
+        quoted.append(quote(field.column) + prefix)
+    return 'CREATE INDEX %s ON %s (%s)' % (quote(index_name(model, field_names)), quote(model._meta.db_table),
+                                           ', '.join(quoted))
+
+
+def existing_indexes(using=DEFAULT_DB_ALIAS):
+    """
+    Returns the names of the composite indexes already created
+    """
+    names = [index_name(model, field_names) for model, field_names in INDEXES]
+    connection = connections[using]
+    cursor = connection.cursor()
+    vendor = connection.vendor
+    placeholders = ', '.join(['%s'] * len(names))
+    if vendor == 'sqlite':
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name IN (%s)" % placeholders, names)
+    elif vendor == 'postgresql':
+        cursor.execute('SELECT indexname FROM pg_indexes WHERE indexname IN (%s)' % placeholders, names)
+    elif vendor == 'mysql':
+        cursor.execute('SELECT DISTINCT index_name FROM information_schema.statistics '
+                       'WHERE table_schema = DATABASE() AND index_name IN (%s)' % placeholders, names)
+    else:
+        return set()
+    return set(row[0] for row in cursor.fetchall())
+
+
+def create_indexes(using=DEFAULT_DB_ALIAS):
+    """
+    Creates the missing composite indexes.
+    Returns the names of the indexes created
+    """
+    existing = existing_indexes(using)
+    created = []
+    cursor = connections[using].cursor()
+    for model, field_names in INDEXES:
+        name = index_name(model, field_names)
+        if name not in existing:
+            cursor.execute(create_sql(model, field_names, using))
+            created.append(name)
+    transaction.commit_unless_managed(using=using)
+    return created
+
+
+def drop_indexes(using=DEFAULT_DB_ALIAS):
+    """
+    Drops the composite indexes, e.g. to compare query plans without them
+    """
+    connection = connections[using]
+    cursor = connection.cursor()
+    existing = existing_indexes(using)
+    for model, field_names in INDEXES:
+        name = index_name(model, field_names)
+        if name not in existing:
+            continue
+        if connection.vendor == 'mysql':
+            cursor.execute('DROP INDEX %s ON %s' % (connection.ops.quote_name(name),
+                                                    connection.ops.quote_name(model._meta.db_table)))
+        else:
+            cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+    transaction.commit_unless_managed(using=using)
@@ -0,0 +1,180 @@
+# coding=utf-8
+"""
+Per request instrumentation of the cookbook.
+
+InstrumentationMiddleware records, for a sample of the requests
+(DJANGO_CUISINE_INSTRUMENTATION_SAMPLE_RATE), the view, the number of SQL
+queries and their total time, the duplicated queries, the template
+rendering time and the response size. The figures are logged to the
+'cookbook.instrumentation' logger, as a JSON message and as the
+'instrumentation' attribute of the log record for structured handlers,
+and optionally returned in the X-Cookbook-Instrumentation response header
+(DJANGO_CUISINE_INSTRUMENTATION_HEADER).
+
+Duplicated queries are counted twice: exact duplicates (the same SQL with
+the same parameters) and similar queries (the same SQL once the literals
+are removed), the latter exposing the N+1 patterns, e.g. the food and unit
+queries of Ingredient.__unicode__. The requests running more than
+DJANGO_CUISINE_INSTRUMENTATION_MAX_QUERIES queries or repeating a query
+more than DJANGO_CUISINE_INSTRUMENTATION_MAX_SIMILAR times are logged as
+warnings, with the repeated statements.
+
+The middleware should be the first of MIDDLEWARE_CLASSES, so that the
+other middlewares are measured too.
+"""
+import logging
+import random
+import re
+import threading
+import time
+
+from django.db import connections
+from django.template.base import Template
+from django.utils import simplejson
+
+import cookbook_settings
+
+logger = logging.getLogger('cookbook.instrumentation')
+
+HEADER = 'X-Cookbook-Instrumentation'
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\?(?:, \?)*\)')
+
+_state = threading.local()
+
+
+def normalize(sql):
+    """
+    Returns sql without its literals, e.g. "... WHERE id = 3" -> "... WHERE id = ?"
+    """
+    return _IN_LIST.sub('(...)', _NUMBER.sub('?', _STRING.sub('?', sql)))
+
+
+def duplicates(statements, limit=3):
+    """
+    Returns the (exact duplicates, similar queries, [(count, statement)]) of statements,
+    the most repeated normalized statements first (at most limit of them)
+    """
+    exact, similar = {}, {}
+    for sql in statements:
+        exact[sql] = exact.get(sql, 0) + 1
+        key = normalize(sql)
+        similar[key] = similar.get(key, 0) + 1
+    repeated = sorted(((count, sql) for sql, count in similar.iteritems() if count > 1), reverse=True)
+    return len(statements) - len(exact), len(statements) - len(similar), repeated[:limit]
+
+
+def _instrumented_render(self, context):
+    """
+    Template.render timing the outermost templates of the instrumented requests
+    """
+    stats = getattr(_state, 'stats', None)
+    if stats is None:
+        return _instrumented_render.original(self, context)
+    stats['templates'] += 1
+    stats['depth'] += 1
+    start = time.time()
+    try:
+        return _instrumented_render.original(self, context)
+    finally:
+        stats['depth'] -= 1
+        if not stats['depth']:
+            stats['template_time'] += time.time() - start
+
+
+def install_template_timer():
+    """
+    Wraps Template.render (once) to measure the rendering time
+    """
+    if Template.render.im_func is not _instrumented_render:
+        _instrumented_render.original = Template.render.im_func
+        Template.render = _instrumented_render
+
+
+def _collect_queries(stats):
+    """
+    Returns the (statements, total time) of the queries run since stats started,
+    restoring the debug cursors of the connections
+    """
+    statements, sql_time = [], 0.0
+    for alias, (use_debug_cursor, start) in stats['debug_cursors'].items():
+        connection = connections[alias]
+        queries = connection.queries[start:]
+        statements.extend(query['sql'] for query in queries)
+        sql_time += sum(float(query['time']) for query in queries)
+        connection.use_debug_cursor = use_debug_cursor
+        if not use_debug_cursor:
+            #the queries were recorded only for this request
+            del connection.queries[start:]
+    return statements, sql_time
+
+
+class InstrumentationMiddleware(object):
+    """
+    Measures queries, templates and response size of a sample of the requests
+    """
+
+    def __init__(self):
+        install_template_timer()
+
+    def process_request(self, request):
+        if getattr(_state, 'stats', None) is not None:
+            #left by a request which raised an exception
+            _collect_queries(_state.stats)
+        _state.stats = None
+        if random.random() >= cookbook_settings.DJANGO_CUISINE_INSTRUMENTATION_SAMPLE_RATE:
+            return None
+        debug_cursors = {}
+        for alias in connections:
+            connection = connections[alias]
+            debug_cursors[alias] = (connection.use_debug_cursor, len(connection.queries))
+            connection.use_debug_cursor = True
+        _state.stats = {'start': time.time(), 'view': None, 'templates': 0, 'depth': 0, 'template_time': 0.0,
+                        'debug_cursors': debug_cursors}
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = getattr(_state, 'stats', None)
+        if stats is not None:
+            stats['view'] = '%s.%s' % (getattr(view_func, '__module__', None),
+                                       getattr(view_func, '__name__', view_func.__class__.__name__))
+        return None
+
+    def process_response(self, request, response):
+        stats = getattr(_state, 'stats', None)
+        if stats is None:
+            return response
+        _state.stats = None
+        statements, sql_time = _collect_queries(stats)
+        exact, similar, repeated = duplicates(statements)
+        if getattr(response, '_base_content_is_iter', False):
+            size = None
+        else:
+            size = len(response.content)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': stats['view'],
+            'status': response.status_code,
+            'time_ms': round((time.time() - stats['start']) * 1000, 2),
+            'queries': len(statements),
+            'sql_ms': round(sql_time * 1000, 2),
+            'duplicates': exact,
+            'similar': similar,
+            'templates': stats['templates'],
+            'template_ms': round(stats['template_time'] * 1000, 2),
+            'size': size,
+        }
+        if (len(statements) > cookbook_settings.DJANGO_CUISINE_INSTRUMENTATION_MAX_QUERIES or
+                (repeated and repeated[0][0] > cookbook_settings.DJANGO_CUISINE_INSTRUMENTATION_MAX_SIMILAR)):
+            record['repeated'] = [{'count': count, 'sql': sql} for count, sql in repeated]
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+        logger.log(level, simplejson.dumps(record, sort_keys=True), extra={'instrumentation': record})
+        if cookbook_settings.DJANGO_CUISINE_INSTRUMENTATION_HEADER:
+            response[HEADER] = ', '.join('%s=%s' % (name, record[name]) for name in (
+                'view', 'time_ms', 'queries', 'sql_ms', 'duplicates', 'similar', 'template_ms', 'size'))
+        return response
@@ -0,0 +1,123 @@
+# coding=utf-8
+"""
+Autocomplete lookups over the geo tables.
+
+Locations, administrative areas and countries are thousands of rows: forms
+do not render them as <select> lists but as autocompleted inputs (see
+cookbook.widgets) backed by the geo_lookup JSON view. Each process keeps a
+sorted index of the names of each kind, built with one query on first use
+and rebuilt after any change (the 'geo' cache version, see cookbook.signals;
+the changes made by other processes are seen through a shared cache only).
+Names match on the start of any of their words, whole names first.
+"""
+import bisect
+import threading
+
+from geo.models import AdministrativeArea, Country, Location
+
+from cookbook import caching
+from cookbook.search import fold
+
+
+def _with_parent(name, parent):
+    return u'%s (%s)' % (name, parent) if parent else name
+
+
+def location_rows():
+    for obj_id, name, area in Location.objects.values_list('id', 'name', 'area__name').order_by().iterator():
+        yield obj_id, name, _with_parent(name, area)
+
+
+def area_rows():
+    for obj_id, name, country in AdministrativeArea.objects.values_list(
+            'id', 'name', 'country__name').order_by().iterator():
+        yield obj_id, name, _with_parent(name, country)
+
+
+def country_rows():
+    for obj_id, name in Country.objects.values_list('id', 'name').order_by().iterator():
+        yield obj_id, name, name
+
+
+#kind -> the function yielding the (id, name, label) rows to index
+KINDS = {
+    'location': location_rows,
+    'area': area_rows,
+    'country': country_rows,
+}
+
+
+class PrefixIndex(object):
+    """
+    Sorted folded names (and name endings, one per inner word), searched
+    by prefix with a binary search
+    """
+
+    def __init__(self, rows):
+        self.labels = {}
+        names, endings = [], []
+        for obj_id, name, label in rows:
+            self.labels[obj_id] = label
+            words = fold(name).split()
+            if words:
+                names.append((u' '.join(words), obj_id))
+            endings.extend((u' '.join(words[i:]), obj_id) for i in range(1, len(words)))
+        self.entries = [self._split(sorted(names)), self._split(sorted(endings))]
+        self.version = None
+
+    def _split(self, entries):
+        return [key for key, obj_id in entries], [obj_id for key, obj_id in entries]
+
+    def search(self, text, limit=10):
+        """
+        Returns the [(id, label)] of the names matching text
+        """
+        prefix = u' '.join(fold(text).split())
+        found = []
+        if not prefix:
+            return found
+        for keys, ids in self.entries:
+            pos = bisect.bisect_left(keys, prefix)
+            while pos < len(keys) and keys[pos].startswith(prefix) and len(found) < limit:
+                if ids[pos] not in found:
+                    found.append(ids[pos])
+                pos += 1
+        return [(obj_id, self.labels[obj_id]) for obj_id in found]
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_index(kind):
+    """
+    Returns the process index of kind (location, area or country),
+    rebuilding it after any change of the geo tables
+    """
+    version = caching.get_version('geo')
+    index = _indexes.get(kind)
+    if index is None or index.version != version:
+        with _lock:
+            index = _indexes.get(kind)
+            if index is None or index.version != version:
+                index = PrefixIndex(KINDS[kind]())
+                index.version = version
+                _indexes[kind] = index
+    return index
+
+
+def search(kind, text, limit=10):
+    """
+    Returns the [(id, label)] of the objects of kind whose name matches text
+    """
+    return get_index(kind).search(text, limit)
+
+
+def label(kind, obj_id):
+    """
+    Returns the label of an object of kind, None if it does not exist
+    """
+    try:
+        return get_index(kind).labels.get(int(obj_id))
+    except (TypeError, ValueError):
+        return None
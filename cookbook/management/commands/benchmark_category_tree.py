@@ -0,0 +1,108 @@
+import random
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+from django.db.models import Max
+
+from cookbook.models import Category, Recipe
+
+
+def build_tree(nodes, seed):
+    """
+    Returns a random tree as a list of parent indexes (None for the root),
+    each node being attached to one of the nodes created before it
+    """
+    rng = random.Random(seed)
+    return [None] + [rng.randrange(i) for i in range(1, nodes)]
+
+
+def nested_sets(parents):
+    """
+    Returns the (lft, rght, level) values of each node of the tree
+    """
+    children = [[] for i in parents]
+    for i, parent in enumerate(parents):
+        if parent is not None:
+            children[parent].append(i)
+    values = [None] * len(parents)
+    counter = 1
+    stack = [(0, 0, False)]
+    while stack:
+        node, level, visited = stack.pop()
+        if visited:
+            values[node] = (values[node][0], counter, level)
+            counter += 1
+            continue
+        values[node] = (counter, None, level)
+        counter += 1
+        stack.append((node, level, True))
+        stack.extend((child, level + 1, False) for child in reversed(children[node]))
+    return values
+
+
+def recursive_walk(category):
+    """
+    Adjacency list walk: one query per tree level
+    """
+    ids = [category.id]
+    frontier = ids
+    while frontier:
+        frontier = list(Category.objects.filter(parent__in=frontier).values_list('id', flat=True))
+        ids.extend(frontier)
+    return ids
+
+
+class Command(NoArgsCommand):
+    """
+    Compares the nested sets Category queries with a recursive adjacency list walk.
+    The tree is created inside a transaction which is rolled back at the end
+    """
+    help = 'Benchmarks Category subtree queries (nested sets vs recursive walk)'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--nodes', dest='nodes', type='int', default=5000, help='Number of categories in the tree'),
+        make_option('--samples', dest='samples', type='int', default=20, help='Number of subtrees to query'),
+        make_option('--seed', dest='seed', type='int', default=42, help='Random seed'),
+    )
+
+    def measure(self, func, categories):
+        start_queries = len(connection.queries)
+        start = time.time()
+        for category in categories:
+            func(category)
+        elapsed = (time.time() - start) * 1000 / len(categories)
+        queries = float(len(connection.queries) - start_queries) / len(categories)
+        return elapsed, queries
+
+    @transaction.commit_manually
+    def handle_noargs(self, **options):
+        connection.use_debug_cursor = True
+        try:
+            parents = build_tree(options['nodes'], options['seed'])
+            first_id = (Category.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+            tree_id = (Category.objects.aggregate(Max('tree_id'))['tree_id__max'] or 0) + 1
+            Category.objects.bulk_create([Category(id=first_id + i, name='Category %d' % i, tree_id=tree_id,
+                                                   parent_id=None if parent is None else first_id + parent,
+                                                   lft=lft, rght=rght, level=level)
+                                          for i, (parent, (lft, rght, level)) in
+                                          enumerate(zip(parents, nested_sets(parents)))])
+            rng = random.Random(options['seed'])
+            #sample the inner nodes, leaves have no subtree to walk
+            categories = list(Category.objects.filter(tree_id=tree_id).extra(where=['rght - lft > 1']))
+            categories = [Category.objects.get(id=first_id)] + rng.sample(categories, min(options['samples'],
+                                                                                        len(categories)))
+            results = (
+                ('recursive walk', self.measure(
+                    lambda cat: list(Recipe.objects.filter(category__in=recursive_walk(cat))), categories)),
+                ('nested sets', self.measure(
+                    lambda cat: list(Recipe.objects.in_category_subtree(cat)), categories)),
+                ('descendants', self.measure(lambda cat: list(Category.objects.descendants(cat)), categories)),
+                ('breadcrumbs', self.measure(Category.objects.breadcrumbs, categories)),
+            )
+            self.stdout.write('%d categories, %d subtrees queried\n' % (options['nodes'], len(categories)))
+            for name, (elapsed, queries) in results:
+                self.stdout.write('%-16s %8.2f ms %8.1f queries\n' % (name, elapsed, queries))
+        finally:
+            transaction.rollback()
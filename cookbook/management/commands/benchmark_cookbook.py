@@ -0,0 +1,62 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.utils import simplejson
+
+from cookbook import benchmarks
+
+
+class Command(NoArgsCommand):
+    """
+    Runs the benchmark suite (see cookbook.benchmarks) against the current
+    database, e.g. one filled by generate_cookbook_data, and writes the
+    results as JSON. With --compare, the p50 latencies and query counts are
+    compared with a previous run and regressions are reported:
+    manage.py benchmark_cookbook --output after.json --compare before.json
+    """
+    help = 'Measures p50/p95 latencies and query counts of the cookbook hot paths'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--iterations', dest='iterations', type='int', default=20, help='Runs of each case'),
+        make_option('--only', dest='only', help='Run only the cases whose name contains this text'),
+        make_option('--cold', dest='cold', action='store_true', default=False,
+                    help='Clear the cache before each run'),
+        make_option('--output', dest='output', help='JSON file to write (default: standard output)'),
+        make_option('--compare', dest='compare', help='JSON file of a previous run to compare with'),
+        make_option('--threshold', dest='threshold', type='float', default=20,
+                    help='p50 growth (percent) reported as a regression'),
+        make_option('--seed', dest='seed', type='int', default=42, help='Random seed'),
+    )
+
+    def progress(self, name, result):
+        if 'error' in result:
+            sys.stderr.write('%-28s %s\n' % (name, result['error']))
+        else:
+            sys.stderr.write('%-28s p50 %9.2f ms  p95 %9.2f ms  %4d queries\n' % (
+                name, result['p50_ms'], result['p95_ms'], result['queries']))
+
+    def handle_noargs(self, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as stream:
+                    baseline = simplejson.load(stream)
+            except (IOError, ValueError) as e:
+                raise CommandError('Cannot read %s: %s' % (options['compare'], e))
+        results = benchmarks.run(iterations=options['iterations'], only=options['only'], cold=options['cold'],
+                                 seed=options['seed'],
+                                 progress=self.progress if int(options.get('verbosity', 1)) > 0 else None)
+        output = simplejson.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                stream.write(output + '\n')
+        else:
+            self.stdout.write(output + '\n')
+        if baseline:
+            rows = benchmarks.compare(baseline, results, options['threshold'] / 100.0)
+            sys.stderr.write('\n%-28s %11s %11s %8s %9s\n' % ('case', 'before p50', 'after p50', 'change', 'queries'))
+            for name, before, after, change, queries_before, queries_after, regression in rows:
+                sys.stderr.write('%-28s %8.2f ms %8.2f ms %+7.0f%% %4d->%-4d%s\n' % (
+                    name, before, after, change * 100, queries_before, queries_after,
+                    '  REGRESSION' if regression else ''))
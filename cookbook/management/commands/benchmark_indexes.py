@@ -0,0 +1,197 @@
+import os
+import random
+import tempfile
+import time
+from optparse import make_option
+
+from django.core.management import call_command
+from django.core.management.base import NoArgsCommand
+from django.db import connections, transaction
+
+from cookbook import indexes
+from cookbook.models import Ingredient, Recipe, RecipeStep
+
+ALIAS = 'index_benchmark'
+WORDS = ('risotto', 'tajarin', 'bagna', 'polenta', 'brasato', 'vitello', 'agnolotti', 'bollito', 'fritto',
+         'panna', 'torta', 'zuppa', 'insalata', 'frittata', 'crostata', 'salsa', 'minestra', 'arrosto')
+
+
+def recipe_rows(count, categories, authors, steps, seed):
+    rng = random.Random(seed)
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    values = {
+        'is_published': lambda i: rng.random() < 0.9,
+        'created': lambda i: now,
+        'updated': lambda i: now,
+        'title': lambda i: u'%s %s %d' % (rng.choice(WORDS), rng.choice(WORDS), i),
+        'difficulty': lambda i: rng.randint(1, 3),
+        'category_id': lambda i: rng.randint(1, categories),
+        'is_for_vegan': lambda i: rng.random() < 0.05,
+        'is_for_vegetarian': lambda i: rng.random() < 0.2,
+        'country_id': lambda i: 1,
+        'author_id': lambda i: rng.randint(1, authors),
+        'fork_origin_id': lambda i: rng.randint(1, i - 1) if i > 1 and rng.random() < 0.1 else None,
+        'forks_count': lambda i: 0,
+        #the steps of child_rows last 5 minutes
+        'total_duration': lambda i: steps * 5,
+        'tags': lambda i: u'',
+    }
+    fields = [field.attname for field in Recipe._meta.fields if field.attname != 'id']
+    for i in xrange(1, count + 1):
+        yield [i] + [values[name](i) if name in values else None for name in fields]
+
+
+def child_rows(model, recipes, per_recipe, seed):
+    rng = random.Random(seed)
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    values = {
+        'is_published': lambda recipe_id, order: True,
+        'created': lambda recipe_id, order: now,
+        'updated': lambda recipe_id, order: now,
+        'recipe_id': lambda recipe_id, order: recipe_id,
+        'order': lambda recipe_id, order: order,
+        'text': lambda recipe_id, order: u'Step %d' % order,
+        'duration': lambda recipe_id, order: 5,
+        'quantity': lambda recipe_id, order: rng.randint(1, 500),
+        'food_id': lambda recipe_id, order: rng.randint(1, 1000),
+    }
+    fields = [field.attname for field in model._meta.fields if field.attname != 'id']
+    #children are not inserted recipe by recipe, like in a real database
+    recipe_ids = range(1, recipes + 1)
+    rng.shuffle(recipe_ids)
+    for order in range(per_recipe):
+        for recipe_id in recipe_ids:
+            yield [None] + [values[name](recipe_id, order) if name in values else None for name in fields]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+class Command(NoArgsCommand):
+    """
+    Measures the composite indexes of cookbook.indexes on a generated SQLite
+    database (1M recipes by default, a few minutes to build): the query plans
+    and latencies of the hot queries are shown without and with the indexes.
+    The database is deleted at the end unless --database is given, in which
+    case it is reused by the following runs
+    """
+    help = 'Benchmarks the composite indexes on a generated SQLite database'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--database', dest='database', help='SQLite file to build (or reuse)'),
+        make_option('--recipes', dest='recipes', type='int', default=1000000, help='Number of recipes'),
+        make_option('--steps', dest='steps', type='int', default=3, help='Steps per recipe'),
+        make_option('--ingredients', dest='ingredients', type='int', default=4, help='Ingredients per recipe'),
+        make_option('--categories', dest='categories', type='int', default=50, help='Number of categories'),
+        make_option('--samples', dest='samples', type='int', default=50, help='Runs of each query'),
+        make_option('--seed', dest='seed', type='int', default=42, help='Random seed'),
+    )
+
+    def queries(self, category_ids, recipe_ids):
+        """
+        Returns the (name, [querysets]) benchmarked, one queryset per sample
+        """
+        return (
+            ('published recipes', [Recipe.pub_objects.db_manager(ALIAS).all()[:20]] * len(recipe_ids)),
+            ('vegan recipes', [Recipe.veg_objects.db_manager(ALIAS).vegan_friendly()[:20]] * len(recipe_ids)),
+            ('vegetarian recipes',
+             [Recipe.veg_objects.db_manager(ALIAS).vegetarian_friendly()[:20]] * len(recipe_ids)),
+            ('published of a category', [Recipe.pub_objects.db_manager(ALIAS).filter(category=category_id)[:20]
+                                         for category_id in category_ids]),
+            ('steps of a recipe', [RecipeStep.objects.db_manager(ALIAS).filter(recipe=recipe_id)
+                                   for recipe_id in recipe_ids]),
+            #without the food and unit joins of IngredientManager: those tables are empty here
+            ('ingredients of a recipe', [Ingredient.objects.db_manager(ALIAS).filter(recipe=recipe_id).values_list(
+                'id', 'food', 'unit', 'quantity') for recipe_id in recipe_ids]),
+        )
+
+    def measure(self, category_ids, recipe_ids):
+        cursor = connections[ALIAS].cursor()
+        cursor.execute('ANALYZE')
+        results = []
+        for name, querysets in self.queries(category_ids, recipe_ids):
+            sql, params = querysets[0].query.get_compiler(ALIAS).as_sql()
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+            timings = []
+            for queryset in querysets:
+                start = time.time()
+                list(queryset._clone())
+                timings.append((time.time() - start) * 1000)
+            results.append((name, median(timings), plan))
+        return results
+
+    def insert(self, model, rows, batch_size=10000):
+        connection = connections[ALIAS]
+        columns = [connection.ops.quote_name(field.column) for field in model._meta.fields]
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (connection.ops.quote_name(model._meta.db_table),
+                                                   ', '.join(columns), ', '.join(['%s'] * len(columns)))
+        cursor = connection.cursor()
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+        transaction.commit_unless_managed(using=ALIAS)
+
+    def build(self, options):
+        connection = connections[ALIAS]
+        call_command('syncdb', database=ALIAS, interactive=False, verbosity=0)
+        cursor = connection.cursor()
+        cursor.execute('SELECT COUNT(*) FROM %s' % connection.ops.quote_name(Recipe._meta.db_table))
+        if cursor.fetchone()[0]:
+            return
+        #faster bulk inserts, the database is disposable
+        cursor.execute('PRAGMA journal_mode = OFF')
+        cursor.execute('PRAGMA synchronous = OFF')
+        indexes.drop_indexes(ALIAS)
+        start = time.time()
+        self.insert(Recipe, recipe_rows(options['recipes'], options['categories'], max(options['recipes'] // 100, 1),
+                                        options['steps'], options['seed']))
+        self.insert(RecipeStep, child_rows(RecipeStep, options['recipes'], options['steps'], options['seed']))
+        self.insert(Ingredient, child_rows(Ingredient, options['recipes'], options['ingredients'], options['seed']))
+        self.stdout.write('%d recipes generated in %.1f s\n' % (options['recipes'], time.time() - start))
+
+    def report(self, title, results):
+        self.stdout.write('\n%s\n' % title)
+        for name, elapsed, plan in results:
+            self.stdout.write('%-26s %9.3f ms\n' % (name, elapsed))
+            for line in plan:
+                self.stdout.write('    %s\n' % line)
+
+    def handle_noargs(self, **options):
+        path = options.get('database')
+        temporary = not path
+        if temporary:
+            handle, path = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(handle)
+        connections.databases[ALIAS] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+        try:
+            self.build(options)
+            rng = random.Random(options['seed'])
+            category_ids = [rng.randint(1, options['categories']) for i in range(options['samples'])]
+            recipe_ids = [rng.randint(1, options['recipes']) for i in range(options['samples'])]
+            indexes.drop_indexes(ALIAS)
+            before = self.measure(category_ids, recipe_ids)
+            start = time.time()
+            indexes.create_indexes(ALIAS)
+            created = time.time() - start
+            after = self.measure(category_ids, recipe_ids)
+            self.report('Without the composite indexes', before)
+            self.report('With the composite indexes (created in %.1f s)' % created, after)
+            self.stdout.write('\n%-26s %12s %12s %8s\n' % ('query (median)', 'before', 'after', 'speedup'))
+            for (name, elapsed_before, plan), (name, elapsed_after, plan) in zip(before, after):
+                self.stdout.write('%-26s %9.3f ms %9.3f ms %7.1fx\n' % (
+                    name, elapsed_before, elapsed_after, elapsed_before / elapsed_after if elapsed_after else 0))
+        finally:
+            connections[ALIAS].close()
+            #the benchmark database (without a rollback journal) is not left among the connections
+            del connections.databases[ALIAS]
+            delattr(connections._connections, ALIAS)
+            if temporary:
+                os.remove(path)
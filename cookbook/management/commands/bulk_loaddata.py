@@ -0,0 +1,42 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from geo.models import AdministrativeArea, Country, Location
+
+from cookbook import bulkload, caching, catalog
+
+
+class Command(BaseCommand):
+    """
+    Loads big JSON fixtures with a streaming parser and bulk inserts
+    (see cookbook.bulkload), e.g. the geo fixtures:
+    manage.py bulk_loaddata countries italy_full
+    """
+    args = 'fixture [fixture ...]'
+    help = 'Loads JSON fixtures in bulk, skipping the rows already in the database'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='Number of rows inserted at once'),
+    )
+
+    def handle(self, *fixtures, **options):
+        if not fixtures:
+            raise CommandError('Enter at least one fixture')
+        for fixture in fixtures:
+            start = time.time()
+            try:
+                read, inserted, loaded = bulkload.load_fixture(bulkload.find_fixture(fixture),
+                                                               batch_size=options['batch_size'])
+            except ValueError as e:
+                raise CommandError('%s: %s' % (fixture, e))
+            elapsed = time.time() - start
+            if loaded & set([Location, AdministrativeArea, Country]):
+                #no signal is sent by the bulk loader
+                caching.bump_version('geo')
+            if loaded & set(catalog.MODELS):
+                caching.bump_version('catalog')
+            self.stdout.write('%s: %d rows read, %d inserted in %.1f s (%.0f rows/s)\n' % (
+                fixture, read, inserted, elapsed, read / elapsed if elapsed else 0))
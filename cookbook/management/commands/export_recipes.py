@@ -0,0 +1,55 @@
+import gzip
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+
+from cookbook import exchange
+from cookbook.models import Recipe
+
+
+class Command(NoArgsCommand):
+    """
+    Exports the recipes as JSON Lines (see cookbook.exchange), streaming them
+    to a file (gzipped when its name ends with .gz) or to the standard output:
+    manage.py export_recipes --output recipes.jsonl.gz
+    """
+    help = 'Exports the recipes with their steps, ingredients, wines and tags as JSON Lines'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--output', dest='output', help='File to write (default: standard output)'),
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='Number of recipes read at once'),
+        make_option('--published', dest='published', action='store_true', default=False,
+                    help='Export the published recipes only'),
+    )
+
+    def handle_noargs(self, **options):
+        queryset = Recipe.pub_objects.all() if options['published'] else Recipe.objects.all()
+        output = options.get('output')
+        if not output:
+            stream = sys.stdout
+        elif output.endswith('.gz'):
+            stream = gzip.open(output, 'wb')
+        else:
+            stream = open(output, 'wb')
+        start = time.time()
+
+        def progress(count):
+            if int(options.get('verbosity', 1)) >= 2:
+                self.stderr.write('%d recipes exported\n' % count)
+
+        #with DEBUG the queries would be recorded: memory must stay flat
+        old_debug_cursor, connection.use_debug_cursor = connection.use_debug_cursor, False
+        try:
+            count = exchange.export_recipes(stream, queryset, batch_size=options['batch_size'], progress=progress)
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+            if output:
+                stream.close()
+        elapsed = time.time() - start
+        #the standard output can be the export itself
+        self.stderr.write('%d recipes exported in %.1f s (%.0f recipes/s)\n' % (
+            count, elapsed, count / elapsed if elapsed else 0))
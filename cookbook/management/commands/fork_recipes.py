@@ -0,0 +1,39 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from cookbook import forking
+
+
+class Command(BaseCommand):
+    """
+    Forks one or more recipes for a given user, in a single transaction
+    """
+    args = '<recipe_id recipe_id ...>'
+    help = 'Forks the given recipes (with steps, ingredients, wines and tags) for a user'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--author', dest='author', help='Username of the author owning the forks'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Enter at least one recipe id')
+        if not options.get('author'):
+            raise CommandError('The --author option is required')
+        try:
+            author = User.objects.get(username=options['author'])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist' % options['author'])
+        try:
+            ids = [int(arg) for arg in args]
+        except ValueError:
+            raise CommandError('Recipe ids must be integers')
+
+        forks = forking.fork_recipes(ids, author)
+        for origin_id in ids:
+            if origin_id in forks:
+                self.stdout.write('Recipe %d forked as %d\n' % (origin_id, forks[origin_id].id))
+            else:
+                self.stderr.write('Recipe %d does not exist\n' % origin_id)
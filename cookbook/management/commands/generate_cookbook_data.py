@@ -0,0 +1,41 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from cookbook.datagen import DataGenerator
+
+
+class Command(NoArgsCommand):
+    """
+    Generates a synthetic cookbook (see cookbook.datagen), e.g. for the
+    benchmark_cookbook command: manage.py generate_cookbook_data --recipes 100000
+    Generated rows are added to the existing ones
+    """
+    help = 'Generates categories, foods, wines, authors and recipes with steps, ingredients and forks'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--recipes', dest='recipes', type='int', default=10000, help='Number of recipes'),
+        make_option('--steps', dest='steps', type='int', default=3, help='Steps per recipe'),
+        make_option('--ingredients', dest='ingredients', type='int', default=5, help='Ingredients per recipe'),
+        make_option('--categories', dest='categories', type='int', default=50, help='Number of categories'),
+        make_option('--foods', dest='foods', type='int', default=1000, help='Number of foods'),
+        make_option('--wines', dest='wines', type='int', default=500, help='Number of wines'),
+        make_option('--authors', dest='authors', type='int', help='Number of authors (default: recipes / 50)'),
+        make_option('--fork-ratio', dest='fork_ratio', type='float', default=0.1,
+                    help='Fraction of the recipes being forks'),
+        make_option('--seed', dest='seed', type='int', default=42, help='Random seed'),
+        make_option('--database', dest='database', default='default', help='Database to fill'),
+    )
+
+    def handle_noargs(self, **options):
+        start = time.time()
+        generator = DataGenerator(seed=options['seed'], using=options['database'])
+        counts = generator.generate(options['recipes'], steps=options['steps'], ingredients=options['ingredients'],
+                                    categories=options['categories'], foods=options['foods'],
+                                    wines=options['wines'], authors=options['authors'],
+                                    fork_ratio=options['fork_ratio'])
+        for name, count in sorted(counts.items()):
+            self.stdout.write('%-22s %9d rows\n' % (name, count))
+        self.stdout.write('Generated in %.1f s; run reindex_recipes and rebuild_wine_pairings to '
+                          'index the new recipes\n' % (time.time() - start))
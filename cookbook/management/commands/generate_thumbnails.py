@@ -0,0 +1,46 @@
+import multiprocessing
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from cookbook import thumbnails
+
+
+class Command(NoArgsCommand):
+    """
+    Generates the missing thumbnails (see cookbook.thumbnails) of all the
+    recipe, step and wine images with a pool of processes, e.g. after
+    changing THUMBNAIL_ALIASES or loading images in bulk. With --pending,
+    only those of the images queued since the last run, e.g. every minute:
+    manage.py generate_thumbnails --pending
+    """
+    help = 'Generates the missing thumbnails of the recipe, step and wine images'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=multiprocessing.cpu_count(),
+                    help='Processes generating the thumbnails (0: none, in this process)'),
+        make_option('--pending', action='store_true', dest='pending', default=False,
+                    help='Only the images queued when attached or rendered (1000 at most)'),
+    )
+
+    def handle_noargs(self, **options):
+        start = time.time()
+        tasks = thumbnails.take_pending() if options['pending'] else thumbnails.images_to_backfill()
+        if options['workers']:
+            pool = multiprocessing.Pool(options['workers'], initializer=thumbnails.init_worker)
+            results = pool.imap_unordered(thumbnails.generate_task, tasks, chunksize=10)
+        else:
+            pool, results = None, (thumbnails.generate_task(task) for task in tasks)
+        generated = 0
+        try:
+            for count, image_generated in enumerate(results, 1):
+                generated += image_generated
+                if count % 100 == 0 and int(options.get('verbosity', 1)) > 1:
+                    self.stdout.write('%d/%d images\n' % (count, len(tasks)))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.stdout.write('%d thumbnails of %d images generated in %.1f s\n' % (generated, len(tasks),
+                                                                              time.time() - start))
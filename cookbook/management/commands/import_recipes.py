@@ -0,0 +1,57 @@
+import gzip
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from cookbook import exchange
+
+
+class Command(BaseCommand):
+    """
+    Imports recipes exported by export_recipes (see cookbook.exchange),
+    in bulk and in a single transaction:
+    manage.py import_recipes recipes.jsonl.gz --workers 4
+    """
+    args = 'file'
+    help = 'Imports JSON Lines recipes with their steps, ingredients, wines and tags'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='Number of recipes inserted at once'),
+        make_option('--workers', dest='workers', type='int',
+                    help='Number of parsing processes (default: DJANGO_CUISINE_IMPORT_WORKERS, 0: none)'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Enter the file to import')
+        path = args[0]
+        start = time.time()
+
+        def progress(counts):
+            if int(options.get('verbosity', 1)) >= 2:
+                elapsed = time.time() - start
+                self.stdout.write('%d recipes imported (%.0f recipes/s)\n' % (
+                    counts['recipes'], counts['recipes'] / elapsed if elapsed else 0))
+
+        try:
+            stream = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+        except IOError as e:
+            raise CommandError(e)
+        #with DEBUG the queries would be recorded: memory must stay flat
+        old_debug_cursor, connection.use_debug_cursor = connection.use_debug_cursor, False
+        try:
+            counts = exchange.import_recipes(stream, batch_size=options['batch_size'], workers=options['workers'],
+                                             progress=progress)
+        except ValueError as e:
+            raise CommandError('%s: %s' % (path, e))
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+            stream.close()
+        elapsed = time.time() - start
+        for name, count in sorted(counts.items()):
+            self.stdout.write('%-14s %9d\n' % (name, count))
+        self.stdout.write('%d recipes imported in %.1f s (%.0f recipes/s)\n' % (
+            counts.get('recipes', 0), elapsed, counts.get('recipes', 0) / elapsed if elapsed else 0))
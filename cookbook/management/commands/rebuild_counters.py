@@ -0,0 +1,15 @@
+from django.core.management.base import NoArgsCommand
+
+from cookbook import counters
+
+
+class Command(NoArgsCommand):
+    """
+    Rebuilds the denormalized forks, author, tag and duration counters from scratch
+    """
+    help = ('Recomputes Recipe.forks_count, AuthorStats.recipes_count, TagStats.items_count '
+            'and Recipe.total_duration')
+
+    def handle_noargs(self, **options):
+        counters.rebuild_counters()
+        self.stdout.write('Counters rebuilt\n')
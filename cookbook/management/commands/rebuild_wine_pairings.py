@@ -0,0 +1,31 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from cookbook import pairing
+
+
+class Command(NoArgsCommand):
+    """
+    Recomputes the wine pairings of all the recipes, categories and areas
+    """
+    help = 'Recomputes all the precomputed recipe/wine pairings'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='Number of recipes scored per transaction'),
+    )
+
+    def handle_noargs(self, **options):
+        if not pairing.is_available():
+            raise CommandError('The wine pairing engine needs NumPy')
+        verbosity = int(options.get('verbosity', 1))
+        start = time.time()
+        done = 0
+        for done in pairing.rebuild_all(batch_size=options['batch_size']):
+            if verbosity > 1:
+                self.stdout.write('%d recipes scored\n' % done)
+        elapsed = time.time() - start
+        self.stdout.write('%d recipes scored in %.1f s (%.0f recipes/s)\n' % (
+            done, elapsed, done / elapsed if elapsed else 0))
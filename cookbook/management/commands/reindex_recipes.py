@@ -0,0 +1,29 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from cookbook import search
+
+
+class Command(NoArgsCommand):
+    """
+    Rebuilds the recipe search index from scratch
+    """
+    help = 'Rebuilds the recipe full-text search index'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='Number of recipes indexed per transaction'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        start = time.time()
+        done = 0
+        for done in search.reindex_all(batch_size=options['batch_size']):
+            if verbosity > 1:
+                self.stdout.write('%d recipes indexed\n' % done)
+        elapsed = time.time() - start
+        self.stdout.write('%d recipes indexed with the %s in %.1f s (%.0f recipes/s)\n' % (
+            done, search.get_backend().__class__.__name__, elapsed, done / elapsed if elapsed else 0))
@@ -1,10 +1,118 @@
 __author__ = 'Luca'
 
-from django.db import models
+import datetime
+import itertools
+
+from django.db import connections, models, transaction
 from django.db.models import Q
+from django.db.models.query import QuerySet
+from mptt.managers import TreeManager
+
+
+class GenericBaseQuerySet(QuerySet):
+    """
+    This queryset keeps the created/updated timestamps of the
+    GenericBaseModel subclasses right in bulk operations
+    """
+    _with_history = False
+    _history_limit = None
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault('_with_history', self._with_history)
+        kwargs.setdefault('_history_limit', self._history_limit)
+        return super(GenericBaseQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def bulk_create(self, objs, batch_size=None, timestamps=True):
+        """
+        This method is QuerySet.bulk_create, giving all the new objects
+        the same created and updated timestamp, as save() would do.
+        With timestamps=False the timestamps of the objects are kept
+        """
+        objs = list(objs)
+        if timestamps:
+            now = datetime.datetime.now()
+            for obj in objs:
+                obj.created = obj.updated = now
+        return super(GenericBaseQuerySet, self).bulk_create(objs, batch_size=batch_size)
+
+    def bulk_update(self, objs, fields, batch_size=500):
+        """
+        This method saves the given fields of objs, and their updated
+        timestamp, with one UPDATE statement executed for all of them
+        (executemany), batch_size at a time. Objects are matched by
+        primary key and no signal is sent, like bulk_create
+        """
+        objs = list(objs)
+        if not objs:
+            return 0
+        now = datetime.datetime.now()
+        meta = self.model._meta
+        fields = [meta.get_field(name) for name in fields if name != 'updated'] + [meta.get_field('updated')]
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        sql = 'UPDATE %s SET %s WHERE %s = %%s' % (qn(meta.db_table),
+                                                  ', '.join('%s = %%s' % qn(field.column) for field in fields),
+                                                  qn(meta.pk.column))
+        rows = []
+        for obj in objs:
+            obj.updated = now
+            rows.append([field.get_db_prep_save(getattr(obj, field.attname), connection=connection)
+                         for field in fields] + [meta.pk.get_db_prep_value(obj.pk, connection=connection)])
+        cursor = connection.cursor()
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, rows[start:start + batch_size])
+        transaction.commit_unless_managed(using=self.db)
+        return len(rows)
+
+    def touch(self, **kwargs):
+        """
+        This method is update(), setting the updated timestamp too
+        """
+        kwargs.setdefault('updated', datetime.datetime.now())
+        return self.update(**kwargs)
+
+    def with_history(self, limit=None):
+        """
+        This method loads the edit history (LogEntry rows, at most limit
+        per object) of the objects as they are fetched, with one query
+        per 100 objects instead of one per object (see cookbook.history)
+        """
+        return self._clone(_history_limit=limit, _with_history=True)
 
+    def iterator(self):
+        rows = super(GenericBaseQuerySet, self).iterator()
+        if not self._with_history:
+            for row in rows:
+                yield row
+            return
+        from cookbook import history
+        while True:
+            chunk = list(itertools.islice(rows, 100))
+            if not chunk:
+                return
+            for row in history.attach_history(chunk, self._history_limit):
+                yield row
 
-class PublishedManager(models.Manager):
+
+class GenericBaseManager(models.Manager):
+    """
+    This manager returns GenericBaseQuerySet instances
+    """
+
+    def get_query_set(self):
+        return GenericBaseQuerySet(self.model, using=self._db)
+
+    def bulk_update(self, *args, **kwargs):
+        return self.get_query_set().bulk_update(*args, **kwargs)
+
+    def touch(self, **kwargs):
+        return self.get_query_set().touch(**kwargs)
+
+    def with_history(self, limit=None):
+        return self.get_query_set().with_history(limit)
+
+
+class PublishedManager(GenericBaseManager):
     """
     This manager implements the get_query_set() method
     and  filters only the published 'contents'
@@ -19,7 +127,7 @@ class PublishedManager(models.Manager):
         return super(PublishedManager, self).get_query_set().filter(is_published=True)
 
 
-class VegManager(models.Manager):
+class VegManager(GenericBaseManager):
     """
     This manager implements the get_query_set() method
     and  filters only the published 'contents'
@@ -48,3 +156,103 @@ class VegManager(models.Manager):
         """
         return super(VegManager, self).get_query_set().filter(is_published=True, is_for_vegetarian=True)
 
+
+class IngredientManager(GenericBaseManager):
+    """
+    This manager preloads the unit and the food of the ingredients:
+    displaying an ingredient (see Ingredient.__unicode__) needs both
+    """
+
+    def get_query_set(self):
+        return super(IngredientManager, self).get_query_set().select_related('unit', 'food')
+
+
+class CategoryManager(TreeManager, GenericBaseManager):
+    """
+    This manager handles the Category tree (nested sets).
+    Each method runs a single query, whatever the depth of the tree.
+    Its querysets are GenericBaseQuerySet instances, in tree order
+    """
+
+    def descendants(self, category, include_self=True):
+        """
+        This method retrieves the subtree rooted in category, in tree order
+        """
+        return category.get_descendants(include_self=include_self)
+
+    def ancestors(self, category, include_self=False):
+        """
+        This method retrieves the ancestors of category, from the root down
+        """
+        return category.get_ancestors(include_self=include_self)
+
+    def breadcrumbs(self, category):
+        """
+        This method retrieves the path from the root to category (included)
+        as a list, ready to be rendered as breadcrumbs
+        """
+        return list(self.ancestors(category, include_self=True))
+
+
+class RecipeQuerySet(GenericBaseQuerySet):
+    """
+    This queryset adds recipe specific filters
+    """
+
+    def in_category_subtree(self, category):
+        """
+        This method filters the recipes in category or in any of its
+        subcategories, using the nested set bounds of category (no tree walk)
+        """
+        return self.filter(category__tree_id=category.tree_id,
+                           category__lft__gte=category.lft,
+                           category__lft__lte=category.rght)
+
+    def with_details(self):
+        """
+        This method preloads everything a recipe page shows: category,
+        country, area, author and image are joined, steps, ingredients
+        (with their unit and food) and suggested wines take one query each
+        """
+        return self.select_related('category', 'country', 'area', 'author', 'image').prefetch_related(
+            'recipestep_set', 'ingredient_set', 'suggested_wine')
+
+
+class RecipeManager(GenericBaseManager):
+    """
+    This manager returns RecipeQuerySet instances
+    """
+
+    def get_query_set(self):
+        return RecipeQuerySet(self.model, using=self._db)
+
+    def in_category_subtree(self, category):
+        return self.get_query_set().in_category_subtree(category)
+
+    def with_details(self):
+        return self.get_query_set().with_details()
+
+    def get_detail(self, recipe_id):
+        """
+        This method retrieves a recipe with all its details in four queries
+        """
+        return self.with_details().get(id=recipe_id)
+
+    def cookable_with(self, food_ids, min_coverage=1.0, limit=20):
+        """
+        This method retrieves the published recipes covered by the given foods
+        (see cookbook.pantry), best coverage first.
+        Each recipe gets the coverage and missing_food_ids attributes
+        """
+        from cookbook import pantry
+        matches = pantry.cookable_with(food_ids, min_coverage, limit)
+        recipes = self.get_query_set().select_related('category', 'country', 'author').in_bulk(
+            [recipe_id for recipe_id, coverage, missing in matches])
+        result = []
+        for recipe_id, coverage, missing in matches:
+            if recipe_id in recipes:
+                recipes[recipe_id].coverage = coverage
+                recipes[recipe_id].missing_food_ids = missing
+                result.append(recipes[recipe_id])
+        return result
+
@@ -2,14 +2,17 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
-from django.contrib.admin.models import LogEntry
 from django.contrib.contenttypes.models import ContentType
 import datetime
 from filer.fields import image
+from mptt.models import MPTTModel, TreeForeignKey
 
 from geo.models import AdministrativeArea, Country, Location
 from tagging.fields import TagField
-from managers import VegManager, PublishedManager
+from tagging.models import Tag
+from managers import VegManager, PublishedManager, CategoryManager, IngredientManager, RecipeManager
+from managers import GenericBaseManager
+import cookbook_settings
 
 #Some choices here
 DIFFICULTY_CHOICES = ((1, _(u'Very Easy')),
@@ -19,10 +22,19 @@ DIFFICULTY_CHOICES = ((1, _(u'Very Easy')),
                       (5, _(u'Very Difficult')),)
 
 #unit type, for Weight, Volume or other....
-UNIT_TYPE = ((1, _(u'Weight')),
-             (2, _(u'Volume')),
+WEIGHT = 1
+VOLUME = 2
+UNIT_TYPE = ((WEIGHT, _(u'Weight')),
+             (VOLUME, _(u'Volume')),
              (3, _(u'Other')),)
 
+#unit system, the target of unit conversions (see cookbook.units)
+METRIC = 1
+IMPERIAL = 2
+UNIT_SYSTEM = ((METRIC, _(u'Metric')),
+               (IMPERIAL, _(u'Imperial')),
+               (3, _(u'Other')),)
+
 WINE_KIND_LIST = ((1, _(u'Red')),
                  (2, _(u'White')),
                  (3, _(u'Rosè')),
@@ -46,6 +58,19 @@ WINE_TRADITIONAL_TYPES = ((DOCG, _(u'DOCG')),
                          (IGT, _(u'IGT')),
                          (TR_OTHER, _(u'Other')),)
 
+
+class DenormalizedIntegerField(models.PositiveIntegerField):
+    """
+    A denormalized column, maintained with UPDATE statements (see
+    cookbook.counters): saving an existing object keeps the stored value
+    instead of writing the in-memory one, which may be stale
+    """
+
+    def pre_save(self, model_instance, add):
+        if add:
+            return super(DenormalizedIntegerField, self).pre_save(model_instance, add)
+        return models.F(self.attname)
+
 class GenericBaseModel(models.Model):
     """
     GenericBaseModel class - inherits from models.Model
@@ -55,9 +80,9 @@ class GenericBaseModel(models.Model):
     applications
     """
     is_published = models.BooleanField(blank=True, default=True, verbose_name=_(u'Published'))
-    created = models.DateTimeField(verbose_name=_(u'Creation Date'), default=datetime.datetime.now(), editable=False)
-    updated = models.DateTimeField(verbose_name=_(u'Modify Date'), default=datetime.datetime.now(), editable=False)
-    objects = models.Manager()
+    created = models.DateTimeField(verbose_name=_(u'Creation Date'), default=datetime.datetime.now, editable=False)
+    updated = models.DateTimeField(verbose_name=_(u'Modify Date'), default=datetime.datetime.now, editable=False)
+    objects = GenericBaseManager()
     pub_objects = PublishedManager()
 
     class Meta:
@@ -74,14 +99,14 @@ class GenericBaseModel(models.Model):
 
     def get_history(self):
         """
-        This method retrieves the history for this object searching in LogEntry Table
+        This method retrieves the history for this object searching in LogEntry Table,
+        newest first; objects fetched with with_history() (or given to
+        cookbook.history.attach_history) have it preloaded
         """
-        lst = []
-        try:
-            lst = LogEntry.objects.filter(content_type=ContentType.objects.get_for_model(self).id, object_id=self.pk)
-        except LogEntry.DoesNotExist:
-            pass
-        return lst
+        if hasattr(self, '_history_cache'):
+            return self._history_cache
+        from cookbook import history
+        return history.entries(self)
 
     def _get_creation_date(self):
         """
@@ -100,13 +125,19 @@ class GenericBaseModel(models.Model):
     modify_date = property(_get_modify_date)
 
 
-class Category(GenericBaseModel):
+class Category(MPTTModel, GenericBaseModel):
     """
-    Category class - inherits from GenericBaseModel
+    Category class - inherits from MPTTModel and GenericBaseModel
+    Categories are a tree stored as nested sets (django-mptt), so that
+    descendants and ancestors of a category are read with a single query
     """
     name = models.CharField(verbose_name=_(u'Category'), max_length=60, blank=True, null=True)
-    parent = models.ForeignKey('self', verbose_name=_(u'Parent'))
+    parent = TreeForeignKey('self', verbose_name=_(u'Parent'), blank=True, null=True)
     order = models.IntegerField(verbose_name=_(u'Order'), blank=True, null=True)
+    objects = CategoryManager()
+
+    def __unicode__(self):
+        return self.name or u''
 
     class Meta:
         ordering = ['name']
@@ -182,15 +213,38 @@ class Recipe(GenericBaseModel):
                                             blank=True)
     author = models.ForeignKey(User, verbose_name=_(u'Author'))
     fork_origin = models.ForeignKey('self', verbose_name=_(u'Fork Origin'), blank=True, null=True)
+    #denormalized counter, maintained by cookbook.counters
+    forks_count = DenormalizedIntegerField(verbose_name=_(u'Forks'), default=0, editable=False)
+    #sum of the step durations, maintained by cookbook.counters
+    total_duration = DenormalizedIntegerField(verbose_name=_(u'Total Duration (min.)'), default=0, editable=False)
     #Use django-tagging application here
     tags = TagField()
-    objects = models.Manager()
+    objects = RecipeManager()
     pub_objects = PublishedManager()
     veg_objects = VegManager()
 
     def __unicode__(self):
         return self.title
 
+    def scaled_ingredients(self, multiplier=1.0, system=None):
+        """
+        Returns the ingredient quantities of the recipe multiplied by multiplier
+        and, if a unit system is given, converted to it (see cookbook.units)
+        """
+        from cookbook import units
+        return units.scale_recipes([self.id], multiplier, system)[self.id]
+
+    def recommended_wines(self, limit=None):
+        """
+        Returns the best wines for the recipe, precomputed by cookbook.pairing.
+        The wines of the recipe category are used until the recipe is scored
+        """
+        limit = limit or cookbook_settings.DJANGO_CUISINE_WINE_PAIRINGS
+        wines = list(Wine.objects.filter(pairings__recipe=self).order_by('pairings__rank')[:limit])
+        if not wines:
+            wines = list(Wine.objects.filter(pairings__category=self.category_id).order_by('pairings__rank')[:limit])
+        return wines
+
     class Meta:
         ordering = ['title']
 
@@ -223,6 +277,10 @@ class Unit(models.Model):
     unit_name = models.CharField(max_length=60, verbose_name=_(u'Unit Name'))
     code = models.CharField(verbose_name=_(u'Abbreviation Code'), max_length=60, blank=True, null=True)
     type = models.IntegerField(verbose_name=_(u'Unit Type'), choices=UNIT_TYPE)
+    system = models.IntegerField(verbose_name=_(u'Unit System'), choices=UNIT_SYSTEM, default=3)
+    #quantity of the base unit of the type (gram or millilitre) in one unit
+    factor = models.FloatField(verbose_name=_(u'Conversion Factor'), blank=True, null=True,
+                               help_text=_(u'Grams (for weights) or millilitres (for volumes) in one unit'))
 
     def __unicode__(self):
         return self.unit_name
@@ -267,15 +325,111 @@ class Ingredient(GenericBaseModel):
     recipe = models.ForeignKey(Recipe, verbose_name=_(u'Recipe'))
     food = models.ForeignKey(Food, verbose_name=_(u'Food'))
     order = models.PositiveIntegerField(verbose_name=_(u'Order'), blank=True, null=True)
+    objects = IngredientManager()
 
     def __init__(self, *args, **kwargs):
         super(Ingredient, self).__init__(*args, **kwargs)
 
     def __unicode__(self):
+        #unit and food are read from the catalog snapshot unless they are already loaded
+        from cookbook import catalog
         q = str(int(self.quantity) if self.quantity == int(self.quantity) else self.quantity)
-        unit = str(self.unit.unit_name if None != self.unit else '')
-        food = str(self.food).lower()
+        unit = str(catalog.related(self, 'unit').unit_name if None != self.unit_id else '')
+        food = str(catalog.related(self, 'food')).lower()
         return "%s %s %s" % (q, unit, food)
 
     class Meta:
         ordering = ['order', 'id']
+
+
+class RecipeSearchTerm(models.Model):
+    """
+    RecipeSearchTerm class - inherits from models.Model
+    This class is the inverted index used by the pure-Python search
+    backend (see cookbook.search): the weighted frequency of a term in a recipe
+    """
+    term = models.CharField(max_length=60, verbose_name=_(u'Term'), db_index=True)
+    recipe = models.ForeignKey(Recipe, verbose_name=_(u'Recipe'), related_name='search_terms')
+    weight = models.FloatField(verbose_name=_(u'Weight'), default=0)
+
+    def __unicode__(self):
+        return self.term
+
+
+class AuthorStats(models.Model):
+    """
+    AuthorStats class - inherits from models.Model
+    This class stores denormalized counters for a recipe author,
+    maintained by cookbook.counters
+    """
+    user = models.OneToOneField(User, verbose_name=_(u'Author'), related_name='cookbook_stats')
+    recipes_count = models.PositiveIntegerField(verbose_name=_(u'Recipes'), default=0)
+
+    def __unicode__(self):
+        return u'%s (%d)' % (self.user, self.recipes_count)
+
+    class Meta:
+        verbose_name = _(u'Author Stats')
+        verbose_name_plural = _(u'Author Stats')
+
+
+class TagStats(models.Model):
+    """
+    TagStats class - inherits from models.Model
+    This class stores the denormalized number of objects of a model
+    tagged with a tag, maintained by cookbook.counters
+    """
+    tag = models.ForeignKey(Tag, verbose_name=_(u'Tag'), related_name='cookbook_stats')
+    content_type = models.ForeignKey(ContentType, verbose_name=_(u'Content type'))
+    items_count = models.PositiveIntegerField(verbose_name=_(u'Items'), default=0)
+
+    def __unicode__(self):
+        return u'%s - %s (%d)' % (self.tag, self.content_type, self.items_count)
+
+    class Meta:
+        unique_together = ('tag', 'content_type')
+        verbose_name = _(u'Tag Stats')
+        verbose_name_plural = _(u'Tag Stats')
+
+
+class WinePairing(models.Model):
+    """
+    WinePairing class - inherits from models.Model
+    This class stores the best wines for a recipe, a category or an area,
+    ranked by the pairing engine (see cookbook.pairing)
+    """
+    wine = models.ForeignKey(Wine, verbose_name=_(u'Wine'), related_name='pairings')
+    recipe = models.ForeignKey(Recipe, verbose_name=_(u'Recipe'), related_name='wine_pairings', null=True,
+                               blank=True)
+    category = models.ForeignKey(Category, verbose_name=_(u'Category'), related_name='wine_pairings', null=True,
+                                 blank=True)
+    area = models.ForeignKey(AdministrativeArea, verbose_name=_(u'Area'), related_name='wine_pairings', null=True,
+                             blank=True)
+    rank = models.PositiveIntegerField(verbose_name=_(u'Rank'))
+    score = models.FloatField(verbose_name=_(u'Score'))
+
+    def __unicode__(self):
+        return u'%s (%d)' % (self.wine, self.rank)
+
+    class Meta:
+        ordering = ['rank']
+
+
+class PendingThumbnail(models.Model):
+    """
+    PendingThumbnail class - inherits from models.Model
+    This class stores the images whose thumbnails are to be generated by
+    the generate_thumbnails command (see cookbook.thumbnails)
+    """
+    image = models.OneToOneField('filer.Image', verbose_name=_(u'Image'), related_name='cookbook_pending_thumbnail')
+    created = models.DateTimeField(verbose_name=_(u'Creation Date'), default=datetime.datetime.now)
+
+    def __unicode__(self):
+        return unicode(self.image_id)
+
+    class Meta:
+        ordering = ['id']
+
+
+#signal receivers are connected once models are defined
+import signals
@@ -0,0 +1,169 @@
+# coding=utf-8
+"""
+Keyset pagination and approximate counts.
+
+A keyset (seek) page is fetched with WHERE (ordering columns) > (last row
+seen) ... LIMIT n instead of OFFSET: the cost of a page does not depend on
+its position, and rows added or removed meanwhile do not shift pages.
+Pages are addressed by opaque cursors encoding the ordering values of the
+first or last row of the current page, so only next/previous links exist.
+"""
+import base64
+import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Q
+from django.utils import simplejson
+
+from cookbook import caching
+
+#seconds an exact count stands for an approximate one, on backends without table statistics
+COUNT_TIMEOUT = 300
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder keeping the microseconds of datetimes, which
+    DjangoJSONEncoder drops: the cursor must hold the exact values
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super(CursorEncoder, self).default(o)
+
+
+def keyset_ordering(model):
+    """
+    Returns the [(field, descending)] keyset ordering of model: its
+    Meta.ordering followed by the primary key. Orderings a keyset cannot
+    follow (related or nullable fields, random) fall back to the primary key
+    """
+    opts = model._meta
+    ordering = []
+    for name in opts.ordering:
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name == 'pk':
+            name = opts.pk.name
+        try:
+            field = opts.get_field(name)
+        except Exception:
+            return [(opts.pk, False)]
+        if field.null or field.rel:
+            return [(opts.pk, False)]
+        ordering.append((field, descending))
+    if opts.pk not in [field for field, descending in ordering]:
+        ordering.append((opts.pk, False))
+    return ordering
+
+
+class KeysetPage(object):
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+
+class KeysetPaginator(object):
+    """
+    Paginates a queryset (model instances or values() dicts) along the
+    keyset ordering of its model, per_page rows at a time
+    """
+
+    def __init__(self, queryset, per_page):
+        self.per_page = int(per_page)
+        self.ordering = keyset_ordering(queryset.model)
+        self.queryset = queryset
+
+    def encode(self, obj):
+        if isinstance(obj, dict):
+            values = [obj[field.name] for field, descending in self.ordering]
+        else:
+            values = [getattr(obj, field.attname) for field, descending in self.ordering]
+        return base64.urlsafe_b64encode(simplejson.dumps(values, cls=CursorEncoder)).rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            values = simplejson.loads(base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4)))
+            if len(values) != len(self.ordering):
+                raise ValueError('Wrong number of values')
+            return [field.to_python(value) for (field, descending), value in zip(self.ordering, values)]
+        except Exception as e:
+            raise InvalidCursor('Invalid cursor %r: %s' % (cursor, e))
+
+    def _seek(self, values, backwards):
+        #(a, b) > (x, y) is a > x OR (a = x AND b > y)
+        condition = Q()
+        for i, ((field, descending), value) in enumerate(zip(self.ordering, values)):
+            lookup = 'lt' if descending != backwards else 'gt'
+            term = Q(**{'%s__%s' % (field.name, lookup): value})
+            for previous, previous_value in zip(self.ordering[:i], values):
+                term &= Q(**{previous[0].name: previous_value})
+            condition |= term
+        return condition
+
+    def page(self, after=None, before=None):
+        """
+        Returns the page following the after cursor, or preceding the
+        before cursor, or the first page
+        """
+        backwards = before is not None and after is None
+        cursor = before if backwards else after
+        order_by = ['%s%s' % ('-' if descending != backwards else '', field.name)
+                    for field, descending in self.ordering]
+        queryset = self.queryset.order_by(*order_by)
+        if cursor is not None:
+            queryset = queryset.filter(self._seek(self.decode(cursor), backwards))
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            next_cursor = self.encode(rows[-1]) if rows else cursor
+            previous_cursor = self.encode(rows[0]) if more else None
+        else:
+            next_cursor = self.encode(rows[-1]) if more else None
+            previous_cursor = self.encode(rows[0]) if rows and cursor is not None else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+def approximate_count(model):
+    """
+    Returns the approximate number of rows of model: the planner
+    statistics on PostgreSQL and MySQL, a cached COUNT(*) otherwise
+    """
+    table = model._meta.db_table
+    vendor = connection.vendor
+    if vendor in ('postgresql', 'mysql'):
+        cursor = connection.cursor()
+        if vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+        else:
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        row = cursor.fetchone()
+        if row and row[0] is not None and row[0] >= 0:
+            return int(row[0])
+    return caching.get_or_set('counts', table, model._default_manager.count, COUNT_TIMEOUT)
@@ -0,0 +1,353 @@
+# coding=utf-8
+"""
+Wine pairing recommender.
+
+Wines are described by feature vectors (their area, country, kind, grape
+types and tags); a recipe vector holds its area, country and tags, plus the
+kind and grape profile of the wines suggested for it. The score of a wine
+for a recipe is the weighted dot product of the two vectors, the wine rating
+breaking ties. Scoring is done with NumPy, a whole batch of recipes against
+all the wines at once, and only the best DJANGO_CUISINE_WINE_PAIRINGS wines
+are stored (WinePairing), so that Recipe.recommended_wines() is a lookup.
+
+Recipe changes refresh the pairings of the changed recipes, Wine changes
+score only the recipes sharing a feature with the wine and rewrite the
+pairings it enters or leaves, with the pairings of the categories and areas
+of those recipes (see cookbook.signals). A recipe change moves the mean
+vector of its category by one recipe only: category pairings catch up on
+the next wine change of the category or with the rebuild_wine_pairings
+command, which recomputes everything. Without NumPy nothing is computed.
+The functions commit unless they run in a managed transaction (the admin,
+forking and import ones), so they are rolled back with it.
+"""
+import threading
+from collections import defaultdict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import Count, Min, Q
+from tagging.models import TaggedItem
+from tagging.utils import parse_tag_input
+
+import cookbook_settings
+from cookbook import caching
+from cookbook.models import Recipe, Wine, WinePairing
+
+#weight of a match on each group of features
+WEIGHTS = {'area': 3.0, 'country': 1.0, 'kind': 2.0, 'grape': 2.0, 'tag': 1.0}
+#features a recipe takes from its suggested wines
+PROFILE_GROUPS = ('kind', 'grape')
+#the wine rating (1 to 5) only breaks ties between equally matching wines
+RATING_WEIGHT = 0.01
+
+
+def is_available():
+    return numpy is not None
+
+
+class WineMatrix(object):
+    """
+    The feature vectors of all the wines, one row per wine, loaded with two queries
+    """
+
+    def __init__(self):
+        rows = list(Wine.objects.values_list('id', 'area', 'area__country', 'kind', 'rating', 'tags').order_by('id'))
+        grapes = defaultdict(list)
+        for wine_id, grape_id in Wine.grape_type.through.objects.values_list('wine', 'grapetype'):
+            grapes[wine_id].append(grape_id)
+        self.columns = {}
+        features = []
+        for wine_id, area_id, country_id, kind, rating, tags in rows:
+            keys = [('area', area_id), ('country', country_id), ('kind', kind)]
+            keys.extend(('grape', grape_id) for grape_id in grapes[wine_id])
+            keys.extend(('tag', tag) for tag in parse_tag_input(tags or ''))
+            features.append([self.columns.setdefault(key, len(self.columns)) for key in keys])
+        self.ids = numpy.array([row[0] for row in rows], dtype=int)
+        self.positions = dict((wine_id, i) for i, wine_id in enumerate(self.ids))
+        self.matrix = numpy.zeros((len(rows), len(self.columns)))
+        for i, columns in enumerate(features):
+            self.matrix[i, columns] = 1
+        self.weights = numpy.zeros(len(self.columns))
+        self.profile = numpy.zeros(len(self.columns))
+        for (group, value), column in self.columns.iteritems():
+            self.weights[column] = WEIGHTS[group]
+            self.profile[column] = group in PROFILE_GROUPS
+        self.prior = RATING_WEIGHT * numpy.array([row[4] for row in rows], dtype=float)
+        self.version = None
+
+    def vectors(self, items):
+        """
+        Returns the feature vectors of items, a list of
+        (area id, country id, tags, [suggested wine ids])
+        """
+        vectors = numpy.zeros((len(items), len(self.columns)))
+        for i, (area_id, country_id, tags, wine_ids) in enumerate(items):
+            keys = [('area', area_id), ('country', country_id)] + [('tag', tag) for tag in parse_tag_input(tags or '')]
+            vectors[i, [self.columns[key] for key in keys if key in self.columns]] = 1
+            rows = [self.positions[wine_id] for wine_id in wine_ids if wine_id in self.positions]
+            if rows:
+                vectors[i] += self.matrix[rows].mean(axis=0) * self.profile
+        return vectors
+
+    def scores(self, vectors, wine_rows=None):
+        """
+        Returns the (vectors x wines) score matrix; wines without any
+        matching feature score 0, whatever their rating
+        """
+        matrix, prior = self.matrix, self.prior
+        if wine_rows is not None:
+            matrix, prior = matrix[wine_rows], prior[wine_rows]
+        match = (vectors * self.weights).dot(matrix.T)
+        return numpy.where(match > 0, match + prior, 0)
+
+    def best(self, vectors, k):
+        """
+        Returns, for each vector, the [(wine id, score)] of its k best wines
+        """
+        if not len(self.ids) or not len(vectors):
+            return [[] for vector in vectors]
+        scores = self.scores(vectors)
+        k = min(k, len(self.ids))
+        candidates = numpy.argpartition(-scores, k - 1, axis=1)[:, :k]
+        result = []
+        for row, best in zip(scores, candidates):
+            best = best[numpy.lexsort((self.ids[best], -row[best]))]
+            result.append([(int(self.ids[i]), float(row[i])) for i in best if row[i] > 0])
+        return result
+
+
+_matrix = None
+_lock = threading.Lock()
+
+
+def get_matrix():
+    """
+    Returns the process wine matrix, reloading it after any Wine change
+    """
+    global _matrix
+    version = caching.get_version('wines')
+    if _matrix is None or _matrix.version != version:
+        with _lock:
+            if _matrix is None or _matrix.version != version:
+                matrix = WineMatrix()
+                matrix.version = version
+                _matrix = matrix
+    return _matrix
+
+
+def recipe_items(recipe_ids):
+    """
+    Returns {recipe id: (area id, country id, tags, [suggested wine ids])}
+    for the given recipes, with two queries
+    """
+    wines = defaultdict(list)
+    for recipe_id, wine_id in Recipe.suggested_wine.through.objects.filter(
+            recipe__in=recipe_ids).values_list('recipe', 'wine'):
+        wines[recipe_id].append(wine_id)
+    return dict((recipe_id, (area_id, country_id, tags, wines[recipe_id])) for recipe_id, area_id, country_id, tags in
+                Recipe.objects.filter(id__in=recipe_ids).values_list('id', 'area', 'country', 'tags'))
+
+
+def _store(field, pairings):
+    """
+    Replaces the pairings of the given objects, pairings being
+    {object id: [(wine id, score)]} and field recipe, category or area
+    """
+    if not pairings:
+        return
+    #a plain DELETE statement: QuerySet.delete() would load every row first
+    connection.cursor().execute('DELETE FROM %s WHERE %s IN (%s)' % (
+        connection.ops.quote_name(WinePairing._meta.db_table), connection.ops.quote_name(field + '_id'),
+        ', '.join(['%s'] * len(pairings))), list(pairings))
+    WinePairing.objects.bulk_create([WinePairing(wine_id=wine_id, rank=rank, score=score, **{field + '_id': object_id})
+                                     for object_id, best in pairings.iteritems()
+                                     for rank, (wine_id, score) in enumerate(best)])
+
+
+def _refresh(matrix, items):
+    recipe_ids = items.keys()
+    best = matrix.best(matrix.vectors(items.values()), cookbook_settings.DJANGO_CUISINE_WINE_PAIRINGS)
+    _store('recipe', dict(zip(recipe_ids, best)))
+
+
+def refresh_recipes(recipe_ids):
+    """
+    Recomputes the pairings of the given recipes
+    """
+    recipe_ids = list(recipe_ids)
+    if numpy is None or not recipe_ids:
+        return
+    matrix = get_matrix()
+    for start in range(0, len(recipe_ids), 500):
+        _refresh(matrix, recipe_items(recipe_ids[start:start + 500]))
+    transaction.commit_unless_managed()
+
+
+def paired_with(wine_id):
+    """
+    Returns the {'recipe', 'category', 'area': ids} paired with the given wine,
+    e.g. read before its deletion for wine_changed()
+    """
+    paired = {'recipe': set(), 'category': set(), 'area': set()}
+    for row in WinePairing.objects.filter(wine=wine_id).values_list('recipe', 'category', 'area'):
+        for field, object_id in zip(('recipe', 'category', 'area'), row):
+            if object_id is not None:
+                paired[field].add(object_id)
+    return paired
+
+
+def sharing_recipes(wine_id):
+    """
+    Returns the ids of the recipes sharing at least a feature with the given
+    wine (area, country, tag, or the kind or a grape of a suggested wine):
+    the only ones it can score for
+    """
+    try:
+        area_id, country_id, kind, tags = Wine.objects.values_list(
+            'area', 'area__country', 'kind', 'tags').get(id=wine_id)
+    except Wine.DoesNotExist:
+        return set()
+    recipe_ids = set(Recipe.objects.filter(Q(area=area_id) | Q(country=country_id)).values_list('id', flat=True))
+    tag_names = parse_tag_input(tags or '')
+    if tag_names:
+        recipe_ids.update(TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Recipe), tag__name__in=tag_names).values_list(
+            'object_id', flat=True))
+    grape_ids = list(Wine.grape_type.through.objects.filter(wine=wine_id).values_list('grapetype', flat=True))
+    profile = Q(wine__kind=kind)
+    if grape_ids:
+        profile |= Q(wine__grape_type__in=grape_ids)
+    recipe_ids.update(Recipe.suggested_wine.through.objects.filter(profile).values_list('recipe', flat=True))
+    return recipe_ids
+
+
+def wine_changed(wine_id, paired=None):
+    """
+    Updates the pairings after a change of the given wine (paired being its
+    paired_with(), read before the deletion of a deleted wine). Only the
+    recipes sharing a feature with the wine are scored: those it enters
+    (scoring more than their last stored wine), those it leaves (already
+    paired with it) and those suggesting it are recomputed, with the
+    categories of the recipes sharing its features and the areas of its country
+    """
+    caching.bump_version('wines')
+    if numpy is None:
+        return
+    matrix = get_matrix()
+    k = cookbook_settings.DJANGO_CUISINE_WINE_PAIRINGS
+    if paired is None:
+        paired = paired_with(wine_id)
+    stale = set(paired['recipe'])
+    stale.update(Recipe.suggested_wine.through.objects.filter(wine=wine_id).values_list('recipe', flat=True))
+    position = matrix.positions.get(wine_id)
+    candidates = sorted(sharing_recipes(wine_id)) if position is not None else []
+    category_ids = set(paired['category'])
+    area_ids = set(paired['area'])
+    for start in range(0, len(candidates), 500):
+        recipe_ids = candidates[start:start + 500]
+        items = recipe_items(recipe_ids)
+        worst = dict((row['recipe'], (row['worst'], row['count'])) for row in WinePairing.objects.filter(
+            recipe__in=recipe_ids).values('recipe').annotate(worst=Min('score'), count=Count('id')).order_by())
+        ids = items.keys()
+        scores = matrix.scores(matrix.vectors(items.values()), [position])[:, 0]
+        for recipe_id, score in zip(ids, scores):
+            lowest, count = worst.get(recipe_id, (0, 0))
+            if score > 0 and (count < k or score > lowest):
+                stale.add(recipe_id)
+        for category_id, area_id in Recipe.objects.filter(id__in=recipe_ids).values_list(
+                'category', 'area').distinct().order_by():
+            category_ids.add(category_id)
+            if area_id is not None:
+                area_ids.add(area_id)
+    stale = sorted(stale)
+    for start in range(0, len(stale), 500):
+        _refresh(matrix, recipe_items(stale[start:start + 500]))
+    refresh_categories(category_ids)
+    refresh_areas(area_ids)
+    transaction.commit_unless_managed()
+
+
+def refresh_areas(area_ids=None):
+    """
+    Recomputes the pairings of the given areas (of all the areas of the recipes by default)
+    """
+    if numpy is None:
+        return
+    matrix = get_matrix()
+    recipes = Recipe.objects.exclude(area=None)
+    if area_ids is not None:
+        area_ids = set(area_ids)
+        if not area_ids:
+            return
+        recipes = recipes.filter(area__in=area_ids)
+    areas = list(recipes.values_list('area', 'area__country').distinct().order_by())
+    best = matrix.best(matrix.vectors([(area_id, country_id, '', []) for area_id, country_id in areas]),
+                       cookbook_settings.DJANGO_CUISINE_WINE_PAIRINGS)
+    pairings = dict((area_id, []) for area_id in area_ids or ())
+    pairings.update((area_id, area_best) for (area_id, country_id), area_best in zip(areas, best))
+    _store('area', pairings)
+
+
+def refresh_categories(category_ids=None):
+    """
+    Recomputes the pairings of the given categories (all of them by
+    default), whose vector is the mean of the vectors of their recipes
+    """
+    if numpy is None:
+        return
+    matrix = get_matrix()
+    recipes = Recipe.objects.all()
+    if category_ids is not None:
+        category_ids = set(category_ids)
+        if not category_ids:
+            return
+        recipes = recipes.filter(category__in=category_ids)
+    sums = {}
+    counts = defaultdict(int)
+    last_id = 0
+    while True:
+        rows = list(recipes.filter(id__gt=last_id).order_by('id').values_list('id', 'category')[:500])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        items = recipe_items([recipe_id for recipe_id, category_id in rows])
+        vectors = matrix.vectors([items[recipe_id] for recipe_id, category_id in rows])
+        for (recipe_id, category_id), vector in zip(rows, vectors):
+            sums[category_id] = sums.get(category_id, 0) + vector
+            counts[category_id] += 1
+    categories = sorted(sums)
+    pairings = dict((category_id, []) for category_id in category_ids or ())
+    if categories:
+        means = numpy.array([sums[category_id] / counts[category_id] for category_id in categories])
+        pairings.update(zip(categories, matrix.best(means, cookbook_settings.DJANGO_CUISINE_WINE_PAIRINGS)))
+    _store('category', pairings)
+
+
+def rebuild_all(batch_size=500):
+    """
+    Recomputes all the pairings, batch_size recipes at a time.
+    It yields the number of recipes processed after each batch
+    """
+    if numpy is None:
+        return
+    caching.bump_version('wines')
+    connection.cursor().execute('DELETE FROM %s' % connection.ops.quote_name(WinePairing._meta.db_table))
+    transaction.commit_unless_managed()
+    done = 0
+    last_id = 0
+    while True:
+        ids = list(Recipe.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        refresh_recipes(ids)
+        last_id = ids[-1]
+        done += len(ids)
+        yield done
+    refresh_categories()
+    refresh_areas()
+    transaction.commit_unless_managed()
@@ -0,0 +1,161 @@
+# coding=utf-8
+"""
+"What can I cook?" matching engine.
+
+A process-local index keeps, for each published recipe, the sorted array of
+the food ids of its ingredients, plus the inverted food -> sorted recipe ids
+arrays. Given the foods in a pantry, recipes are ranked by coverage (the
+share of their foods found in the pantry) without touching the database.
+Ingredient and Recipe changes refresh the index of the changed recipes
+(see cookbook.signals): the refreshed index is a new object, swapped in
+once complete, so that the threads reading the current one never see it
+change. Other processes notice the bumped 'pantry' cache version and
+reload their index lazily, provided the cache backend is shared by the
+processes (not LocMemCache).
+"""
+import threading
+from array import array
+from collections import defaultdict
+
+from cookbook import caching
+from cookbook.models import Ingredient
+
+
+class PantryIndex(object):
+    """
+    recipe id -> sorted food ids, and food id -> sorted recipe ids.
+    An index is not changed once built: refreshed() returns a new one
+    """
+
+    def __init__(self):
+        self.foods = {}
+        self.recipes_by_food = {}
+        self.version = None
+
+    def load(self):
+        """
+        Loads the food ids of all the published recipes, with a single query
+        """
+        self.foods = self._read(Ingredient.objects.filter(recipe__is_published=True))
+        recipes_by_food = defaultdict(list)
+        for recipe_id in sorted(self.foods):
+            for food_id in self.foods[recipe_id]:
+                recipes_by_food[food_id].append(recipe_id)
+        self.recipes_by_food = dict((food_id, array('i', recipe_ids))
+                                    for food_id, recipe_ids in recipes_by_food.iteritems())
+
+    def _read(self, queryset):
+        foods = defaultdict(set)
+        for recipe_id, food_id in queryset.values_list('recipe', 'food').order_by().iterator():
+            foods[recipe_id].add(food_id)
+        return dict((recipe_id, array('i', sorted(food_ids))) for recipe_id, food_ids in foods.iteritems())
+
+    def refreshed(self, recipe_ids):
+        """
+        Returns a copy of the index with the food ids of the given recipes
+        reloaded, per 500 recipes; the arrays of the foods they use or used
+        are rebuilt, the others are shared with this index
+        """
+        recipe_ids = sorted(set(recipe_ids))
+        rows = Ingredient.objects.filter(recipe__is_published=True)
+        foods = {}
+        for start in range(0, len(recipe_ids), 500):
+            foods.update(self._read(rows.filter(recipe__in=recipe_ids[start:start + 500])))
+        index = PantryIndex()
+        index.foods = dict(self.foods)
+        index.recipes_by_food = dict(self.recipes_by_food)
+        changed = set(recipe_ids)
+        food_ids = set()
+        for recipe_id in recipe_ids:
+            food_ids.update(index.foods.pop(recipe_id, ()))
+        index.foods.update(foods)
+        added = defaultdict(list)
+        for recipe_id, recipe_food_ids in foods.iteritems():
+            food_ids.update(recipe_food_ids)
+            for food_id in recipe_food_ids:
+                added[food_id].append(recipe_id)
+        for food_id in food_ids:
+            ids = sorted([recipe_id for recipe_id in self.recipes_by_food.get(food_id, ())
+                          if recipe_id not in changed] + added[food_id])
+            if ids:
+                index.recipes_by_food[food_id] = array('i', ids)
+            else:
+                index.recipes_by_food.pop(food_id, None)
+        return index
+
+    def match(self, food_ids, min_coverage=1.0, limit=None):
+        """
+        Returns the [(recipe id, coverage)] of the recipes whose coverage
+        by food_ids is at least min_coverage, best first
+        """
+        hits = defaultdict(int)
+        for food_id in set(food_ids):
+            for recipe_id in self.recipes_by_food.get(food_id, ()):
+                hits[recipe_id] += 1
+        results = []
+        for recipe_id, found in hits.iteritems():
+            coverage = float(found) / len(self.foods[recipe_id])
+            if coverage >= min_coverage:
+                results.append((-coverage, -found, recipe_id))
+        results.sort()
+        return [(recipe_id, -coverage) for coverage, found, recipe_id in results[:limit]]
+
+    def missing(self, recipe_id, food_ids):
+        """
+        Returns the food ids of the recipe which are not in food_ids
+        """
+        food_ids = set(food_ids)
+        return [food_id for food_id in self.foods.get(recipe_id, ()) if food_id not in food_ids]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the process index, (re)loading it when another process has changed it
+    """
+    global _index
+    version = caching.get_version('pantry')
+    if _index is None or _index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                index = PantryIndex()
+                index.load()
+                index.version = version
+                _index = index
+    return _index
+
+
+def recipes_changed(recipe_ids):
+    """
+    Refreshes the index of the given recipes after a change of their
+    ingredients (or of the recipes themselves)
+    """
+    global _index
+    caching.bump_version('pantry')
+    if _index is not None:
+        with _lock:
+            if _index is not None:
+                index = _index.refreshed(recipe_ids)
+                index.version = caching.get_version('pantry')
+                _index = index
+
+
+def reset():
+    """
+    Drops the process index, it will be reloaded on next use
+    """
+    global _index
+    _index = None
+
+
+def cookable_with(food_ids, min_coverage=1.0, limit=20):
+    """
+    Returns [(recipe id, coverage, missing food ids)] for the recipes covered
+    by food_ids at least for min_coverage (1.0: all the ingredients are there)
+    """
+    index = get_index()
+    return [(recipe_id, coverage, index.missing(recipe_id, food_ids))
+            for recipe_id, coverage in index.match(food_ids, min_coverage, limit)]
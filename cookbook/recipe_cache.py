@@ -0,0 +1,94 @@
+# coding=utf-8
+"""
+Read-through cache of the recipe detail page.
+
+The recipe is cached fully assembled by RecipeManager.get_detail (steps,
+ingredients with their food and unit, suggested wines, author, category,
+forks count). Every entry records the versions of the 'recipe_details'
+namespace and of the namespace of its own recipe ('recipe_detail:<id>'):
+the signal receivers in cookbook.signals bump the version of the recipes
+touched by a Recipe, RecipeStep, Ingredient, Food, Wine or Category change
+(and the global one after a Unit change, or when too many recipes are
+touched), so an entry is stale as soon as one of its versions moves.
+Author renames are only seen when the entry expires. Entries and versions
+live in the default cache: with a per-process backend (LocMemCache) every
+process has its own entries, invalidated by its own changes only.
+
+Stale entries are served while they are rebuilt (stale-while-revalidate):
+an entry is fresh for DJANGO_CUISINE_RECIPE_CACHE_TIMEOUT seconds and
+then kept for DJANGO_CUISINE_RECIPE_CACHE_STALE_TIMEOUT more seconds; the
+first request finding it stale (or outdated) takes a short lock and
+rebuilds it, the concurrent ones keep getting the stale recipe instead of
+all querying the database at once.
+"""
+import time
+
+import cookbook_settings
+from cookbook import caching
+from cookbook.models import Recipe
+
+ENTRY_KEY = 'cookbook:recipe_detail:%s'
+LOCK_KEY = 'cookbook:recipe_detail:%s:lock'
+#seconds a rebuild can take before another request tries again
+LOCK_TIMEOUT = 30
+#over this number of recipes, all the entries are invalidated at once
+MAX_INVALIDATED = 500
+
+
+def _namespace(recipe_id):
+    return 'recipe_detail:%s' % recipe_id
+
+
+def get_recipe(recipe_id):
+    """
+    Returns the recipe with all its details, from the cache when possible.
+    Raises Recipe.DoesNotExist
+    """
+    key = ENTRY_KEY % recipe_id
+    entry = caching.cache.get(key)
+    versions = caching.get_versions('recipe_details', _namespace(recipe_id))
+    if entry is not None:
+        entry_versions, fresh_until, recipe = entry
+        if entry_versions == versions and time.time() < fresh_until:
+            return recipe
+        #stale: only one request rebuilds it
+        if not caching.cache.add(LOCK_KEY % recipe_id, True, LOCK_TIMEOUT):
+            return recipe
+    try:
+        recipe = Recipe.objects.get_detail(recipe_id)
+    except Recipe.DoesNotExist:
+        caching.cache.delete(key)
+        raise
+    finally:
+        if entry is not None:
+            caching.cache.delete(LOCK_KEY % recipe_id)
+    timeout = cookbook_settings.DJANGO_CUISINE_RECIPE_CACHE_TIMEOUT
+    caching.cache.set(key, (versions, time.time() + timeout, recipe),
+                      timeout + cookbook_settings.DJANGO_CUISINE_RECIPE_CACHE_STALE_TIMEOUT)
+    return recipe
+
+
+def recipes_changed(recipe_ids):
+    """
+    Invalidates the cached details of the given recipes (ids, None are ignored)
+    """
+    recipe_ids = set(recipe_id for recipe_id in recipe_ids if recipe_id)
+    if len(recipe_ids) > MAX_INVALIDATED:
+        invalidate_all()
+    elif recipe_ids:
+        caching.bump_version(*[_namespace(recipe_id) for recipe_id in recipe_ids])
+
+
+def recipes_of(queryset, field_name='recipe'):
+    """
+    Invalidates the cached details of the recipes referenced by field_name
+    in the rows of queryset, e.g. recipes_of(Ingredient.objects.filter(food=food))
+    """
+    recipes_changed(queryset.values_list(field_name, flat=True).distinct().order_by()[:MAX_INVALIDATED + 1])
+
+
+def invalidate_all():
+    """
+    Invalidates the cached details of all the recipes
+    """
+    caching.bump_version('recipe_details')
@@ -0,0 +1,225 @@
+# coding=utf-8
+"""
+Recipe full-text search.
+
+Published recipes are indexed on their title, summary, tags, step texts and
+ingredient food names. Two backends are available:
+- FTS5Backend: a SQLite FTS5 virtual table, ranked with bm25
+- InvertedIndexBackend: a term -> recipe table (RecipeSearchTerm) filled by
+  a pure-Python tokenizer, usable on any database
+The index is updated by the receivers in cookbook.signals and rebuilt by the
+reindex_recipes management command.
+"""
+import re
+import sqlite3
+import unicodedata
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+import cookbook_settings
+from cookbook.models import Ingredient, Recipe, RecipeSearchTerm, RecipeStep
+
+FIELDS = ('title', 'summary', 'tags', 'steps', 'ingredients')
+#relevance of a match in each of the FIELDS
+FIELD_WEIGHTS = (10.0, 4.0, 6.0, 1.0, 3.0)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fold(text):
+    """
+    Returns text in lowercase and without diacritics
+    (the same folding done by the FTS5 unicode61 tokenizer)
+    """
+    text = unicodedata.normalize('NFKD', unicode(text or u'').lower())
+    return u''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """
+    Splits text into folded words
+    """
+    return [word for word in WORD_RE.findall(fold(text)) if len(word) > 1]
+
+
+def recipe_documents(recipe_ids):
+    """
+    Returns {recipe id: [title, summary, tags, steps, ingredients]}
+    for the published recipes among recipe_ids, with three queries
+    """
+    docs = dict((row[0], list(row[1:]) + [[], []]) for row in Recipe.objects.filter(
+        id__in=recipe_ids, is_published=True).values_list('id', 'title', 'summary', 'tags'))
+    if docs:
+        for recipe_id, text in RecipeStep.objects.filter(recipe__in=docs.keys()).values_list('recipe', 'text'):
+            docs[recipe_id][3].append(text or u'')
+        for recipe_id, name in Ingredient.objects.filter(recipe__in=docs.keys()).values_list('recipe', 'food__name'):
+            docs[recipe_id][4].append(name)
+    for doc in docs.values():
+        doc[0:3] = [value or u'' for value in doc[0:3]]
+        doc[3:5] = [u' '.join(values) for values in doc[3:5]]
+    return docs
+
+
+class FTS5Backend(object):
+    """
+    Search backend storing the index in a SQLite FTS5 virtual table
+    """
+    table = 'cookbook_recipe_fts'
+    _available = None
+
+    @classmethod
+    def is_available(cls):
+        if connection.vendor != 'sqlite':
+            return False
+        if cls._available is None:
+            try:
+                sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE probe USING fts5(text)')
+                cls._available = True
+            except sqlite3.OperationalError:
+                cls._available = False
+        return cls._available
+
+    def setup(self):
+        cursor = connection.cursor()
+        #checked first: the sqlite3 module commits the current transaction before any DDL statement
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+        if not cursor.fetchone():
+            cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(%s, tokenize='unicode61')"
+                           % (self.table, ', '.join(FIELDS)))
+
+    def index(self, recipe_ids, docs):
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (self.table, ', '.join(['%s'] * len(recipe_ids))),
+                       list(recipe_ids))
+        cursor.executemany('INSERT INTO %s (rowid, %s) VALUES (%%s, %%s, %%s, %%s, %%s, %%s)' % (
+            self.table, ', '.join(FIELDS)), [[recipe_id] + doc for recipe_id, doc in docs.items()])
+
+    def clear(self):
+        connection.cursor().execute('DELETE FROM %s' % self.table)
+
+    def search(self, terms, limit, offset):
+        cursor = connection.cursor()
+        cursor.execute('SELECT rowid, bm25(%s, %s) AS rank FROM %s WHERE %s MATCH %%s ORDER BY rank LIMIT %%s OFFSET %%s'
+                       % (self.table, ', '.join(str(w) for w in FIELD_WEIGHTS), self.table, self.table),
+                       [u' '.join(u'"%s"' % term for term in terms), limit, offset])
+        #bm25 is lower for better matches
+        return [(recipe_id, -rank) for recipe_id, rank in cursor.fetchall()]
+
+
+class InvertedIndexBackend(object):
+    """
+    Search backend storing the index in the RecipeSearchTerm table.
+    Each row holds the weighted frequency of a term in a recipe
+    """
+    table = RecipeSearchTerm._meta.db_table
+    term_length = RecipeSearchTerm._meta.get_field('term').max_length
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def setup(self):
+        pass
+
+    def index(self, recipe_ids, docs):
+        #plain DELETE statements: QuerySet.delete() would load every row first
+        connection.cursor().execute('DELETE FROM %s WHERE recipe_id IN (%s)' % (
+            connection.ops.quote_name(self.table), ', '.join(['%s'] * len(recipe_ids))), list(recipe_ids))
+        terms = []
+        for recipe_id, doc in docs.items():
+            weights = defaultdict(float)
+            for text, field_weight in zip(doc, FIELD_WEIGHTS):
+                for term in tokenize(text):
+                    weights[term[:self.term_length]] += field_weight
+            terms.extend(RecipeSearchTerm(recipe_id=recipe_id, term=term, weight=weight)
+                         for term, weight in weights.items())
+        RecipeSearchTerm.objects.bulk_create(terms)
+
+    def clear(self):
+        connection.cursor().execute('DELETE FROM %s' % connection.ops.quote_name(self.table))
+
+    def search(self, terms, limit, offset):
+        terms = set(term[:self.term_length] for term in terms)
+        rows = RecipeSearchTerm.objects.filter(term__in=terms).values('recipe').annotate(
+            matched=Count('id'), score=Sum('weight')).filter(matched=len(terms)).order_by('-score', 'recipe__id')
+        return [(row['recipe'], row['score']) for row in rows[offset:offset + limit]]
+
+
+BACKENDS = {
+    'fts5': FTS5Backend,
+    'python': InvertedIndexBackend,
+}
+
+
+def get_backend():
+    """
+    Returns the configured search backend (DJANGO_CUISINE_SEARCH_BACKEND);
+    'auto' picks FTS5 when the database supports it
+    """
+    name = cookbook_settings.DJANGO_CUISINE_SEARCH_BACKEND
+    if name == 'auto':
+        name = 'fts5' if FTS5Backend.is_available() else 'python'
+    return BACKENDS[name]()
+
+
+def index_recipes(recipe_ids):
+    """
+    Updates the index entries of the given recipes (unpublished
+    or deleted recipes are removed from the index).
+    Inside a managed transaction (e.g. the admin or the importer ones) the
+    entries are committed, or rolled back, with it
+    """
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        get_backend().index(recipe_ids, recipe_documents(recipe_ids))
+        transaction.commit_unless_managed()
+
+
+def reindex_all(batch_size=500):
+    """
+    Rebuilds the whole index, batch_size recipes at a time.
+    It yields the number of recipes processed after each batch
+    """
+    backend = get_backend()
+    backend.setup()
+    backend.clear()
+    transaction.commit_unless_managed()
+    done = 0
+    last_id = 0
+    while True:
+        ids = list(Recipe.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        index_recipes(ids)
+        last_id = ids[-1]
+        done += len(ids)
+        yield done
+
+
+def search_recipes(query, limit=20, offset=0):
+    """
+    Returns the [(recipe id, score)] best matching the query
+    (all its words must match), best first
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return []
+    return get_backend().search(terms, limit, offset)
+
+
+def search(query, limit=20, offset=0):
+    """
+    Returns the published recipes best matching the query, best first.
+    Each recipe has its relevance in the search_score attribute
+    """
+    results = search_recipes(query, limit, offset)
+    recipes = Recipe.pub_objects.select_related('category', 'country', 'author').in_bulk(
+        [recipe_id for recipe_id, score in results])
+    found = []
+    for recipe_id, score in results:
+        if recipe_id in recipes:
+            recipes[recipe_id].search_score = score
+            found.append(recipes[recipe_id])
+    return found
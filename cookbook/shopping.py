@@ -0,0 +1,102 @@
+# coding=utf-8
+"""
+Shopping lists.
+
+The ingredients of a set of recipes are loaded with a single query (food and
+food type names included) and merged by Food: weights and volumes with a
+conversion factor are summed in grams or millilitres and expressed in the
+best unit of the wanted system (see cookbook.units), any other quantity is
+summed per Unit. Lists can be written as CSV or JSON chunk by chunk.
+"""
+import csv
+from collections import defaultdict, namedtuple
+from cStringIO import StringIO
+
+from django.utils import simplejson
+
+from cookbook import units
+from cookbook.models import Ingredient, METRIC
+
+ShoppingItem = namedtuple('ShoppingItem', 'food_id food_name quantities')
+
+
+def build_shopping_list(recipe_ids, multiplier=1.0, system=METRIC):
+    """
+    Returns the shopping list of the given recipes as [(food type name, [ShoppingItem])],
+    sorted by food type and food name. Each item has the [(quantity, unit name)] to buy.
+    multiplier is a number or a {recipe id: multiplier} dict
+    """
+    recipe_ids = sorted(set(int(recipe_id) for recipe_id in recipe_ids))
+    table = units.get_table()
+    foods = {}
+    sums = defaultdict(float)
+    for start in range(0, len(recipe_ids), 500):
+        rows = Ingredient.objects.filter(recipe__in=recipe_ids[start:start + 500]).values_list(
+            'recipe', 'food', 'food__name', 'food__food_type__type_name', 'unit', 'quantity').order_by()
+        for recipe_id, food_id, food_name, type_name, unit_id, quantity in rows:
+            foods[food_id] = (type_name, food_name)
+            if isinstance(multiplier, dict):
+                quantity *= multiplier.get(recipe_id, 1.0)
+            else:
+                quantity *= multiplier
+            factor = table.factors.get(unit_id)
+            if factor:
+                #compatible units are summed in the base unit of their type
+                sums[(food_id, table.types[unit_id], None)] += quantity * factor
+            else:
+                sums[(food_id, None, unit_id)] += quantity
+    quantities = defaultdict(list)
+    for (food_id, unit_type, unit_id), quantity in sorted(sums.items()):
+        if unit_type:
+            fitted = table.fit(quantity, unit_type, system) or table.fit(quantity, unit_type, METRIC)
+            if fitted:
+                quantity, unit_id = fitted
+            else:
+                quantities[food_id].append((quantity, units.BASE_UNIT_NAMES[unit_type]))
+                continue
+        quantities[food_id].append((quantity, table.names.get(unit_id, u'')))
+    groups = defaultdict(list)
+    for food_id, (type_name, food_name) in foods.iteritems():
+        groups[type_name].append(ShoppingItem(food_id, food_name, quantities[food_id]))
+    return [(type_name, sorted(items, key=lambda item: item.food_name))
+            for type_name, items in sorted(groups.items())]
+
+
+def format_quantity(quantity):
+    """
+    Returns the quantity rounded to two decimals, without trailing zeros
+    """
+    return (u'%.2f' % quantity).rstrip(u'0').rstrip(u'.')
+
+
+def iter_csv(shopping_list):
+    """
+    Yields the shopping list as CSV lines, one per food and unit
+    """
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(['food_type', 'food', 'quantity', 'unit'])
+    for type_name, items in shopping_list:
+        for item in items:
+            for quantity, unit_name in item.quantities:
+                writer.writerow([value.encode('utf-8') for value in
+                                 (type_name, item.food_name, format_quantity(quantity), unit_name)])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def iter_json(shopping_list):
+    """
+    Yields the shopping list as a JSON array, one chunk per food type
+    """
+    yield '['
+    for i, (type_name, items) in enumerate(shopping_list):
+        yield (', ' if i else '') + simplejson.dumps({
+            'food_type': type_name,
+            'foods': [{'id': item.food_id, 'name': item.food_name,
+                       'quantities': [{'quantity': round(quantity, 2), 'unit': unit_name}
+                                      for quantity, unit_name in item.quantities]} for item in items],
+        })
+    yield ']'
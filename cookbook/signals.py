@@ -0,0 +1,356 @@
+# coding=utf-8
+"""
+Signal receivers of the cookbook application.
+They are connected when cookbook.models is imported.
+The feature modules (counters, search...) import cookbook.models themselves:
+receivers import them when called, so any of them can be imported first.
+Recipe, RecipeStep and Ingredient changes only record the recipe: its
+derived data is refreshed in batch by cookbook.changes.
+"""
+import sys
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, post_syncdb, pre_delete
+from geo.models import AdministrativeArea, Country, Location
+from tagging.models import Tag, TaggedItem
+
+from cookbook import caching
+from cookbook.models import Category, Food, FoodType, GrapeType, Ingredient, Recipe, RecipeStep, Unit, Wine
+
+
+def recipe_post_init(sender, instance, **kwargs):
+    """
+    Keeps track of the author and fork origin the recipe has been loaded with,
+    so that counters can be moved when they change
+    """
+    instance._counted_for = (instance.author_id, instance.fork_origin_id)
+
+
+def recipe_post_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Updates forks and author counters after a Recipe save
+    """
+    from cookbook import counters
+    if raw:
+        return
+    if created:
+        author_id, fork_origin_id = None, None
+    else:
+        author_id, fork_origin_id = getattr(instance, '_counted_for', (instance.author_id, instance.fork_origin_id))
+    if author_id != instance.author_id:
+        if author_id:
+            counters.update_recipes_count(author_id, -1)
+        counters.update_recipes_count(instance.author_id, 1)
+    if fork_origin_id != instance.fork_origin_id:
+        counters.update_forks_count([fork_origin_id], -1)
+        counters.update_forks_count([instance.fork_origin_id], 1)
+    instance._counted_for = (instance.author_id, instance.fork_origin_id)
+
+
+def recipe_post_delete(sender, instance, **kwargs):
+    """
+    Updates forks and author counters after a Recipe delete
+    """
+    from cookbook import counters
+    counters.update_recipes_count(instance.author_id, -1)
+    counters.update_forks_count([instance.fork_origin_id], -1)
+
+
+def recipe_changed(sender, instance, raw=False, **kwargs):
+    """
+    Records a saved or deleted Recipe for the refresh of its derived data
+    (its fork origin for the cached details only: forks count), see cookbook.changes
+    """
+    from cookbook import changes
+    if raw:
+        kinds = ('detail',)
+    elif 'created' in kwargs:
+        kinds = ('index', 'pantry', 'pairing', 'detail')
+    else:
+        #the pairings of a deleted recipe are deleted with it
+        kinds = ('index', 'pantry', 'detail')
+    changes.recipes_changed([instance.id], kinds)
+    changes.recipes_changed([instance.fork_origin_id], ('detail',))
+
+
+#the data derived from the recipes which depends on their steps or ingredients
+CHILD_KINDS = {
+    RecipeStep: ('duration', 'index', 'detail'),
+    Ingredient: ('index', 'pantry', 'detail'),
+}
+
+
+def recipe_child_changed(sender, instance, raw=False, **kwargs):
+    """
+    Records the Recipe of a saved or deleted RecipeStep or Ingredient
+    for the refresh of its derived data, see cookbook.changes
+    """
+    from cookbook import changes
+    changes.recipes_changed([instance.recipe_id], ('detail',) if raw else CHILD_KINDS[sender])
+
+
+def invalidate_recipe_lists(sender, **kwargs):
+    """
+    Invalidates the cached recipe lists after a Recipe or Category change
+    """
+    caching.bump_version('recipes')
+
+
+def index_recipes_of_food(sender, instance, created, raw=False, **kwargs):
+    """
+    Updates the search index entries of the recipes using a renamed Food
+    """
+    from cookbook import search
+    if not (raw or created):
+        recipe_ids = list(Ingredient.objects.filter(food=instance).values_list('recipe', flat=True).distinct())
+        for start in range(0, len(recipe_ids), 500):
+            search.index_recipes(recipe_ids[start:start + 500])
+
+
+def invalidate_units(sender, **kwargs):
+    """
+    Invalidates the unit conversion tables after a Unit change
+    """
+    caching.bump_version('units')
+
+
+def refresh_suggested_wine_pairings(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Recomputes the wine pairings of the recipes whose suggested wines changed
+    """
+    from cookbook import pairing
+    if action == 'pre_clear' and reverse:
+        #a wine cleared of all its recipes: they are unknown after the clear
+        instance._cleared_recipe_ids = list(instance.recipes.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            pairing.refresh_recipes([instance.id])
+        else:
+            pairing.refresh_recipes(pk_set or getattr(instance, '_cleared_recipe_ids', ()))
+
+
+def track_wine_pairings(sender, instance, **kwargs):
+    """
+    Keeps track of the recipes, categories and areas paired with a Wine
+    about to be deleted: its pairings are deleted with it
+    """
+    from cookbook import pairing
+    instance._paired = pairing.paired_with(instance.id)
+
+
+def refresh_wine_pairings(sender, instance, raw=False, **kwargs):
+    """
+    Updates the wine pairings after a Wine change
+    """
+    from cookbook import pairing
+    if raw:
+        caching.bump_version('wines')
+    else:
+        pairing.wine_changed(instance.id, getattr(instance, '_paired', None))
+
+
+def refresh_grape_pairings(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Updates the wine pairings after a change of the grape types of wines
+    """
+    from cookbook import pairing
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        wine_ids = (pk_set or []) if reverse else [instance.id]
+        for wine_id in wine_ids:
+            pairing.wine_changed(wine_id)
+
+
+def invalidate_catalog(sender, **kwargs):
+    """
+    Invalidates the catalog snapshots of all the processes after a change
+    of a Unit, FoodType, Food, GrapeType, Category or Country
+    """
+    caching.bump_version('catalog')
+
+
+def invalidate_geo_lookups(sender, **kwargs):
+    """
+    Invalidates the geo autocomplete indexes after a Location,
+    AdministrativeArea or Country change
+    """
+    caching.bump_version('geo')
+
+
+def tagged_item_post_save(sender, instance, created, **kwargs):
+    """
+    Updates the tag counters and the tag index after a TaggedItem insert
+    """
+    from cookbook import counters, tagcloud
+    if created:
+        counters.update_tag_count(instance.content_type_id, instance.tag_id, 1)
+        tagcloud.objects_changed(ContentType.objects.get_for_id(instance.content_type_id).model_class(),
+                                 [instance.object_id])
+
+
+def tagged_item_post_delete(sender, instance, **kwargs):
+    """
+    Updates the tag counters and the tag index after a TaggedItem delete
+    """
+    from cookbook import counters, tagcloud
+    counters.update_tag_count(instance.content_type_id, instance.tag_id, -1)
+    tagcloud.objects_changed(ContentType.objects.get_for_id(instance.content_type_id).model_class(),
+                             [instance.object_id])
+
+
+def refresh_tag_index(sender, instance, raw=False, **kwargs):
+    """
+    Refreshes the tag index entry of a saved Recipe or Wine (e.g. published or not)
+    """
+    from cookbook import tagcloud
+    if not raw:
+        tagcloud.objects_changed(sender, [instance.id])
+
+
+def delete_tagged_items(sender, instance, **kwargs):
+    """
+    Deletes the TaggedItem rows of a deleted Recipe or Wine,
+    which django-tagging leaves behind
+    """
+    TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(sender), object_id=instance.pk).delete()
+
+
+def invalidate_tags(sender, **kwargs):
+    """
+    Invalidates the tag clouds and indexes after a Tag change
+    """
+    caching.bump_version('tags')
+
+
+def track_image(sender, instance, **kwargs):
+    """
+    Keeps track of the image a Recipe, RecipeStep or Wine has been loaded with,
+    so that only newly attached images get their thumbnails generated
+    """
+    instance._loaded_image_id = instance.__dict__.get('image_id')
+
+
+def generate_thumbnails(sender, instance, raw=False, **kwargs):
+    """
+    Queues the thumbnails of the image attached to a Recipe, RecipeStep or Wine
+    """
+    from cookbook import thumbnails
+    if not raw and instance.image_id and instance.image_id != getattr(instance, '_loaded_image_id', None):
+        thumbnails.image_attached(instance)
+    instance._loaded_image_id = instance.image_id
+
+
+def invalidate_recipe_details_of_food(sender, instance, **kwargs):
+    """
+    Invalidates the cached details of the recipes using a Food
+    """
+    from cookbook import recipe_cache
+    recipe_cache.recipes_of(Ingredient.objects.filter(food=instance))
+
+
+def invalidate_recipe_details_of_wine(sender, instance, **kwargs):
+    """
+    Invalidates the cached details of the recipes suggesting a Wine
+    """
+    from cookbook import recipe_cache
+    recipe_cache.recipes_of(Recipe.suggested_wine.through.objects.filter(wine=instance))
+
+
+def invalidate_recipe_details_of_category(sender, instance, **kwargs):
+    """
+    Invalidates the cached details of the recipes of a Category
+    """
+    from cookbook import recipe_cache
+    recipe_cache.recipes_of(Recipe.objects.filter(category=instance), 'id')
+
+
+def invalidate_recipe_details_of_suggested_wines(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the cached details of the recipes whose suggested wines changed
+    """
+    from cookbook import recipe_cache
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            recipe_cache.recipes_changed([instance.id])
+        elif pk_set:
+            recipe_cache.recipes_changed(pk_set)
+        else:
+            #a wine cleared of all its recipes: they are unknown here
+            recipe_cache.invalidate_all()
+
+
+def invalidate_recipe_details(sender, **kwargs):
+    """
+    Invalidates the cached details of all the recipes after a Unit change
+    """
+    from cookbook import recipe_cache
+    recipe_cache.invalidate_all()
+
+
+def create_search_index(sender, app, **kwargs):
+    """
+    Creates the search index storage (if any) after syncdb
+    """
+    from cookbook import search
+    if app.__name__ == Recipe.__module__:
+        search.get_backend().setup()
+
+
+def create_composite_indexes(sender, app, verbosity=1, db=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Creates the missing composite indexes (see cookbook.indexes) after syncdb
+    """
+    from cookbook import indexes
+    if app.__name__ == Recipe.__module__:
+        for name in indexes.create_indexes(db):
+            if verbosity >= 1:
+                sys.stdout.write('Creating index %s\n' % name)
+
+
+post_init.connect(recipe_post_init, sender=Recipe)
+post_save.connect(recipe_post_save, sender=Recipe)
+post_delete.connect(recipe_post_delete, sender=Recipe)
+for changed_model, receiver in ((Recipe, recipe_changed),
+                                (RecipeStep, recipe_child_changed),
+                                (Ingredient, recipe_child_changed)):
+    post_save.connect(receiver, sender=changed_model)
+    post_delete.connect(receiver, sender=changed_model)
+post_save.connect(invalidate_recipe_lists, sender=Recipe)
+post_delete.connect(invalidate_recipe_lists, sender=Recipe)
+post_save.connect(invalidate_recipe_lists, sender=Category)
+post_delete.connect(invalidate_recipe_lists, sender=Category)
+post_save.connect(index_recipes_of_food, sender=Food)
+post_save.connect(invalidate_units, sender=Unit)
+post_delete.connect(invalidate_units, sender=Unit)
+m2m_changed.connect(refresh_suggested_wine_pairings, sender=Recipe.suggested_wine.through)
+post_save.connect(refresh_wine_pairings, sender=Wine)
+pre_delete.connect(track_wine_pairings, sender=Wine)
+post_delete.connect(refresh_wine_pairings, sender=Wine)
+m2m_changed.connect(refresh_grape_pairings, sender=Wine.grape_type.through)
+post_save.connect(tagged_item_post_save, sender=TaggedItem)
+post_delete.connect(tagged_item_post_delete, sender=TaggedItem)
+for tagged_model in (Recipe, Wine):
+    post_save.connect(refresh_tag_index, sender=tagged_model)
+    post_delete.connect(delete_tagged_items, sender=tagged_model)
+post_save.connect(invalidate_tags, sender=Tag)
+post_delete.connect(invalidate_tags, sender=Tag)
+for image_model in (Recipe, RecipeStep, Wine):
+    post_init.connect(track_image, sender=image_model)
+    post_save.connect(generate_thumbnails, sender=image_model)
+#the related recipes are looked up before the delete cascades
+for detail_model, receiver in ((Food, invalidate_recipe_details_of_food),
+                               (Wine, invalidate_recipe_details_of_wine),
+                               (Category, invalidate_recipe_details_of_category)):
+    post_save.connect(receiver, sender=detail_model)
+    pre_delete.connect(receiver, sender=detail_model)
+m2m_changed.connect(invalidate_recipe_details_of_suggested_wines, sender=Recipe.suggested_wine.through)
+post_save.connect(invalidate_recipe_details, sender=Unit)
+post_delete.connect(invalidate_recipe_details, sender=Unit)
+for geo_model in (Location, AdministrativeArea, Country):
+    post_save.connect(invalidate_geo_lookups, sender=geo_model)
+    post_delete.connect(invalidate_geo_lookups, sender=geo_model)
+for catalog_model in (Unit, FoodType, Food, GrapeType, Category, Country):
+    post_save.connect(invalidate_catalog, sender=catalog_model)
+    post_delete.connect(invalidate_catalog, sender=catalog_model)
+post_syncdb.connect(create_search_index)
+post_syncdb.connect(create_composite_indexes)
@@ -0,0 +1,74 @@
+/*
+ * Autocomplete for the geo lookup widgets (cookbook.widgets.GeoLookupWidget):
+ * typing in a .geo-lookup input queries its data-url endpoint, choosing a
+ * suggestion stores its id in the hidden input named by data-target.
+ * Plain DOM code: it runs before jQuery is loaded.
+ */
+(function () {
+    var timer = null;
+
+    function closeList(input) {
+        if (input.geoList) {
+            input.geoList.parentNode.removeChild(input.geoList);
+            input.geoList = null;
+        }
+    }
+
+    function showList(input, items) {
+        closeList(input);
+        var list = document.createElement('ul');
+        list.className = 'dropdown-menu';
+        list.style.display = 'block';
+        list.style.position = 'absolute';
+        for (var i = 0; i < items.length; i++) {
+            var item = document.createElement('li'), link = document.createElement('a');
+            link.href = '#';
+            link.appendChild(document.createTextNode(items[i].label));
+            link.onmousedown = (function (choice) {
+                return function (event) {
+                    event.preventDefault();
+                    input.value = choice.label;
+                    document.getElementById(input.getAttribute('data-target')).value = choice.id;
+                    closeList(input);
+                };
+            })(items[i]);
+            item.appendChild(link);
+            list.appendChild(item);
+        }
+        input.parentNode.style.position = 'relative';
+        input.parentNode.appendChild(list);
+        input.geoList = list;
+    }
+
+    function lookup(input) {
+        var request = new XMLHttpRequest();
+        request.open('GET', input.getAttribute('data-url') + '?q=' + encodeURIComponent(input.value));
+        request.onload = function () {
+            if (request.status === 200) {
+                showList(input, JSON.parse(request.responseText));
+            }
+        };
+        request.send();
+    }
+
+    document.addEventListener('input', function (event) {
+        var input = event.target;
+        if (!input.className || input.className.indexOf('geo-lookup') < 0) {
+            return;
+        }
+        //the typed text is not a valid choice until a suggestion is picked
+        document.getElementById(input.getAttribute('data-target')).value = '';
+        clearTimeout(timer);
+        if (input.value.length < 2) {
+            closeList(input);
+            return;
+        }
+        timer = setTimeout(function () { lookup(input); }, 200);
+    }, false);
+
+    document.addEventListener('blur', function (event) {
+        if (event.target.geoList) {
+            closeList(event.target);
+        }
+    }, true);
+})();
@@ -0,0 +1,187 @@
+# coding=utf-8
+"""
+Tag browsing of recipes and wines.
+
+The per-tag usage counts of each model are the TagStats rows maintained by
+cookbook.counters: the weighted tag cloud of a model is built from them
+(with django-tagging's calculate_cloud) and cached in the 'tags' namespace.
+
+A process-local index keeps, for each tagged model, the tag name ->
+published object ids sets: the objects tagged with all of several tags
+("vegan AND summer AND quick") are found intersecting the sets, smallest
+first, without querying TaggedItem.
+TaggedItem and tagged object changes refresh the index of the changed
+objects (see cookbook.signals): the refreshed index is a new object,
+swapped in once complete, so that the threads reading the current one
+never see it change. Other processes notice the bumped 'tags'
+cache version and reload their index lazily. With a per-process cache
+(LocMemCache) they do not: their index and cloud stay as they loaded them.
+"""
+import threading
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from tagging.models import TaggedItem
+from tagging.utils import LOGARITHMIC, calculate_cloud, parse_tag_input
+
+from cookbook import caching
+from cookbook.models import Recipe, TagStats, Wine
+
+#the models which can be browsed by tag
+TAGGED_MODELS = {
+    'recipe': Recipe,
+    'wine': Wine,
+}
+
+
+class TagIndex(object):
+    """
+    object id -> tag names, and tag name -> object ids of the published objects of a model
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.tags = {}
+        self.objects_by_tag = {}
+        self.version = None
+
+    def _rows(self):
+        return TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.model),
+            object_id__in=self.model.pub_objects.values('pk')).values_list(
+            'object_id', 'tag__name').order_by()
+
+    def _read(self, batches):
+        tags = defaultdict(set)
+        for batch in batches:
+            for object_id, name in batch.iterator():
+                tags[object_id].add(name)
+        return tags
+
+    def load(self):
+        """
+        Loads the tags of all the published objects, with a single query
+        """
+        self.tags = dict(self._read([self._rows()]))
+        objects_by_tag = defaultdict(set)
+        for object_id, names in self.tags.iteritems():
+            for name in names:
+                objects_by_tag[name].add(object_id)
+        self.objects_by_tag = dict(objects_by_tag)
+
+    def refreshed(self, object_ids):
+        """
+        Returns a copy of the index with the tags of the given objects
+        reloaded, per 500 objects; the sets of the tags they have or had
+        are copied, the others are shared with this index
+        """
+        object_ids = sorted(set(object_ids))
+        rows = self._rows()
+        tags = self._read([rows.filter(object_id__in=object_ids[start:start + 500])
+                           for start in range(0, len(object_ids), 500)])
+        index = TagIndex(self.model)
+        index.tags = dict(self.tags)
+        index.objects_by_tag = dict(self.objects_by_tag)
+        names = set()
+        for object_id in object_ids:
+            names.update(index.tags.pop(object_id, ()))
+        index.tags.update(tags)
+        for object_names in tags.itervalues():
+            names.update(object_names)
+        changed = set(object_ids)
+        for name in names:
+            ids = self.objects_by_tag.get(name, set()) - changed
+            ids.update(object_id for object_id, object_names in tags.iteritems() if name in object_names)
+            if ids:
+                index.objects_by_tag[name] = ids
+            else:
+                index.objects_by_tag.pop(name, None)
+        return index
+
+    def intersection(self, tag_names):
+        """
+        Returns the sorted ids of the objects tagged with all of tag_names
+        """
+        sets = [self.objects_by_tag.get(name, ()) for name in set(tag_names)]
+        if not sets:
+            return []
+        sets.sort(key=len)
+        ids = set(sets[0])
+        for other in sets[1:]:
+            if not ids:
+                break
+            ids.intersection_update(other)
+        return sorted(ids)
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_index(model):
+    """
+    Returns the process index of a model, (re)loading it when another process has changed it
+    """
+    version = caching.get_version('tags')
+    index = _indexes.get(model)
+    if index is None or index.version != version:
+        with _lock:
+            index = _indexes.get(model)
+            if index is None or index.version != version:
+                index = TagIndex(model)
+                index.load()
+                index.version = version
+                _indexes[model] = index
+    return index
+
+
+def objects_changed(model, object_ids):
+    """
+    Refreshes the index of the given objects after a change of their tags
+    (or of the objects themselves)
+    """
+    caching.bump_version('tags')
+    if model in _indexes:
+        with _lock:
+            if model in _indexes:
+                index = _indexes[model].refreshed(object_ids)
+                index.version = caching.get_version('tags')
+                _indexes[model] = index
+
+
+def reset():
+    """
+    Drops the process indexes, they will be reloaded on next use
+    """
+    _indexes.clear()
+
+
+def parse_tags(value):
+    """
+    Returns the tag names of value, e.g. "vegan+summer" or "vegan, summer"
+    """
+    return parse_tag_input(value.replace('+', ','))
+
+
+def tagged_ids(model, tag_names):
+    """
+    Returns the sorted ids of the published objects of model tagged with all of tag_names
+    """
+    return get_index(model).intersection(tag_names)
+
+
+def get_cloud(model, steps=4, min_count=1):
+    """
+    Returns the tags of model used at least min_count times, by name,
+    each with its count and font_size (1 to steps, logarithmic)
+    """
+
+    def load():
+        tags = []
+        for stats in TagStats.objects.filter(content_type=ContentType.objects.get_for_model(model),
+                                             items_count__gte=min_count).select_related('tag').order_by('tag__name'):
+            stats.tag.count = stats.items_count
+            tags.append(stats.tag)
+        return calculate_cloud(tags, steps, LOGARITHMIC)
+
+    return caching.get_or_set('tags', 'cloud:%s:%d:%d' % (model._meta.db_table, steps, min_count), load)
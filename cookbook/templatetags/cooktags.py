@@ -1,44 +1,84 @@
 __author__ = 'luca'
 from cookbook.models import Recipe, Category
+from cookbook import caching, catalog, counters, tagcloud, thumbnails
+from cookbook import cookbook_settings
 from django import template
+from django.core.urlresolvers import reverse
 import settings
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
 
 register = template.Library()
 
-@register.inclusion_tag('')
-def show_recipes_by_category(category_id):
-    """visualize example charts"""
+#related rows shown by the recipe list fragments (category and country names come from cookbook.catalog)
+RECIPE_LIST_RELATED = ('author', 'image')
 
-    rec_list = Recipe.objects.filter(category=category_id)
-    cat = Category.objects.get(id=category_id)
-    return {'recipe_list':rec_list ,
-            'category' : cat,
-    }
 
+def _recipe_list(queryset, limit):
+    """
+    utility function: evaluates a recipe queryset preloading its related rows
+    """
+    return list(queryset.select_related(*RECIPE_LIST_RELATED)[:limit])
+
+
+@register.inclusion_tag('tt_recipes_by_category.html')
+def show_recipes_by_category(category_id, limit=None):
+    """
+    This tag shows the list of recipes for a given category
+    The list is read from the versioned 'recipes' cache (see cookbook.caching)
+    """
+    limit = limit or cookbook_settings.DJANGO_CUISINE_TAG_RECIPES_LIMIT
 
+    def load():
+        rec_list = _recipe_list(Recipe.objects.filter(category=category_id), limit)
+        return {'recipe_list': rec_list,
+                'category': catalog.instance(Category, int(category_id)),
+        }
 
+    return caching.get_or_set('recipes', 'by_category:%s:%d' % (category_id, limit), load)
 
 
 @register.inclusion_tag('tt_veg_friendly.html')
-def show_vegetarian_recipes():
+def show_vegetarian_recipes(limit=None):
     """
     This tag shows the list of vegetarian recipes
+    The list is read from the versioned 'recipes' cache (see cookbook.caching)
     """
-
-    rec_list = Recipe.veg_objects.vegetarian_friendly()
-    return {'recipe_list':rec_list ,
+    limit = limit or cookbook_settings.DJANGO_CUISINE_TAG_RECIPES_LIMIT
+    rec_list = caching.get_or_set('recipes', 'vegetarian:%d' % limit,
+                                  lambda: _recipe_list(Recipe.veg_objects.vegetarian_friendly(), limit))
+    return {'recipe_list': rec_list,
             }
 
 
 @register.inclusion_tag('tt_veg_friendly.html')
-def show_vegan_recipes():
+def show_vegan_recipes(limit=None):
     """
     This tag shows the list of vegan recipes
+    The list is read from the versioned 'recipes' cache (see cookbook.caching)
     """
-    rec_list = Recipe.veg_objects.vegan_friendly()
-    return {'recipe_list':rec_list ,
+    limit = limit or cookbook_settings.DJANGO_CUISINE_TAG_RECIPES_LIMIT
+    rec_list = caching.get_or_set('recipes', 'vegan:%d' % limit,
+                                  lambda: _recipe_list(Recipe.veg_objects.vegan_friendly(), limit))
+    return {'recipe_list': rec_list,
+            }
+
+
+@register.inclusion_tag('tt_tag_cloud.html')
+def show_tag_cloud(kind, selected=None, steps=4):
+    """
+    This tag shows the weighted tag cloud of the recipes or wines (kind)
+    The cloud is read from the versioned 'tags' cache (see cookbook.tagcloud);
+    each tag links to the objects tagged with it and with the selected tags
+    """
+    selected = list(selected or [])
+    tag_list = []
+    for tag in tagcloud.get_cloud(tagcloud.TAGGED_MODELS[kind], steps):
+        if tag.name not in selected:
+            tag_list.append({'name': tag.name, 'count': tag.count, 'font_size': tag.font_size,
+                             'url': reverse('cookbook_list:tagged', args=(kind, '+'.join(selected + [tag.name])))})
+    return {'tag_list': tag_list,
             }
 
 
@@ -46,14 +86,36 @@ def show_vegan_recipes():
 def show_forks_count(value):
     """
     This tag shows the number of fork for a given one
+    It reads the counter stored on the recipe (see cookbook.counters)
     """
-    return Recipe.objects.filter(fork_origin=value).count()
+    return counters.get_forks_count(value)
 
 
 @register.simple_tag(name='get_recipes_count_per_user')
 def show_recipes_count_per_user(value):
     """
     This tags shows the number of recipes for a given user
+    It reads the counter stored in AuthorStats (see cookbook.counters)
     """
-    return Recipe.objects.filter(author=value).count()
+    return counters.get_recipes_count(value)
+
 
+@register.simple_tag(name='get_thumbnail_url')
+def show_thumbnail_url(obj, alias, field_name='image'):
+    """
+    This tag shows the URL of the alias thumbnail of the image of a recipe,
+    step or wine; it never generates it: missing thumbnails are queued
+    (see cookbook.thumbnails) and the original image is shown meanwhile
+    """
+    return thumbnails.thumbnail_url(obj, alias, field_name)
+
+
+@register.simple_tag(name='get_catalog_name')
+def show_catalog_name(obj, field_name):
+    """
+    This tag shows the name of the unit, food, category, country... referenced
+    by the field_name foreign key of obj, read from the catalog snapshot
+    (see cookbook.catalog) instead of the database
+    """
+    field = obj._meta.get_field(field_name)
+    return escape(catalog.name(field.rel.to, getattr(obj, field.attname)))
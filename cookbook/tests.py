@@ -1,11 +1,96 @@
 """
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
-
-Replace this with more appropriate tests for your application.
+Tests for the cookbook application.
+Run them with "manage.py test cookbook".
 """
 
-from django.test import TestCase
+from django.contrib import admin
+from django.contrib.admin.models import ADDITION, CHANGE, LogEntry
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, get_cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.paginator import EmptyPage
+from django.core.urlresolvers import reverse
+from django.db import connection, reset_queries, transaction
+from django.forms.models import modelform_factory
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase
+from django.utils import simplejson
+from django.utils.unittest import skipUnless
+from StringIO import StringIO
+from geo.models import AdministrativeArea, AdministrativeAreaType, Country, Location
+import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+from tagging.models import Tag, TaggedItem
+from filer.models import Image
+from PIL import Image as PILImage
+import shutil
+import sys
+
+from cookbook import benchmarks, bulkload, caching, catalog, changes, cookbook_settings, counters, exchange
+from cookbook import facets, forking, history, indexes, instrumentation, lookups, pagination, pairing
+from cookbook import pantry, recipe_cache, search, shopping, tagcloud, thumbnails, units
+from cookbook.forms import CatalogChoiceField, CatalogMultipleChoiceField, RecipeForm, WineForm, catalog_formfield
+from cookbook.datagen import DataGenerator
+from cookbook.models import AuthorStats, Category, Food, FoodType, GrapeType, Ingredient, Recipe, RecipeStep, TagStats
+from cookbook.models import PendingThumbnail, Unit, Wine
+from cookbook.models import IMPERIAL, METRIC, VOLUME, WEIGHT
+
+
+class QueryCounter(object):
+    """
+    Context manager counting the queries run in its block
+    """
+
+    def __enter__(self):
+        self.old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        self.start = len(connection.queries)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.count = len(connection.queries) - self.start
+        connection.use_debug_cursor = self.old_debug_cursor
+
+
+class CookbookTestCase(TestCase):
+    """
+    Base TestCase: it creates a small cookbook (a recipe with its
+    steps, ingredients and a suggested wine)
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('cook', 'cook@example.com', 'cook')
+        self.other_user = User.objects.create_user('other', 'other@example.com', 'other')
+        self.country = Country.objects.create(iso_code='IT', iso3_code='ITA', num_code='380', name='Italy',
+                                              fullname='Italian Republic', continent='EU')
+        area_type = AdministrativeAreaType.objects.create(name='Regione', country=self.country)
+        self.area = AdministrativeArea.objects.create(name='Piemonte', country=self.country, type=area_type)
+        self.category = Category.objects.create(name='Pasta')
+        self.food_type = FoodType.objects.create(type_name='Cereals')
+        self.gram = Unit.objects.create(unit_name='gram', code='g', type=1)
+        self.wine = Wine.objects.create(name='Barolo', code='DOCG-1', area=self.area, alcohol_percentage=14,
+                                        year=2008, kind=1)
+        self.recipe = self.create_recipe('Tajarin', steps=2, ingredients=3, tags='pasta piemonte')
+
+    def create_recipe(self, title, steps=0, ingredients=0, author=None, category=None, **kwargs):
+        kwargs.setdefault('country', self.country)
+        recipe = Recipe.objects.create(title=title, difficulty=2, category=category or self.category,
+                                       author=author or self.user, **kwargs)
+        for i in range(steps):
+            RecipeStep.objects.create(recipe=recipe, text='Step %d of %s' % (i, title), order=i, duration=5)
+        for i in range(ingredients):
+            food = Food.objects.create(name='Food %d of %s' % (i, title), food_type=self.food_type)
+            Ingredient.objects.create(recipe=recipe, food=food, unit=self.gram, quantity=100 + i, order=i)
+        recipe.suggested_wine.add(self.wine)
+        return recipe
 
 
 class SimpleTest(TestCase):
@@ -14,3 +99,1645 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class ForkingTest(CookbookTestCase):
+
+    def test_fork_copies_recipe(self):
+        fork = forking.fork_recipe(self.recipe, self.other_user)
+        self.assertNotEqual(fork.id, self.recipe.id)
+        fork = Recipe.objects.get(id=fork.id)
+        self.assertEqual(fork.title, self.recipe.title)
+        self.assertEqual(fork.author, self.other_user)
+        self.assertEqual(fork.fork_origin, self.recipe)
+        self.assertEqual([s.text for s in fork.recipestep_set.all()],
+                         [s.text for s in self.recipe.recipestep_set.all()])
+        self.assertEqual([(i.food_id, i.quantity) for i in fork.ingredient_set.all()],
+                         [(i.food_id, i.quantity) for i in self.recipe.ingredient_set.all()])
+        self.assertEqual(list(fork.suggested_wine.all()), [self.wine])
+        self.assertEqual(set(t.name for t in Tag.objects.get_for_object(fork)), set(['pasta', 'piemonte']))
+
+    def test_fork_queries_do_not_depend_on_recipe_size(self):
+        big_recipe = self.create_recipe('Lasagne', steps=15, ingredients=20, tags='pasta')
+        forking.fork_recipe(self.recipe, self.other_user)
+        with QueryCounter() as small:
+            forking.fork_recipe(self.recipe, self.other_user)
+        with QueryCounter() as big:
+            forking.fork_recipe(big_recipe, self.other_user)
+        with QueryCounter() as batch:
+            forks = forking.fork_recipes([self.recipe, big_recipe], self.other_user)
+        self.assertEqual(small.count, big.count)
+        self.assertEqual(small.count, batch.count)
+        self.assertEqual(forks[big_recipe.id].recipestep_set.count(), 15)
+        self.assertEqual(forks[big_recipe.id].ingredient_set.count(), 20)
+
+    def test_forks_get_their_own_primary_keys(self):
+        first = forking.fork_recipe(self.recipe, self.other_user)
+        second = forking.fork_recipe(self.recipe, self.other_user)
+        self.assertEqual(second.id, first.id + 1)
+        self.assertEqual([fork.recipestep_set.count() for fork in (first, second)], [2, 2])
+        self.assertTrue(self.create_recipe('Bagna cauda').id > second.id)
+
+    def test_fork_view(self):
+        self.client.login(username='other', password='other')
+        response = self.client.get(reverse('cookbook_list:recipe_fork', args=(self.recipe.id,)))
+        fork = Recipe.objects.get(fork_origin=self.recipe)
+        self.assertRedirects(response, reverse('cookbook_list:recipe_form', args=(fork.id,)))
+        self.assertEqual(fork.author, self.other_user)
+
+    def test_fork_command(self):
+        call_command('fork_recipes', str(self.recipe.id), author='other', stdout=StringIO())
+        self.assertEqual(Recipe.objects.filter(fork_origin=self.recipe, author=self.other_user).count(), 1)
+
+
+class RecipeDetailTest(CookbookTestCase):
+
+    def test_ingredients_preload_unit_and_food(self):
+        Ingredient.objects.create(recipe=self.recipe, food=Food.objects.create(name='Salt', food_type=self.food_type),
+                                  quantity=1)
+        with self.assertNumQueries(1):
+            self.assertEqual([unicode(i) for i in Ingredient.objects.filter(recipe=self.recipe)],
+                             [u'1  salt'] + [u'%d gram food %d of tajarin' % (100 + i, i) for i in range(3)])
+
+    def test_detail_query_budget(self):
+        self.recipe.area = self.area
+        self.recipe.save()
+        with self.assertNumQueries(4):
+            recipe = Recipe.objects.get_detail(self.recipe.id)
+            self.assertEqual((recipe.category.name, recipe.country.name, recipe.area.name, recipe.author.username,
+                              recipe.image, recipe.tags),
+                             (u'Pasta', u'Italy', u'Piemonte', u'cook', None, u'pasta piemonte'))
+            self.assertEqual([step.text for step in recipe.recipestep_set.all()],
+                             [u'Step 0 of Tajarin', u'Step 1 of Tajarin'])
+            self.assertEqual([unicode(i) for i in recipe.ingredient_set.all()],
+                             [u'%d gram food %d of tajarin' % (100 + i, i) for i in range(3)])
+            self.assertEqual([wine.name for wine in recipe.suggested_wine.all()], [u'Barolo'])
+
+
+class CountersTest(CookbookTestCase):
+
+    def assertCounters(self, forks, cook_recipes, other_recipes):
+        self.assertEqual(Recipe.objects.get(id=self.recipe.id).forks_count, forks)
+        self.assertEqual(counters.get_recipes_count(self.user), cook_recipes)
+        self.assertEqual(counters.get_recipes_count(self.other_user), other_recipes)
+
+    def test_counters_follow_save_fork_and_delete(self):
+        self.assertCounters(0, 1, 0)
+        fork = forking.fork_recipe(self.recipe, self.other_user)
+        self.assertCounters(1, 1, 1)
+        manual_fork = self.create_recipe('Tajarin al tartufo', fork_origin=self.recipe)
+        self.assertCounters(2, 2, 1)
+        manual_fork = Recipe.objects.get(id=manual_fork.id)
+        manual_fork.author = self.other_user
+        manual_fork.fork_origin = None
+        manual_fork.save()
+        self.assertCounters(1, 1, 2)
+        Recipe.objects.get(id=fork.id).delete()
+        self.assertCounters(0, 1, 1)
+
+    def test_stale_save_keeps_denormalized_columns(self):
+        stale = Recipe.objects.get(id=self.recipe.id)
+        forking.fork_recipe(self.recipe, self.other_user)
+        RecipeStep.objects.create(recipe=self.recipe, text='Rest', order=2, duration=30)
+        stale.title = 'Tajarin al burro'
+        stale.save()
+        recipe = Recipe.objects.get(id=self.recipe.id)
+        self.assertEqual((recipe.title, recipe.forks_count, recipe.total_duration), (u'Tajarin al burro', 1, 40))
+
+    def test_rebuild_counters(self):
+        forking.fork_recipes([self.recipe], self.other_user)
+        Recipe.objects.update(forks_count=7)
+        AuthorStats.objects.all().delete()
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertCounters(1, 1, 1)
+
+    def test_count_tags_run_no_aggregate(self):
+        forking.fork_recipe(self.recipe, self.other_user)
+        recipe = Recipe.objects.get(id=self.recipe.id)
+        template = Template('{% load cooktags %}{% get_forks_count recipe %}')
+        with QueryCounter() as queries:
+            self.assertEqual(template.render(Context({'recipe': recipe})), '1')
+        self.assertEqual(queries.count, 0)
+        template = Template('{% load cooktags %}{% get_recipes_count_per_user user %}')
+        with QueryCounter() as queries:
+            self.assertEqual(template.render(Context({'user': self.other_user})), '1')
+        self.assertFalse('COUNT' in connection.queries[-1]['sql'])
+
+
+class CachedTagsTest(CookbookTestCase):
+
+    def setUp(self):
+        super(CachedTagsTest, self).setUp()
+        cache.clear()
+        self.recipe.is_for_vegan = True
+        self.recipe.save()
+
+    def render(self, source, **context):
+        return Template('{% load cooktags %}' + source).render(Context(context))
+
+    def test_warm_tags_run_no_queries(self):
+        source = '{% show_vegan_recipes %}{% show_vegetarian_recipes %}{% show_recipes_by_category category %}'
+        with QueryCounter() as cold:
+            html = self.render(source, category=self.category.id)
+        with QueryCounter() as warm:
+            self.assertEqual(self.render(source, category=self.category.id), html)
+        #the three lists, and the category and country tables of the catalog snapshot
+        self.assertEqual(cold.count, 5)
+        self.assertEqual(warm.count, 0)
+        self.assertTrue('Tajarin' in html and 'Pasta' in html and 'Italy' in html)
+
+    def test_recipe_change_invalidates_tags(self):
+        self.assertTrue('Tajarin' in self.render('{% show_vegan_recipes %}'))
+        self.recipe.is_for_vegan = False
+        self.recipe.save()
+        self.assertFalse('Tajarin' in self.render('{% show_vegan_recipes %}'))
+
+    def test_category_change_invalidates_tags(self):
+        self.render('{% show_recipes_by_category category %}', category=self.category.id)
+        self.category.name = 'Fresh pasta'
+        self.category.save()
+        self.assertTrue('Fresh pasta' in self.render('{% show_recipes_by_category category %}',
+                                                     category=self.category.id))
+
+
+class CategoryTreeTest(CookbookTestCase):
+
+    def setUp(self):
+        super(CategoryTreeTest, self).setUp()
+        #mptt updates the tree in the database: parents are reloaded before use
+        self.first = Category.objects.create(name='First courses')
+        self.category.move_to(self.first)
+        self.filled = Category.objects.create(name='Filled pasta', parent=self.reload(self.category))
+        self.soups = Category.objects.create(name='Soups', parent=self.reload(self.first))
+        self.ravioli = self.create_recipe('Ravioli', category=self.filled)
+        self.minestrone = self.create_recipe('Minestrone', category=self.soups)
+
+    def reload(self, category):
+        return Category.objects.get(id=category.id)
+
+    def test_descendants_and_ancestors(self):
+        pasta, filled = self.reload(self.category), self.reload(self.filled)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Category.objects.descendants(pasta)), [pasta, filled])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Category.objects.ancestors(filled)), [self.first, pasta])
+        with self.assertNumQueries(1):
+            self.assertEqual([c.name for c in Category.objects.breadcrumbs(filled)],
+                             ['First courses', 'Pasta', 'Filled pasta'])
+
+    def test_recipes_in_category_subtree(self):
+        pasta = self.reload(self.category)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Recipe.objects.in_category_subtree(pasta)), [self.ravioli, self.recipe])
+        self.assertEqual(list(Recipe.objects.in_category_subtree(self.reload(self.first))),
+                         [self.minestrone, self.ravioli, self.recipe])
+
+    def test_tree_follows_moves_and_deletes(self):
+        soups = self.reload(self.soups)
+        soups.move_to(self.reload(self.category))
+        self.assertEqual(list(Recipe.objects.in_category_subtree(self.reload(self.category))),
+                         [self.minestrone, self.ravioli, self.recipe])
+        self.reload(self.filled).delete()
+        self.assertEqual([c.name for c in Category.objects.descendants(self.reload(self.first))],
+                         ['First courses', 'Pasta', 'Soups'])
+
+    def test_bulk_update_and_touch(self):
+        categories = list(Category.objects.all())
+        self.assertEqual([c.name for c in categories], ['First courses', 'Pasta', 'Filled pasta', 'Soups'])
+        before = datetime.datetime.now()
+        for category in categories:
+            category.order = len(category.name)
+        with self.assertNumQueries(1):
+            self.assertEqual(Category.objects.bulk_update(categories, ['order']), 4)
+        self.assertEqual([(c.order, c.updated >= before) for c in Category.objects.all()],
+                         [(13, True), (5, True), (12, True), (5, True)])
+        before = datetime.datetime.now()
+        self.assertEqual(Category.objects.filter(id=self.soups.id).touch(name='Broths'), 1)
+        self.assertTrue(self.reload(self.soups).updated >= before)
+        self.assertEqual([c.name for c in Category.objects.descendants(self.reload(self.first))],
+                         ['First courses', 'Pasta', 'Filled pasta', 'Broths'])
+
+
+class InvertedIndexSearchTest(CookbookTestCase):
+    backend = 'python'
+
+    def setUp(self):
+        self.old_backend = cookbook_settings.DJANGO_CUISINE_SEARCH_BACKEND
+        cookbook_settings.DJANGO_CUISINE_SEARCH_BACKEND = self.backend
+        super(InvertedIndexSearchTest, self).setUp()
+        self.risotto = self.create_recipe(u'Risotto al Barolo', summary=u'Creamy rice with red wine')
+        RecipeStep.objects.create(recipe=self.risotto, text=u'Toast the rice, then add the wine', order=1)
+        food = Food.objects.create(name=u'Parmigiano', food_type=self.food_type)
+        Ingredient.objects.create(recipe=self.risotto, food=food, unit=self.gram, quantity=50)
+
+    def tearDown(self):
+        cookbook_settings.DJANGO_CUISINE_SEARCH_BACKEND = self.old_backend
+
+    def titles(self, query):
+        return [recipe.title for recipe in search.search(query)]
+
+    def test_search_fields(self):
+        self.assertEqual(self.titles(u'tajarin'), [u'Tajarin'])
+        self.assertEqual(self.titles(u'PIEMONTE'), [u'Tajarin'])
+        self.assertEqual(self.titles(u'parmigiano'), [u'Risotto al Barolo'])
+        self.assertEqual(self.titles(u'toast'), [u'Risotto al Barolo'])
+        self.assertEqual(self.titles(u'creamy rice'), [u'Risotto al Barolo'])
+        self.assertEqual(self.titles(u'creamy tajarin'), [])
+        self.assertEqual(self.titles(u''), [])
+
+    def test_ranking(self):
+        self.create_recipe(u'Rice salad', summary=u'A summer dish')
+        self.assertEqual(self.titles(u'rice'), [u'Rice salad', u'Risotto al Barolo'])
+
+    def test_incremental_updates(self):
+        self.risotto.title = u'Risotto alla Milanese'
+        self.risotto.save()
+        self.assertEqual(self.titles(u'milanese'), [u'Risotto alla Milanese'])
+        self.assertEqual(self.titles(u'barolo'), [])
+        Food.objects.filter(name=u'Parmigiano').get().save()
+        food = Food.objects.get(name=u'Parmigiano')
+        food.name = u'Grana'
+        food.save()
+        self.assertEqual(self.titles(u'grana'), [u'Risotto alla Milanese'])
+        self.risotto.is_published = False
+        self.risotto.save()
+        self.assertEqual(self.titles(u'milanese'), [])
+        fork = forking.fork_recipe(self.recipe, self.other_user)
+        self.assertEqual([r.id for r in search.search(u'tajarin')], [self.recipe.id, fork.id])
+
+    def test_reindex_command(self):
+        search.get_backend().clear()
+        self.assertEqual(self.titles(u'tajarin'), [])
+        call_command('reindex_recipes', stdout=StringIO())
+        self.assertEqual(self.titles(u'tajarin'), [u'Tajarin'])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('cookbook_list:recipe_search'), {'q': u'barolo'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r.title for r in response.context['recipe_list']], [u'Risotto al Barolo'])
+
+
+class FTS5SearchTest(InvertedIndexSearchTest):
+    backend = 'fts5'
+
+
+class PantryTest(CookbookTestCase):
+
+    def setUp(self):
+        super(PantryTest, self).setUp()
+        pantry.reset()
+        self.foods = list(Food.objects.filter(ingredient__recipe=self.recipe).order_by('id'))
+        self.salad = self.create_recipe(u'Salad', ingredients=2)
+
+    def food_ids(self, foods):
+        return [food.id for food in foods]
+
+    def test_coverage(self):
+        recipes = Recipe.objects.cookable_with(self.food_ids(self.foods))
+        self.assertEqual([(r.title, r.coverage, r.missing_food_ids) for r in recipes], [(u'Tajarin', 1.0, [])])
+        recipes = Recipe.objects.cookable_with(self.food_ids(self.foods[:2]), min_coverage=0.5)
+        self.assertEqual([(r.title, r.missing_food_ids) for r in recipes], [(u'Tajarin', [self.foods[2].id])])
+        self.assertEqual(Recipe.objects.cookable_with(self.food_ids(self.foods[:1]), min_coverage=0.5), [])
+
+    def test_ranking(self):
+        salad_foods = list(Food.objects.filter(ingredient__recipe=self.salad))
+        matches = pantry.cookable_with(self.food_ids(self.foods[:2] + salad_foods), min_coverage=0)
+        self.assertEqual([recipe_id for recipe_id, coverage, missing in matches], [self.salad.id, self.recipe.id])
+
+    def test_index_updates(self):
+        food_ids = self.food_ids(self.foods)
+        pantry.cookable_with(food_ids)
+        with QueryCounter() as counter:
+            pantry.cookable_with(food_ids)
+        self.assertEqual(counter.count, 0)
+        index = pantry.get_index()
+        Ingredient.objects.filter(recipe=self.recipe, food=self.foods[2]).get().delete()
+        self.assertEqual(pantry.cookable_with(food_ids[:2]), [(self.recipe.id, 1.0, [])])
+        #the refreshed index replaces the one being read, which is left as it was
+        self.assertFalse(pantry.get_index() is index)
+        self.assertEqual(list(index.foods[self.recipe.id]), food_ids)
+        self.assertEqual(list(index.recipes_by_food[food_ids[2]]), [self.recipe.id])
+        self.assertFalse(food_ids[2] in pantry.get_index().recipes_by_food)
+        self.assertEqual(pantry.get_index().recipes_by_food[food_ids[0]].tolist(), [self.recipe.id])
+        fork = forking.fork_recipe(self.recipe, self.other_user)
+        self.assertEqual(sorted(recipe_id for recipe_id, coverage, missing in pantry.cookable_with(food_ids)),
+                         [self.recipe.id, fork.id])
+        self.recipe.is_published = False
+        self.recipe.save()
+        self.assertEqual(pantry.cookable_with(food_ids), [(fork.id, 1.0, [])])
+        #another process has changed the recipes: the index is reloaded
+        pantry.get_index().foods.clear()
+        caching.bump_version('pantry')
+        self.assertEqual(pantry.cookable_with(food_ids), [(fork.id, 1.0, [])])
+
+    def test_pantry_view(self):
+        response = self.client.get(reverse('cookbook_list:recipe_pantry'),
+                                   {'food': self.food_ids(self.foods[:2]), 'min_coverage': '50'})
+        self.assertEqual(response.status_code, 200)
+        recipe = response.context['recipe_list'][0]
+        self.assertEqual((recipe.title, recipe.coverage_percent, recipe.missing_foods),
+                         (u'Tajarin', 67, [self.foods[2].name]))
+
+
+class UnitsTest(CookbookTestCase):
+    use_numpy = True
+
+    def setUp(self):
+        self.old_numpy = units.numpy
+        if not self.use_numpy:
+            units.numpy = None
+        super(UnitsTest, self).setUp()
+        self.gram.system, self.gram.factor = METRIC, 1
+        self.gram.save()
+        self.kilogram = Unit.objects.create(unit_name='kilogram', code='kg', type=WEIGHT, system=METRIC, factor=1000)
+        self.ounce = Unit.objects.create(unit_name='ounce', code='oz', type=WEIGHT, system=IMPERIAL,
+                                         factor=28.349523125)
+        self.pound = Unit.objects.create(unit_name='pound', code='lb', type=WEIGHT, system=IMPERIAL,
+                                         factor=453.59237)
+        self.millilitre = Unit.objects.create(unit_name='millilitre', code='ml', type=VOLUME, system=METRIC, factor=1)
+        self.cup = Unit.objects.create(unit_name='cup', type=VOLUME, system=IMPERIAL, factor=236.5882365)
+        self.pinch = Unit.objects.create(unit_name='pinch', type=3)
+
+    def tearDown(self):
+        units.numpy = self.old_numpy
+
+    def assertConverted(self, result, expected):
+        quantities, unit_ids = result
+        self.assertEqual(unit_ids, [unit.id if unit else None for quantity, unit in expected])
+        for quantity, (expected_quantity, unit) in zip(quantities, expected):
+            self.assertAlmostEqual(quantity, expected_quantity)
+
+    def test_convert(self):
+        result = units.convert([500, 3, 3, 1, 4], [self.gram.id, self.pound.id, self.pinch.id, self.cup.id, None],
+                               system=METRIC)
+        self.assertConverted(result, [(500, self.gram), (1.36077711, self.kilogram), (3, self.pinch),
+                                      (236.5882365, self.millilitre), (4, None)])
+        result = units.convert([500, 20, 1000], [self.gram.id, self.gram.id, self.millilitre.id], system=IMPERIAL)
+        self.assertConverted(result, [(1.10231131, self.pound), (0.70547924, self.ounce), (4.22675284, self.cup)])
+
+    def test_scale(self):
+        result = units.convert([250, 3, 2], [self.gram.id, self.pinch.id, None], multipliers=[4, 2, 0.5])
+        self.assertConverted(result, [(1000, self.gram), (6, self.pinch), (1, None)])
+        result = units.convert([250, 125], [self.gram.id, self.gram.id], multipliers=4, system=METRIC)
+        self.assertConverted(result, [(1, self.kilogram), (500, self.gram)])
+
+    def test_scale_recipes(self):
+        salad = self.create_recipe('Salad', ingredients=2)
+        with QueryCounter() as counter:
+            result = units.scale_recipes([self.recipe, salad.id], {salad.id: 10}, system=METRIC)
+        self.assertEqual(counter.count, 2)
+        self.assertEqual([(i.unit_id, round(i.quantity, 6)) for i in result[self.recipe.id]],
+                         [(self.gram.id, 100), (self.gram.id, 101), (self.gram.id, 102)])
+        self.assertEqual([(i.unit_id, round(i.quantity, 6)) for i in result[salad.id]],
+                         [(self.kilogram.id, 1), (self.kilogram.id, 1.01)])
+        self.assertEqual([i.quantity for i in self.recipe.scaled_ingredients(2)], [200, 202, 204])
+
+    def test_unit_changes(self):
+        units.convert([1], [self.gram.id], system=METRIC)
+        self.kilogram.delete()
+        self.assertConverted(units.convert([2000], [self.gram.id], system=METRIC), [(2000, self.gram)])
+
+
+class PythonUnitsTest(UnitsTest):
+    use_numpy = False
+
+
+@skipUnless(pairing.is_available(), 'the wine pairing engine needs NumPy')
+class WinePairingTest(CookbookTestCase):
+
+    def setUp(self):
+        super(WinePairingTest, self).setUp()
+        area_type = self.area.type
+        tuscany = AdministrativeArea.objects.create(name='Toscana', country=self.country, type=area_type)
+        france = Country.objects.create(iso_code='FR', iso3_code='FRA', num_code='250', name='France',
+                                        fullname='French Republic', continent='EU')
+        bordeaux_area = AdministrativeArea.objects.create(name='Aquitaine', country=france,
+                                                          type=AdministrativeAreaType.objects.create(name='Region',
+                                                                                                     country=france))
+        self.wine.grape_type.add(GrapeType.objects.create(name='Nebbiolo', origin='Piemonte'))
+        self.moscato = self.create_wine('Moscato', self.area, kind=5)
+        self.chianti = self.create_wine('Chianti', tuscany, kind=1)
+        self.vermentino = self.create_wine('Vermentino', tuscany, kind=2)
+        self.bordeaux = self.create_wine('Bordeaux', bordeaux_area, kind=1)
+        self.recipe.area = self.area
+        self.recipe.save()
+
+    def create_wine(self, name, area, kind):
+        return Wine.objects.create(name=name, code=name, area=area, alcohol_percentage=12, year=2010, kind=kind)
+
+    def names(self, wines):
+        return [wine.name for wine in wines]
+
+    def test_recommended_wines(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names(self.recipe.recommended_wines()),
+                             [u'Barolo', u'Moscato', u'Chianti', u'Bordeaux', u'Vermentino'])
+        self.assertEqual(self.names(self.recipe.recommended_wines(2)), [u'Barolo', u'Moscato'])
+        self.recipe.suggested_wine.clear()
+        self.assertEqual(self.names(self.recipe.recommended_wines()),
+                         [u'Barolo', u'Moscato', u'Chianti', u'Vermentino'])
+
+    def test_wine_changes(self):
+        self.bordeaux.area = self.area
+        self.bordeaux.save()
+        self.assertEqual(self.names(self.recipe.recommended_wines()),
+                         [u'Barolo', u'Bordeaux', u'Moscato', u'Chianti', u'Vermentino'])
+        self.moscato.delete()
+        self.assertEqual(self.names(self.recipe.recommended_wines()),
+                         [u'Barolo', u'Bordeaux', u'Chianti', u'Vermentino'])
+
+    def test_rebuild_and_category_fallback(self):
+        spain = Country.objects.create(iso_code='ES', iso3_code='ESP', num_code='724', name='Spain',
+                                       fullname='Kingdom of Spain', continent='EU')
+        paella = self.create_recipe('Paella', country=spain)
+        paella.suggested_wine.clear()
+        #paella matches no wine: the pairings of its category, last refreshed
+        #by a wine change before the area of the recipe was set, are used
+        self.assertEqual(self.names(paella.recommended_wines()),
+                         [u'Barolo', u'Chianti', u'Bordeaux', u'Moscato', u'Vermentino'])
+        call_command('rebuild_wine_pairings', stdout=StringIO())
+        self.assertEqual(self.names(paella.recommended_wines()),
+                         [u'Barolo', u'Moscato', u'Chianti', u'Bordeaux', u'Vermentino'])
+        self.assertEqual(self.names(self.recipe.recommended_wines(3)), [u'Barolo', u'Moscato', u'Chianti'])
+        #a wine change refreshes the categories of the recipes sharing its features
+        self.bordeaux.area = self.area
+        self.bordeaux.save()
+        self.assertEqual(self.names(paella.recommended_wines()),
+                         [u'Barolo', u'Bordeaux', u'Moscato', u'Chianti', u'Vermentino'])
+
+    def test_wine_change_scores_sharing_recipes_only(self):
+        spain = Country.objects.create(iso_code='ES', iso3_code='ESP', num_code='724', name='Spain',
+                                       fullname='Kingdom of Spain', continent='EU')
+        paella = self.create_recipe('Paella', country=spain)
+        paella.suggested_wine.clear()
+        champagne = self.create_wine('Champagne', self.bordeaux.area, kind=4)
+        self.assertEqual(pairing.sharing_recipes(champagne.id), set())
+        self.assertEqual(pairing.sharing_recipes(self.chianti.id), set([self.recipe.id]))
+        with QueryCounter() as unrelated:
+            champagne.save()
+        with QueryCounter() as related:
+            self.chianti.save()
+        self.assertTrue(unrelated.count < related.count)
+        self.assertEqual(self.names(self.recipe.recommended_wines(3)), [u'Barolo', u'Moscato', u'Chianti'])
+        self.wine.recipes.clear()
+        self.assertEqual(self.names(self.recipe.recommended_wines()),
+                         [u'Barolo', u'Moscato', u'Chianti', u'Vermentino'])
+
+
+class BulkLoadTest(TestCase):
+
+    def load(self, items):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.write(fd, json.dumps(items))
+        os.close(fd)
+        try:
+            call_command('bulk_loaddata', path, stdout=StringIO())
+        finally:
+            os.remove(path)
+
+    def test_streaming_parser(self):
+        text = json.dumps([{'a': [1, 2, {'b': 'x], ['}]}, 12345, u'\xe8', [], {'c': None}], indent=2)
+        for chunk_size in (1, 2, 3, 7, 64 * 1024):
+            self.assertEqual(list(bulkload.iter_json_array(StringIO(text), chunk_size)), json.loads(text))
+        self.assertEqual(list(bulkload.iter_json_array(StringIO(u' [ ] '))), [])
+        self.assertRaises(ValueError, list, bulkload.iter_json_array(StringIO(text[:-3]), 5))
+
+    def test_natural_keys(self):
+        items = [
+            {'pk': 7, 'model': 'geo.country', 'fields': {'name': 'Italy', 'iso_code': 'IT', 'iso3_code': 'ITA',
+                                                         'num_code': '380', 'fullname': 'Italy', 'continent': 'EU'}},
+            {'pk': 3, 'model': 'geo.administrativeareatype',
+             'fields': {'name': 'Regione', 'country': ['IT'], 'parent': None, 'lft': 1, 'rght': 2, 'level': 0,
+                        'tree_id': 1, '_order': 0}},
+            {'pk': 5, 'model': 'geo.administrativearea',
+             'fields': {'name': 'Piemonte', 'country': ['IT'], 'type': ['IT', 'Regione'], 'parent': None,
+                        'lft': 1, 'rght': 2, 'level': 0, 'tree_id': 1, '_order': 0}},
+            {'pk': 9, 'model': 'geo.location',
+             'fields': {'name': 'Torino', 'country': ['IT'], 'area': ['IT', 'Piemonte'], 'lat': '45.07',
+                        'lng': None, '_order': 0}},
+        ]
+        self.load(items)
+        location = Location.objects.get(name='Torino')
+        self.assertEqual((location.pk, location.country.pk, location.area.pk, location.area.type.pk),
+                         (9, 7, 5, 3))
+        self.load(items)
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_geo_fixtures(self):
+        call_command('bulk_loaddata', 'countries', 'italy_full', stdout=StringIO())
+        self.assertEqual((Country.objects.count(), AdministrativeArea.objects.count(), Location.objects.count()),
+                         (253, 130, 8102))
+        self.assertEqual(Location.objects.get(name='Agrigento').area.name, u'Provincia di Agrigento')
+
+
+class ShoppingListTest(CookbookTestCase):
+
+    def setUp(self):
+        super(ShoppingListTest, self).setUp()
+        self.gram.system, self.gram.factor = METRIC, 1
+        self.gram.save()
+        self.kilogram = Unit.objects.create(unit_name='kilogram', code='kg', type=WEIGHT, system=METRIC, factor=1000)
+        self.ounce = Unit.objects.create(unit_name='ounce', code='oz', type=WEIGHT, system=IMPERIAL,
+                                         factor=28.349523125)
+        self.pinch = Unit.objects.create(unit_name='pinch', type=3)
+        vegetables = FoodType.objects.create(type_name='Vegetables')
+        self.flour = Food.objects.create(name='Flour', food_type=self.food_type)
+        self.salt = Food.objects.create(name='Salt', food_type=self.food_type)
+        self.onion = Food.objects.create(name='Onion', food_type=vegetables)
+        self.recipes = Recipe.objects.bulk_create([
+            Recipe(title='Bread %d' % i, difficulty=1, category=self.category, country=self.country, author=self.user)
+            for i in range(100)])
+        self.recipe_ids = list(Recipe.objects.filter(title__startswith='Bread').values_list('id', flat=True))
+        Ingredient.objects.bulk_create([Ingredient(recipe_id=recipe_id, food=food, unit=unit, quantity=quantity)
+                                        for recipe_id in self.recipe_ids for food, unit, quantity in (
+                                            (self.flour, self.kilogram, 0.5), (self.flour, self.ounce, 1),
+                                            (self.salt, self.pinch, 1), (self.onion, None, 1))])
+
+    def test_build(self):
+        items = shopping.build_shopping_list(self.recipe_ids[:2])
+        self.assertEqual([(type_name, [(item.food_name, [(round(q, 4), unit) for q, unit in item.quantities])
+                                       for item in items]) for type_name, items in items],
+                         [(u'Cereals', [(u'Flour', [(1.0567, u'kg')]), (u'Salt', [(2, u'pinch')])]),
+                          (u'Vegetables', [(u'Onion', [(2, u'')])])])
+        items = shopping.build_shopping_list(self.recipe_ids[:1], multiplier={self.recipe_ids[0]: 0.5}, system=IMPERIAL)
+        self.assertAlmostEqual(items[0][1][0].quantities[0][0], 0.5 * (500 / 28.349523125 + 1))
+
+    def test_constant_queries(self):
+        shopping.build_shopping_list([self.recipe.id])
+        with QueryCounter() as counter:
+            shopping.build_shopping_list([self.recipe.id])
+        with QueryCounter() as counter_100:
+            items = shopping.build_shopping_list(self.recipe_ids)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(counter_100.count, 1)
+        self.assertAlmostEqual(items[0][1][0].quantities[0][0], 100 * (0.5 + 0.028349523125))
+
+    def test_shopping_list_view(self):
+        url = reverse('cookbook_list:recipe_shopping_list')
+        response = self.client.get(url, {'recipe': self.recipe_ids[:3]})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Flour: 1.59 kg')
+        response = self.client.get(url, {'recipe': self.recipe_ids[:3], 'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response.content.splitlines()[:2], ['food_type,food,quantity,unit', 'Cereals,Flour,1.59,kg'])
+        response = self.client.get(url, {'recipe': self.recipe_ids[:3], 'format': 'json'})
+        self.assertEqual(simplejson.loads(response.content)[1],
+                         {'food_type': 'Vegetables', 'foods': [{'id': self.onion.id, 'name': 'Onion',
+                                                                'quantities': [{'quantity': 3, 'unit': ''}]}]})
+
+class GeoLookupTest(CookbookTestCase):
+
+    def setUp(self):
+        super(GeoLookupTest, self).setUp()
+        Location.objects.create(name=u'Alba', country=self.country, area=self.area)
+        Location.objects.create(name=u'Santo Stefano Belbo', country=self.country, area=self.area)
+        Location.objects.create(name=u'Forl\xec', country=self.country)
+
+    def test_search(self):
+        self.assertEqual([label for obj_id, label in lookups.search('location', 'al')], [u'Alba (Piemonte)'])
+        #any word of the name matches, whole names first
+        Location.objects.create(name=u'Stefanaconi', country=self.country)
+        self.assertEqual([label for obj_id, label in lookups.search('location', 'STEF')],
+                         [u'Stefanaconi', u'Santo Stefano Belbo (Piemonte)'])
+        self.assertEqual([label for obj_id, label in lookups.search('location', 'forli')], [u'Forl\xec'])
+        self.assertEqual(lookups.search('location', ' '), [])
+        self.assertEqual(lookups.search('area', 'pie'), [(self.area.id, u'Piemonte (Italy)')])
+        self.assertEqual(lookups.label('country', str(self.country.id)), u'Italy')
+
+    def test_geo_lookup_view(self):
+        response = self.client.get(reverse('cookbook_list:geo_lookup', args=('location',)), {'q': 'san'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(simplejson.loads(response.content), [
+            {'id': Location.objects.get(name='Santo Stefano Belbo').id, 'label': 'Santo Stefano Belbo (Piemonte)'}])
+
+    def test_forms_do_not_load_geo_tables(self):
+        wine_form = WineForm(instance=self.wine)
+        recipe_form = RecipeForm(instance=self.recipe)
+        lookups.search('location', 'a')
+        lookups.search('area', 'a')
+        lookups.search('country', 'a')
+        with QueryCounter() as counter:
+            html = unicode(wine_form['area']) + unicode(wine_form['place']) + unicode(recipe_form['country'])
+        geo_queries = [query['sql'] for query in connection.queries[counter.start:] if 'geo_' in query['sql']]
+        self.assertEqual(geo_queries, [])
+        self.assertIn(u'value="Piemonte (Italy)"', html)
+        self.assertIn(reverse('cookbook_list:geo_lookup', args=('location',)), html)
+
+class KeysetPaginationTest(CookbookTestCase):
+
+    def setUp(self):
+        super(KeysetPaginationTest, self).setUp()
+        #duplicated titles: the primary key breaks the ties
+        Recipe.objects.bulk_create([Recipe(title='Risotto %02d' % (i // 2), summary=str(i), difficulty=1,
+                                           category=self.category, country=self.country, author=self.user)
+                                    for i in range(30)])
+        self.titles = list(Recipe.objects.order_by('title', 'id').values_list('title', 'id'))
+
+    def test_pages(self):
+        paginator = pagination.KeysetPaginator(Recipe.objects.all(), 10)
+        page, seen = paginator.page(), []
+        self.assertFalse(page.has_previous())
+        while True:
+            seen.extend((recipe.title, recipe.id) for recipe in page)
+            if not page.has_next():
+                break
+            page = paginator.page(after=page.next_cursor)
+        self.assertEqual(seen, self.titles)
+        previous = paginator.page(before=page.previous_cursor)
+        self.assertEqual([(recipe.title, recipe.id) for recipe in previous], self.titles[20:30])
+        previous = paginator.page(before=paginator.page(before=previous.previous_cursor).previous_cursor)
+        self.assertEqual([(recipe.title, recipe.id) for recipe in previous], self.titles[:10])
+        self.assertFalse(previous.has_previous())
+        self.assertRaises(pagination.InvalidCursor, paginator.page, after='garbage')
+
+    def test_list_view(self):
+        url = reverse('cookbook_list:recipe_list')
+        cache.clear()
+        self.client.get(url)
+        with QueryCounter() as counter:
+            response = self.client.get(url)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(response.context['approximate_count'], 31)
+        recipes = response.context['object_list']
+        self.assertEqual([recipe.title for recipe in recipes], [title for title, recipe_id in self.titles[:25]])
+        self.assertTrue(recipes[0]._deferred)
+        response = self.client.get(url, {'after': response.context['page_obj'].next_cursor})
+        self.assertEqual(len(response.context['object_list']), 6)
+        self.assertContains(response, 'Tajarin')
+
+class AdminPerformanceTest(CookbookTestCase):
+
+    def setUp(self):
+        super(AdminPerformanceTest, self).setUp()
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        countries = [Country.objects.create(iso_code='F%d' % i, iso3_code='FR%d' % i, num_code='%d' % i,
+                                            name='Country %d' % i, fullname='Country %d' % i, continent='EU')
+                     for i in range(5)]
+        Recipe.objects.bulk_create([Recipe(title='%s recipe %d' % ('ABC'[i % 3], i), difficulty=1,
+                                           category=self.category, country=countries[i % 5], author=self.user)
+                                    for i in range(40)])
+        Wine.objects.bulk_create([Wine(name='Wine %d' % i, code='W%d' % i, area=self.area, alcohol_percentage=11 + i % 4,
+                                       year=1995 + i, kind=1) for i in range(20)])
+        cache.clear()
+
+    def tearDown(self):
+        for model_admin in admin.site._registry.values():
+            model_admin.__dict__.pop('performance_mode', None)
+
+    def use_admin(self, model, performance_mode):
+        #the admin views are bound to the registered instances
+        admin.site._registry[model].performance_mode = performance_mode
+
+    def changelist(self, url, params=None):
+        self.client.get(url, params or {})
+        with QueryCounter() as counter:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in connection.queries[counter.start:]]
+
+    def test_recipe_changelist(self):
+        url = reverse('admin:cookbook_recipe_changelist')
+        self.use_admin(Recipe, False)
+        response, default_queries = self.changelist(url)
+        self.assertTrue([sql for sql in default_queries if 'DISTINCT' in sql])
+        self.use_admin(Recipe, True)
+        response, queries = self.changelist(url)
+        self.assertEqual([sql for sql in queries if 'DISTINCT' in sql or 'COUNT(' in sql], [])
+        self.assertTrue(len(queries) < len(default_queries))
+        self.assertEqual(response.context['cl'].result_count, 41)
+        self.assertEqual([choice['display'] for choice in response.context['cl'].filter_specs[0].choices(
+            response.context['cl'])], ['All', 'A', 'B', 'C', 'T'])
+        self.assertContains(response, 'Country 4')
+        #a filtered list is counted exactly
+        response, queries = self.changelist(url, {'title__istartswith': 'b'})
+        self.assertEqual(response.context['cl'].result_count, 13)
+        self.assertEqual(response.context['cl'].full_result_count, 41)
+
+    def test_wine_changelist(self):
+        url = reverse('admin:cookbook_wine_changelist')
+        self.use_admin(Wine, True)
+        response, queries = self.changelist(url, {'year__gte': '2000', 'year__lt': '2010'})
+        self.assertEqual(response.context['cl'].result_count, 11)
+        self.assertEqual([sql for sql in queries if 'DISTINCT' in sql or 'MIN(' in sql], [])
+        cl = response.context['cl']
+        self.assertEqual([choice['display'] for choice in cl.filter_specs[0].choices(cl)],
+                         ['All', '1990 - 2000', '2000 - 2010', '2010 - 2020'])
+        self.assertEqual([choice['display'] for choice in cl.filter_specs[2].choices(cl)][1:],
+                         ['10 - 12', '12 - 14', '14 - 16'])
+
+    def test_estimated_count_only_displayed(self):
+        url = reverse('admin:cookbook_recipe_changelist')
+        self.use_admin(Recipe, True)
+        self.assertEqual(pagination.approximate_count(Recipe), 41)
+        #the cached estimate misses these ones
+        Recipe.objects.bulk_create([Recipe(title='D recipe %d' % i, difficulty=1, category=self.category,
+                                           country=self.country, author=self.user) for i in range(60)])
+        paginator = admin.site._registry[Recipe].get_paginator(None, Recipe.objects.order_by('id'), 20)
+        self.assertEqual((paginator.count, paginator.num_pages), (41, 3))
+        self.assertEqual(len(paginator.page(6).object_list), 1)
+        self.assertRaises(EmptyPage, paginator.page, 7)
+        #100 recipes per page
+        response, queries = self.changelist(url)
+        self.assertEqual((response.context['cl'].result_count, len(response.context['cl'].result_list)), (41, 100))
+        response, queries = self.changelist(url, {'p': '1'})
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        response = self.client.get(url, {'p': '2'})
+        self.assertRedirects(response, url + '?e=1')
+
+
+class CompositeIndexesTest(TestCase):
+
+    def test_created_by_syncdb(self):
+        names = [indexes.index_name(model, field_names) for model, field_names in indexes.INDEXES]
+        self.assertEqual(indexes.existing_indexes(), set(names))
+        indexes.drop_indexes()
+        self.assertEqual(indexes.existing_indexes(), set())
+        self.assertEqual(indexes.create_indexes(), names)
+        self.assertEqual(indexes.create_indexes(), [])
+
+    def test_syncdb_output(self):
+        indexes.drop_indexes()
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            call_command('syncdb', interactive=False, verbosity=0)
+            self.assertEqual(sys.stdout.getvalue(), '')
+            indexes.drop_indexes()
+            call_command('syncdb', interactive=False, verbosity=1)
+            self.assertIn('Creating index cookbook_recipe_is_published_is_for_vegan_title_idx\n', sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(len(indexes.existing_indexes()), len(indexes.INDEXES))
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_query_plans(self):
+        cursor = connection.cursor()
+        for queryset, name in ((Recipe.veg_objects.vegan_friendly(), 'is_published_is_for_vegan_title_idx'),
+                               (Recipe.pub_objects.filter(category=1), 'category_id_is_published_title_idx'),
+                               (history.entries(Recipe(id=1)), 'content_type_id_object_id_action_time_idx')):
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = u' '.join(row[-1] for row in cursor.fetchall())
+            self.assertIn(name, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite benchmark database')
+    def test_benchmark_command(self):
+        stdout = StringIO()
+        call_command('benchmark_indexes', recipes=200, samples=2, stdout=stdout)
+        output = stdout.getvalue()
+        self.assertTrue(output.startswith('200 recipes generated in '))
+        self.assertIn('With the composite indexes', output)
+
+
+class DataGeneratorTest(TestCase):
+
+    def test_generate(self):
+        counts = DataGenerator(seed=7).generate(60, steps=2, ingredients=3, categories=8, foods=20, wines=10)
+        self.assertEqual(counts['Recipe'], 60)
+        self.assertEqual(counts['RecipeStep'], 120)
+        self.assertEqual(counts['Ingredient'], 180)
+        recipes = Recipe.objects.all()
+        self.assertEqual(recipes.count(), 60)
+        for recipe in recipes.filter(forks_count__gt=0):
+            self.assertEqual(recipe.forks_count, Recipe.objects.filter(fork_origin=recipe).count())
+        for stats in AuthorStats.objects.all():
+            self.assertEqual(stats.recipes_count, Recipe.objects.filter(author=stats.user).count())
+        #the categories are a valid tree
+        for category in Category.objects.filter(level=0):
+            self.assertEqual(category.get_descendant_count(), category.get_children().count())
+        self.assertEqual(Ingredient.objects.filter(recipe=recipes[0]).count(), 3)
+        for recipe in recipes[:10]:
+            self.assertEqual(recipe.total_duration, sum(recipe.recipestep_set.values_list('duration', flat=True)))
+
+    def test_seeded(self):
+        DataGenerator(seed=3).generate(20, categories=4, foods=10, wines=5)
+        DataGenerator(seed=3).generate(20, categories=4, foods=10, wines=5)
+        titles = list(Recipe.objects.order_by('id').values_list('title', flat=True))
+        self.assertEqual(titles[:20], titles[20:])
+
+
+class BenchmarksTest(TestCase):
+
+    def test_run_and_compare(self):
+        DataGenerator().generate(30, categories=4, foods=10, wines=5)
+        results = benchmarks.run(iterations=3, only='managers.')
+        self.assertEqual(sorted(results['cases']), ['managers.category_subtree', 'managers.history_50_recipes',
+                                                     'managers.published', 'managers.recipe_detail', 'managers.vegan'])
+        for result in results['cases'].values():
+            self.assertTrue(result['p50_ms'] <= result['p95_ms'] <= result['max_ms'])
+            self.assertTrue(result['queries'] >= 1)
+        self.assertEqual(results['meta']['recipes'], 30)
+        simplejson.loads(simplejson.dumps(results))
+        slower = {'cases': dict((name, dict(result, p50_ms=result['p50_ms'] * 2 + 1))
+                                for name, result in results['cases'].items())}
+        rows = benchmarks.compare(results, slower)
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(row[-1] for row in rows))
+        self.assertFalse(any(row[-1] for row in benchmarks.compare(results, results)))
+        self.assertFalse(User.objects.filter(username=benchmarks.BENCHMARK_USER).exists())
+
+    def test_existing_user_is_kept(self):
+        user = User.objects.create_user(benchmarks.BENCHMARK_USER, 'benchmark@example.com', 'secret')
+        benchmarks.run(iterations=1, only='managers.published')
+        self.assertTrue(User.objects.get(id=user.id).check_password('secret'))
+
+    def test_percentile(self):
+        self.assertEqual(benchmarks.percentile(range(1, 101), 50), 50)
+        self.assertEqual(benchmarks.percentile(range(1, 101), 95), 95)
+        self.assertEqual(benchmarks.percentile([3], 95), 3)
+
+
+class InstrumentationTest(CookbookTestCase):
+
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        self.records = []
+        self.handler = logging.Handler()
+        self.handler.emit = self.records.append
+        self.handlers, self.level = instrumentation.logger.handlers, instrumentation.logger.level
+        instrumentation.logger.handlers = [self.handler]
+        instrumentation.logger.setLevel(logging.INFO)
+        self.settings = dict((name, getattr(cookbook_settings, name)) for name in dir(cookbook_settings)
+                             if name.startswith('DJANGO_CUISINE_INSTRUMENTATION_'))
+        cookbook_settings.DJANGO_CUISINE_INSTRUMENTATION_SAMPLE_RATE = 1.0
+        cookbook_settings.DJANGO_CUISINE_INSTRUMENTATION_HEADER = True
+        #requests empty connection.queries: the counters must start from an empty list
+        reset_queries()
+
+    def tearDown(self):
+        instrumentation.logger.handlers = self.handlers
+        instrumentation.logger.setLevel(self.level)
+        for name, value in self.settings.items():
+            setattr(cookbook_settings, name, value)
+        super(InstrumentationTest, self).tearDown()
+
+    def test_duplicates(self):
+        statements = ['SELECT * FROM food WHERE id = 1', 'SELECT * FROM food WHERE id = 2',
+                      'SELECT * FROM food WHERE id = 1', "SELECT * FROM unit WHERE code = 'g'",
+                      'SELECT * FROM food WHERE id IN (1, 2, 3)', 'SELECT * FROM food WHERE id IN (4)']
+        self.assertEqual(instrumentation.normalize("SELECT 'it''s' FROM t WHERE a = 1.5 AND b IN (1, 2)"),
+                         'SELECT ? FROM t WHERE a = ? AND b IN (...)')
+        self.assertEqual(instrumentation.duplicates(statements), (
+            1, 3, [(3, 'SELECT * FROM food WHERE id = ?'), (2, 'SELECT * FROM food WHERE id IN (...)')]))
+
+    def test_middleware(self):
+        url = reverse('cookbook_list:recipe_list')
+        with QueryCounter() as counter:
+            response = self.client.get(url)
+        record = self.records[-1].instrumentation
+        self.assertEqual(record['queries'], counter.count)
+        self.assertEqual(record['view'], 'cookbook.views_helpers.ListView')
+        self.assertEqual(record['size'], len(response.content))
+        self.assertEqual(record['templates'], 1)
+        self.assertEqual(simplejson.loads(self.records[-1].getMessage())['path'], url)
+        self.assertIn('queries=%d' % counter.count, response[instrumentation.HEADER])
+        #the queries are recorded only while instrumenting
+        self.assertFalse(connection.use_debug_cursor)
+
+    def test_repeated_queries(self):
+        User.objects.filter(username='cook').update(is_staff=True, is_superuser=True)
+        self.client.login(username='cook', password='cook')
+        self.client.get(reverse('admin:cookbook_recipe_change', args=(self.recipe.id,)))
+        record = self.records[-1]
+        self.assertEqual(record.levelno, logging.WARNING)
+        self.assertEqual(record.instrumentation['view'], 'django.contrib.admin.options.change_view')
+        #the food and unit choices are queried again for each ingredient form
+        repeated = [repeated['sql'] for repeated in record.instrumentation['repeated']]
+        self.assertTrue([sql for sql in repeated if 'FROM "cookbook_food"' in sql])
+        self.assertTrue(record.instrumentation['similar'] >= 10)
+
+    def test_sampling(self):
+        cookbook_settings.DJANGO_CUISINE_INSTRUMENTATION_SAMPLE_RATE = 0
+        response = self.client.get(reverse('cookbook_list:recipe_list'))
+        self.assertFalse(response.has_header(instrumentation.HEADER))
+        self.assertEqual(self.records, [])
+
+
+class TagCloudTest(CookbookTestCase):
+
+    def setUp(self):
+        super(TagCloudTest, self).setUp()
+        cache.clear()
+        tagcloud.reset()
+        self.create_recipe('Bagna cauda', tags='piemonte winter')
+        self.create_recipe('Panna cotta', tags='piemonte summer quick')
+        self.create_recipe('Vitello tonnato', tags='piemonte summer', is_published=False)
+
+    def test_counts(self):
+        self.assertEqual(counters.get_tag_counts(Recipe), {'pasta': 1, 'piemonte': 4, 'winter': 1, 'summer': 2,
+                                                           'quick': 1})
+        recipe = Recipe.objects.get(title='Bagna cauda')
+        recipe.tags = 'piemonte summer'
+        recipe.save()
+        self.assertEqual(counters.get_tag_counts(Recipe)['summer'], 3)
+        self.assertNotIn('winter', counters.get_tag_counts(Recipe))
+        #the tagging rows of a deleted recipe are deleted with it
+        recipe.delete()
+        self.assertEqual(counters.get_tag_counts(Recipe)['piemonte'], 3)
+        self.assertFalse(TaggedItem.objects.filter(object_id=recipe.id,
+                                                   content_type__model='recipe').exists())
+        forking.fork_recipes([self.recipe.id], self.other_user)
+        self.assertEqual(counters.get_tag_counts(Recipe)['pasta'], 2)
+        counts = counters.get_tag_counts(Recipe)
+        TagStats.objects.update(items_count=0)
+        counters.rebuild_counters()
+        self.assertEqual(counters.get_tag_counts(Recipe), counts)
+
+    def test_intersection(self):
+        self.assertEqual(tagcloud.tagged_ids(Recipe, ['piemonte', 'summer']),
+                         [Recipe.objects.get(title='Panna cotta').id])
+        self.assertEqual(tagcloud.tagged_ids(Recipe, ['summer', 'winter']), [])
+        self.assertEqual(tagcloud.tagged_ids(Recipe, ['unknown']), [])
+        #the index is refreshed incrementally, without reloading it, into a
+        #new index: the one being read is left as it was
+        index = tagcloud.get_index(Recipe)
+        recipe = Recipe.objects.get(title='Vitello tonnato')
+        recipe.is_published = True
+        recipe.save()
+        with QueryCounter() as counter:
+            ids = tagcloud.tagged_ids(Recipe, ['summer', 'piemonte'])
+        self.assertEqual(ids, sorted([recipe.id, Recipe.objects.get(title='Panna cotta').id]))
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(index.intersection(['summer', 'piemonte']), [Recipe.objects.get(title='Panna cotta').id])
+        #another process changed the tags
+        index = tagcloud.get_index(Recipe)
+        caching.bump_version('tags')
+        self.assertFalse(tagcloud.get_index(Recipe) is index)
+
+    def test_cloud(self):
+        cloud = tagcloud.get_cloud(Recipe)
+        self.assertEqual([(tag.name, tag.count) for tag in cloud],
+                         [('pasta', 1), ('piemonte', 4), ('quick', 1), ('summer', 2), ('winter', 1)])
+        self.assertEqual(dict((tag.name, tag.font_size) for tag in cloud)['piemonte'], 4)
+        with QueryCounter() as counter:
+            tagcloud.get_cloud(Recipe)
+        self.assertEqual(counter.count, 0)
+        self.create_recipe('Bollito misto', tags='winter')
+        self.assertEqual(dict((tag.name, tag.count) for tag in tagcloud.get_cloud(Recipe))['winter'], 2)
+
+    def test_view(self):
+        response = self.client.get(reverse('cookbook_list:tagged', args=('recipe', 'piemonte+summer')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([recipe.title for recipe in response.context['object_list']], ['Panna cotta'])
+        self.assertContains(response, reverse('cookbook_list:tagged', args=('recipe', 'piemonte+summer+quick')))
+        response = self.client.get(reverse('cookbook_list:tag_cloud', args=('wine',)))
+        self.assertEqual(response.status_code, 200)
+
+
+class ThumbnailsTest(CookbookTestCase):
+
+    def setUp(self):
+        super(ThumbnailsTest, self).setUp()
+        self.workers = cookbook_settings.DJANGO_CUISINE_THUMBNAIL_WORKERS
+        cookbook_settings.DJANGO_CUISINE_THUMBNAIL_WORKERS = 0
+        #the filer storages write in a temporary MEDIA_ROOT
+        self.media_root = tempfile.mkdtemp()
+        field = Image._meta.get_field('file')
+        self.storages = [storage for storage in (field.storages['public'], field.thumbnail_storages['public'])]
+        self.locations = [(storage.location, storage.base_location) for storage in self.storages]
+        for storage in self.storages:
+            storage.location = storage.base_location = self.media_root
+        stream = StringIO()
+        PILImage.new('RGB', (800, 600), 'red').save(stream, 'JPEG')
+        self.image = Image.objects.create(original_filename='tajarin.jpg',
+                                          file=ContentFile(stream.getvalue(), name='tajarin.jpg'))
+
+    def tearDown(self):
+        for storage, (location, base_location) in zip(self.storages, self.locations):
+            storage.location, storage.base_location = location, base_location
+        shutil.rmtree(self.media_root)
+        cookbook_settings.DJANGO_CUISINE_THUMBNAIL_WORKERS = self.workers
+        super(ThumbnailsTest, self).tearDown()
+
+    def thumbnail_files(self):
+        return sorted(name for path, dirs, files in os.walk(self.media_root) for name in files
+                      if '_thumbnails' in path)
+
+    def test_generated_when_attached(self):
+        self.assertEqual(sorted(thumbnails.alias_options(Recipe)), ['detail', 'list'])
+        self.recipe.image = self.image
+        self.recipe.save()
+        self.assertEqual(len(self.thumbnail_files()), 2)
+        url = thumbnails.thumbnail_url(self.recipe, 'list')
+        self.assertIn('160x120', url)
+        self.assertEqual(Template('{% load cooktags %}{% get_thumbnail_url recipe "list" %}').render(
+            Context({'recipe': Recipe.objects.get(id=self.recipe.id)})), url)
+        #saving again does not queue the image again
+        with QueryCounter() as counter:
+            self.recipe.save()
+        self.assertFalse([query for query in connection.queries[counter.start:]
+                          if 'easy_thumbnails' in query['sql']])
+
+    def test_render_time_fallback(self):
+        step = RecipeStep.objects.filter(recipe=self.recipe)[0]
+        RecipeStep.objects.filter(id=step.id).update(image=self.image)
+        step = RecipeStep.objects.get(id=step.id)
+        #the missing thumbnail is queued, the original image is shown meanwhile
+        self.assertEqual(thumbnails.thumbnail_url(step, 'step'), self.image.url)
+        self.assertIn('320x240', thumbnails.thumbnail_url(step, 'step'))
+        self.assertEqual(thumbnails.thumbnail_url(step, 'unknown'), self.image.url)
+        self.assertEqual(thumbnails.thumbnail_url(self.recipe, 'list'), '')
+
+    def test_backfill(self):
+        Recipe.objects.filter(id=self.recipe.id).update(image=self.image)
+        Wine.objects.filter(id=self.wine.id).update(image=self.image)
+        self.assertEqual([(image_id, len(options)) for image_id, options in thumbnails.images_to_backfill()],
+                         [(self.image.id, 3)])
+        stdout = StringIO()
+        call_command('generate_thumbnails', workers=0, stdout=stdout)
+        self.assertEqual(stdout.getvalue().split(' in ')[0], '3 thumbnails of 1 images generated')
+        self.assertEqual(len(self.thumbnail_files()), 3)
+
+    def test_queued_for_the_command(self):
+        cookbook_settings.DJANGO_CUISINE_THUMBNAIL_WORKERS = 2
+        self.recipe.image = self.image
+        self.recipe.save()
+        self.assertEqual(thumbnails.thumbnail_url(self.recipe, 'list'), self.image.url)
+        self.assertEqual(list(PendingThumbnail.objects.values_list('image', flat=True)), [self.image.id])
+        self.assertEqual(self.thumbnail_files(), [])
+        stdout = StringIO()
+        call_command('generate_thumbnails', pending=True, workers=0, stdout=stdout)
+        self.assertEqual(stdout.getvalue().split(' in ')[0], '2 thumbnails of 1 images generated')
+        self.assertEqual(PendingThumbnail.objects.count(), 0)
+        self.assertIn('160x120', thumbnails.thumbnail_url(self.recipe, 'list'))
+        stdout = StringIO()
+        call_command('generate_thumbnails', pending=True, workers=0, stdout=stdout)
+        self.assertEqual(stdout.getvalue().split(' in ')[0], '0 thumbnails of 0 images generated')
+
+
+class RecipeCacheTest(CookbookTestCase):
+
+    def setUp(self):
+        super(RecipeCacheTest, self).setUp()
+        cache.clear()
+
+    def assertCached(self, recipe_id, cached=True):
+        with QueryCounter() as counter:
+            recipe = recipe_cache.get_recipe(recipe_id)
+        self.assertEqual(counter.count == 0, cached)
+        return recipe
+
+    def test_read_through(self):
+        self.assertCached(self.recipe.id, False)
+        recipe = self.assertCached(self.recipe.id)
+        with self.assertNumQueries(0):
+            self.assertEqual([step.text for step in recipe.recipestep_set.all()],
+                             [u'Step 0 of Tajarin', u'Step 1 of Tajarin'])
+            self.assertEqual([unicode(i) for i in recipe.ingredient_set.all()],
+                             [u'%d gram food %d of tajarin' % (100 + i, i) for i in range(3)])
+            self.assertEqual((recipe.category.name, recipe.author.username, recipe.forks_count),
+                             (u'Pasta', u'cook', 0))
+            response = self.client.get(reverse('cookbook_list:recipe_detail', args=(self.recipe.id,)))
+        self.assertContains(response, u'Step 1 of Tajarin')
+        self.assertContains(response, u'101 gram food 1 of tajarin')
+        self.assertContains(response, u'Barolo')
+        self.assertRaises(Recipe.DoesNotExist, recipe_cache.get_recipe, self.recipe.id + 1000)
+
+    def test_invalidation(self):
+        step = self.recipe.recipestep_set.all()[0]
+        ingredient = self.recipe.ingredient_set.all()[0]
+
+        def edit(model, obj_id, **values):
+            obj = model.objects.get(id=obj_id)
+            for name, value in values.items():
+                setattr(obj, name, value)
+            obj.save()
+
+        changes = [
+            (lambda: Recipe.objects.get(id=self.recipe.id).save(),
+             lambda recipe: recipe.title, u'Tajarin'),
+            (lambda: edit(RecipeStep, step.id, text='Boil'),
+             lambda recipe: recipe.recipestep_set.all()[0].text, u'Boil'),
+            (lambda: Ingredient.objects.create(recipe=self.recipe, food=ingredient.food, quantity=1, order=9),
+             lambda recipe: len(recipe.ingredient_set.all()), 4),
+            (lambda: edit(Food, ingredient.food_id, name='flour'),
+             lambda recipe: recipe.ingredient_set.all()[0].food.name, u'flour'),
+            (lambda: edit(Unit, self.gram.id, code='gr'),
+             lambda recipe: recipe.ingredient_set.all()[0].unit.code, u'gr'),
+            (lambda: edit(Wine, self.wine.id, name='Barbaresco'),
+             lambda recipe: recipe.suggested_wine.all()[0].name, u'Barbaresco'),
+            (lambda: self.recipe.suggested_wine.clear(),
+             lambda recipe: len(recipe.suggested_wine.all()), 0),
+            (lambda: edit(Category, self.category.id, name='Primi'),
+             lambda recipe: recipe.category.name, u'Primi'),
+            (lambda: forking.fork_recipe(self.recipe, self.other_user),
+             lambda recipe: recipe.forks_count, 1),
+            (lambda: Recipe.objects.filter(fork_origin=self.recipe)[0].delete(),
+             lambda recipe: recipe.forks_count, 0),
+        ]
+        self.assertCached(self.recipe.id, False)
+        for change, value, expected in changes:
+            self.assertCached(self.recipe.id)
+            change()
+            self.assertEqual(value(self.assertCached(self.recipe.id, False)), expected)
+        #other recipes are not invalidated
+        other = self.create_recipe('Agnolotti', steps=1, category=Category.objects.create(name='Ripieni'))
+        self.assertCached(other.id, False)
+        RecipeStep.objects.get(id=step.id).save()
+        self.assertCached(other.id)
+        self.recipe.delete()
+        self.assertRaises(Recipe.DoesNotExist, recipe_cache.get_recipe, self.recipe.id)
+
+    def test_stale_while_revalidate(self):
+        self.assertCached(self.recipe.id, False)
+        RecipeStep.objects.filter(recipe=self.recipe).update(text='Boil')
+        self.recipe.save()
+        #another request is rebuilding the entry: the stale recipe is served meanwhile
+        cache.add(recipe_cache.LOCK_KEY % self.recipe.id, True)
+        self.assertEqual(self.assertCached(self.recipe.id).recipestep_set.all()[0].text, u'Step 0 of Tajarin')
+        cache.delete(recipe_cache.LOCK_KEY % self.recipe.id)
+        self.assertEqual(self.assertCached(self.recipe.id, False).recipestep_set.all()[0].text, u'Boil')
+        self.assertCached(self.recipe.id)
+        #expired entries are served stale the same way
+        timeout = cookbook_settings.DJANGO_CUISINE_RECIPE_CACHE_TIMEOUT
+        cookbook_settings.DJANGO_CUISINE_RECIPE_CACHE_TIMEOUT = -1
+        try:
+            recipe_cache.recipes_changed([self.recipe.id])
+            self.assertCached(self.recipe.id, False)
+            cache.add(recipe_cache.LOCK_KEY % self.recipe.id, True)
+            self.assertCached(self.recipe.id)
+            cache.delete(recipe_cache.LOCK_KEY % self.recipe.id)
+            self.assertCached(self.recipe.id, False)
+            self.assertFalse(cache.get(recipe_cache.LOCK_KEY % self.recipe.id))
+        finally:
+            cookbook_settings.DJANGO_CUISINE_RECIPE_CACHE_TIMEOUT = timeout
+
+    def test_file_based_cache(self):
+        location = tempfile.mkdtemp()
+        default_cache = caching.cache
+        caching.cache = get_cache('django.core.cache.backends.filebased.FileBasedCache', LOCATION=location)
+        try:
+            self.assertCached(self.recipe.id, False)
+            recipe = self.assertCached(self.recipe.id)
+            with self.assertNumQueries(0):
+                self.assertEqual(len(recipe.ingredient_set.all()), 3)
+            RecipeStep.objects.filter(recipe=self.recipe)[0].delete()
+            self.assertEqual(len(self.assertCached(self.recipe.id, False).recipestep_set.all()), 1)
+        finally:
+            caching.cache = default_cache
+            shutil.rmtree(location)
+
+    def test_versions_do_not_expire(self):
+        default_cache = caching.cache
+        caching.cache = get_cache('django.core.cache.backends.locmem.LocMemCache', LOCATION='versions', TIMEOUT=1)
+        try:
+            version = caching.get_version('recipes')
+            caching.bump_version('recipes')
+            self.assertTrue(caching.get_version('recipes') > version)
+            key = caching.cache.make_key(caching.VERSION_KEY % 'recipes')
+            self.assertTrue(caching.cache._expire_info[key] > time.time() + 60 * 60 * 24)
+        finally:
+            caching.cache = default_cache
+
+
+class ExchangeTest(CookbookTestCase):
+
+    def setUp(self):
+        super(ExchangeTest, self).setUp()
+        self.recipe.area = self.area
+        self.recipe.save()
+        self.fork = forking.fork_recipe(self.recipe, self.other_user)
+
+    def export(self, **kwargs):
+        stream = StringIO()
+        count = exchange.export_recipes(stream, **kwargs)
+        return count, stream.getvalue()
+
+    def test_round_trip(self):
+        count, data = self.export(batch_size=1)
+        self.assertEqual(count, 2)
+        lines = [json.loads(line) for line in data.splitlines()]
+        self.assertEqual([line['id'] for line in lines], [self.recipe.id, self.fork.id])
+        self.assertEqual((lines[0]['category'], lines[0]['area'], lines[0]['author'], lines[1]['fork_origin']),
+                         ([u'Pasta'], [u'IT', u'Piemonte'], u'cook', self.recipe.id))
+        self.assertEqual(lines[0]['ingredients'][0], {'quantity': 100.0, 'unit': u'gram', 'order': 0,
+                                                      'food': [u'Food 0 of Tajarin', u'Cereals']})
+        self.assertEqual(lines[0]['wines'], [[u'DOCG-1', u'Barolo', 2008]])
+        counts = exchange.import_recipes(StringIO(data), batch_size=1, workers=0)
+        self.assertEqual((counts['recipes'], counts['steps'], counts['ingredients'], counts['wines'], counts['tags']),
+                         (2, 4, 6, 2, 4))
+        copy, fork_copy = Recipe.objects.filter(id__gt=self.fork.id).order_by('id')
+        self.assertEqual(fork_copy.fork_origin_id, copy.id)
+        self.assertEqual((copy.title, copy.area, copy.author, copy.tags, copy.created),
+                         (self.recipe.title, self.area, self.user, u'pasta piemonte',
+                          Recipe.objects.get(id=self.recipe.id).created))
+        self.assertEqual([unicode(i) for i in copy.ingredient_set.all()],
+                         [unicode(i) for i in self.recipe.ingredient_set.all()])
+        self.assertEqual([s.text for s in fork_copy.recipestep_set.all()],
+                         [s.text for s in self.recipe.recipestep_set.all()])
+        self.assertEqual(list(fork_copy.suggested_wine.all()), [self.wine])
+        #no food was duplicated, counters and indexes are up to date
+        self.assertEqual(Food.objects.count(), 3)
+        self.assertEqual(counters.get_forks_count(copy.id), 1)
+        self.assertEqual(counters.get_recipes_count(self.user), 2)
+        self.assertEqual(counters.get_tag_counts(Recipe), {u'pasta': 4, u'piemonte': 4})
+        self.assertEqual(tagcloud.tagged_ids(Recipe, [u'piemonte']),
+                         [self.recipe.id, self.fork.id, copy.id, fork_copy.id])
+        self.assertIn(copy.id, [recipe.id for recipe in search.search(u'tajarin')])
+        #the new rows get the next primary keys
+        self.assertTrue(Recipe.objects.create(title='Bagna cauda', difficulty=1, category=self.category,
+                                              country=self.country, author=self.user).id > fork_copy.id)
+
+    def test_natural_keys(self):
+        line = {'id': 1, 'title': u'Plin', 'difficulty': 3, 'category': [u'Pasta', u'Ripiena'], 'country': u'IT',
+                'area': [u'IT', u'Langhe'], 'author': u'chef', 'fork_origin': 99, 'tags': u'pasta',
+                'steps': [{'order': 0, 'text': u'Pinch'}, {'order': 0, 'text': u'Pinch'}],
+                'ingredients': [{'quantity': 2, 'unit': None, 'food': [u'Egg', u'Eggs']}],
+                'wines': [[u'DOCG-1', u'Barolo', 2008], [u'DOC-9', u'Dolcetto', 2010]]}
+        counts = exchange.import_recipes(StringIO(json.dumps(line) + '\n\n'), workers=0)
+        self.assertEqual((counts['authors'], counts['categories'], counts['foods'], counts['unknown wines']),
+                         (1, 1, 1, 1))
+        recipe = Recipe.objects.get(title=u'Plin')
+        self.assertEqual((recipe.author.username, recipe.category.parent, recipe.area, recipe.fork_origin),
+                         (u'chef', self.category, None, None))
+        self.assertEqual(recipe.recipestep_set.count(), 2)
+        self.assertEqual([unicode(i) for i in recipe.ingredient_set.all()], [u'2  egg'])
+        self.assertEqual(recipe.ingredient_set.get().food.food_type.type_name, u'Eggs')
+        recipes_count = Recipe.objects.count()
+        line['ingredients'][0]['unit'] = u'cup'
+        self.assertRaisesRegexp(ValueError, 'Unit cup does not exist', exchange.import_recipes,
+                                StringIO(json.dumps(line)), workers=0)
+        self.assertRaisesRegexp(ValueError, 'Line 2: title is missing', exchange.import_recipes,
+                                StringIO(json.dumps(line) + '\n{"difficulty": 1}\n'), workers=0)
+        self.assertEqual(Recipe.objects.count(), recipes_count)
+
+    def test_invalid_fields(self):
+        line = {'title': u'Plin', 'difficulty': 3, 'category': [u'Pasta'], 'country': u'IT', 'author': u'chef',
+                'ingredients': [{'quantity': 2, 'food': [u'Egg', u'Eggs']}]}
+        categories_count = Category.objects.count()
+        for name, value, message in (
+                ('category', u'Pasta', 'Line 1: category must be a list of one or more strings'),
+                ('area', u'Piemonte', 'Line 1: area must be a list of 2 strings'),
+                ('ingredients', [{'food': [u'Egg', u'Eggs']}], 'Line 1: ingredient quantity is missing'),
+                ('ingredients', [{'quantity': 2}], 'Line 1: ingredient food must be a list of 2 strings')):
+            self.assertRaisesRegexp(ValueError, message, exchange.import_recipes,
+                                    StringIO(json.dumps(dict(line, **{name: value}))), workers=0)
+        self.assertEqual(Category.objects.count(), categories_count)
+        self.assertFalse(Recipe.objects.filter(title=u'Plin').exists())
+
+    def test_commands(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'recipes.jsonl.gz')
+            stderr = StringIO()
+            call_command('export_recipes', output=path, stderr=stderr)
+            self.assertTrue(stderr.getvalue().startswith('2 recipes exported in '))
+            stdout = StringIO()
+            call_command('import_recipes', path, workers=2, batch_size=1, stdout=stdout)
+            self.assertIn('2 recipes imported in ', stdout.getvalue())
+            self.assertEqual(Recipe.objects.filter(title=self.recipe.title).count(), 4)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TimestampsTest(CookbookTestCase):
+
+    def test_default_is_evaluated_per_object(self):
+        before = datetime.datetime.now()
+        food = Food(name='Salt', food_type=self.food_type)
+        self.assertTrue(before <= food.created <= datetime.datetime.now())
+        self.assertTrue(food.created > self.recipe.created)
+
+    def test_bulk_create(self):
+        old = datetime.datetime(2000, 1, 1)
+        steps = [RecipeStep(recipe=self.recipe, order=10 + i, text='Rest', created=old, updated=old) for i in range(3)]
+        before = datetime.datetime.now()
+        RecipeStep.objects.bulk_create(steps)
+        stamps = set(RecipeStep.objects.filter(order__gte=10).values_list('created', 'updated'))
+        self.assertEqual(len(stamps), 1)
+        created, updated = stamps.pop()
+        self.assertEqual(created, updated)
+        self.assertTrue(created >= before)
+        Food.objects.bulk_create([Food(name='Salt', food_type=self.food_type, created=old, updated=old)],
+                                 timestamps=False)
+        self.assertEqual(Food.objects.filter(name='Salt').values_list('created', 'updated')[0], (old, old))
+
+    def test_bulk_update_and_touch(self):
+        steps = list(RecipeStep.objects.filter(recipe=self.recipe))
+        created = [step.created for step in steps]
+        before = datetime.datetime.now()
+        for step in steps:
+            step.text = 'Updated %d' % step.order
+            step.duration = None
+        with self.assertNumQueries(1):
+            self.assertEqual(RecipeStep.objects.bulk_update(steps, ['text', 'duration']), 2)
+        steps = list(RecipeStep.objects.filter(recipe=self.recipe))
+        self.assertEqual([(step.text, step.duration) for step in steps], [(u'Updated 0', None), (u'Updated 1', None)])
+        self.assertEqual([step.created for step in steps], created)
+        self.assertTrue(all(step.updated >= before for step in steps))
+        self.assertEqual(Recipe.pub_objects.bulk_update([], ['title']), 0)
+        before = datetime.datetime.now()
+        self.assertEqual(Recipe.pub_objects.filter(id=self.recipe.id).touch(title='Tajarin al tartufo'), 1)
+        recipe = Recipe.objects.get(id=self.recipe.id)
+        self.assertEqual(recipe.title, u'Tajarin al tartufo')
+        self.assertTrue(recipe.updated >= before)
+        self.assertEqual(recipe.created, self.recipe.created)
+
+
+class HistoryTest(CookbookTestCase):
+
+    def setUp(self):
+        super(HistoryTest, self).setUp()
+        self.recipes = [self.recipe] + [self.create_recipe('Recipe %d' % i) for i in range(4)]
+        recipe_type = ContentType.objects.get_for_model(Recipe)
+        for i, recipe in enumerate(self.recipes):
+            for action in range(i):
+                LogEntry.objects.log_action(self.user.id, recipe_type.id, recipe.id, unicode(recipe), CHANGE,
+                                            'Change %d' % action)
+        LogEntry.objects.log_action(self.user.id, ContentType.objects.get_for_model(Wine).id, self.wine.id,
+                                    unicode(self.wine), ADDITION)
+
+    def test_with_history(self):
+        with self.assertNumQueries(2):
+            recipes = list(Recipe.objects.with_history().filter(id__in=[r.id for r in self.recipes]).order_by('id'))
+            self.assertEqual([len(recipe.get_history()) for recipe in recipes], [0, 1, 2, 3, 4])
+            self.assertEqual([entry.change_message for entry in recipes[4].get_history()],
+                             ['Change 3', 'Change 2', 'Change 1', 'Change 0'])
+            self.assertEqual(recipes[4].get_history()[0].user.username, u'cook')
+        with self.assertNumQueries(2):
+            recipes = list(Recipe.pub_objects.with_history(limit=2).order_by('id'))
+            self.assertEqual([len(recipe.get_history()) for recipe in recipes], [0, 1, 2, 2, 2])
+        #not preloaded: one query per object
+        self.assertEqual([entry.change_message for entry in Recipe.objects.get(id=self.recipes[2].id).get_history()],
+                         ['Change 1', 'Change 0'])
+
+    def test_mixed_models(self):
+        wine = Wine.objects.get(id=self.wine.id)
+        with self.assertNumQueries(2):
+            history.attach_history([wine] + self.recipes)
+            self.assertEqual([entry.action_flag for entry in wine.get_history()], [ADDITION])
+            self.assertEqual(len(self.recipes[3].get_history()), 3)
+
+    def test_history_page(self):
+        recipe = self.recipes[4]
+        page = history.history_page(recipe, per_page=3)
+        self.assertEqual([entry.change_message for entry in page], ['Change 3', 'Change 2', 'Change 1'])
+        self.assertFalse(page.has_previous())
+        page = history.history_page(recipe, per_page=3, after=page.next_cursor)
+        self.assertEqual([entry.change_message for entry in page], ['Change 0'])
+        self.assertFalse(page.has_next())
+        page = history.history_page(recipe, per_page=3, before=page.previous_cursor)
+        self.assertEqual([entry.change_message for entry in page], ['Change 3', 'Change 2', 'Change 1'])
+        self.assertRaises(pagination.InvalidCursor, history.history_page, recipe, after='bogus')
+
+
+class FacetsTest(CookbookTestCase):
+
+    def setUp(self):
+        super(FacetsTest, self).setUp()
+        cache.clear()
+        self.soups = Category.objects.create(name='Soups')
+        self.soup = self.create_recipe('Minestrone', steps=3, category=self.soups, is_for_vegan=True,
+                                       is_for_vegetarian=True)
+        Recipe.objects.filter(id=self.soup.id).update(difficulty=4)
+        RecipeStep.objects.create(recipe=self.soup, text='Simmer', order=3, duration=45)
+        self.create_recipe('Draft', steps=1, is_published=False)
+
+    def total_duration(self, recipe):
+        return Recipe.objects.get(id=recipe.id).total_duration
+
+    def test_total_duration_follows_steps(self):
+        self.assertEqual(self.total_duration(self.recipe), 10)
+        self.assertEqual(self.total_duration(self.soup), 60)
+        step = self.recipe.recipestep_set.all()[0]
+        step.duration = 25
+        step.save()
+        self.assertEqual(self.total_duration(self.recipe), 30)
+        step.duration = None
+        step.save()
+        self.assertEqual(self.total_duration(self.recipe), 5)
+        self.recipe.recipestep_set.all()[1].delete()
+        self.assertEqual(self.total_duration(self.recipe), 0)
+        fork = forking.fork_recipe(self.soup, self.other_user)
+        self.assertEqual(self.total_duration(fork), 60)
+        Recipe.objects.update(total_duration=0)
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(self.total_duration(self.soup), 60)
+        self.assertEqual(counters.refresh_total_durations([self.soup.id, fork.id]), 0)
+
+    def test_facet_counts(self):
+        with QueryCounter() as queries:
+            counts = facets.count_facets({})
+        self.assertEqual(queries.count, 1)
+        self.assertEqual(counts['duration'], {'15': 1, '60': 1})
+        self.assertEqual(counts['difficulty'], {2: 1, 4: 1})
+        self.assertEqual(counts['category'], {self.category.id: 1, self.soups.id: 1})
+        self.assertEqual(counts['country'], {self.country.id: 2})
+        self.assertEqual(counts['vegan'], {True: 1})
+        filters = facets.parse_filters({'duration': '60', 'country': str(self.country.id), 'vegan': '1',
+                                        'difficulty': '9', 'category': 'x'})
+        self.assertEqual(filters, {'duration': '60', 'country': self.country.id, 'vegan': True})
+        self.assertEqual(facets.count_facets(filters)['category'], {self.soups.id: 1})
+        self.assertEqual(list(facets.filter_recipes(filters)), [Recipe.objects.get(id=self.soup.id)])
+        self.assertEqual(facets.count_facets({'duration': '30'})['country'], {})
+
+    def test_cached_facets(self):
+        facet_list = facets.get_facets({'difficulty': 4})
+        category = [facet for facet in facet_list if facet['name'] == 'category'][0]
+        self.assertEqual([(choice['label'], choice['count'], choice['selected']) for choice in category['choices']],
+                         [(u'Soups', 1, False)])
+        difficulty = [facet for facet in facet_list if facet['name'] == 'difficulty'][0]
+        self.assertEqual([(choice['value'], choice['selected'], choice['query']) for choice in difficulty['choices']],
+                         [(4, True, '')])
+        with self.assertNumQueries(0):
+            facets.get_facets({'difficulty': 4})
+        #a step duration change moves the recipe to another bucket
+        RecipeStep.objects.filter(recipe=self.soup, duration=45).get().delete()
+        duration = facets.get_facets({'difficulty': 4})[0]
+        self.assertEqual([(choice['value'], choice['count']) for choice in duration['choices']], [('15', 1)])
+
+    def test_browse_view(self):
+        response = self.client.get(reverse('cookbook_list:recipe_browse'), {'category': self.soups.id})
+        self.assertContains(response, u'Minestrone')
+        self.assertNotContains(response, u'Tajarin')
+        self.assertNotContains(response, u'Draft')
+        self.assertContains(response, u'?category=%d&amp;vegan=1' % self.soups.id)
+        response = self.client.get(reverse('cookbook_list:recipe_browse'), {'duration': '15'})
+        self.assertContains(response, u'Tajarin')
+        self.assertNotContains(response, u'Minestrone')
+
+
+class CatalogTest(CookbookTestCase):
+
+    def setUp(self):
+        super(CatalogTest, self).setUp()
+        cache.clear()
+
+    def load_catalog(self):
+        for model in catalog.MODELS:
+            catalog.records(model)
+
+    def test_snapshot_loaded_once(self):
+        with QueryCounter() as cold:
+            record = catalog.get(Unit, self.gram.id)
+            self.assertEqual([food.name for food in catalog.records(Food)],
+                             [u'Food %d of Tajarin' % i for i in range(3)])
+            catalog.get(Unit, self.gram.id)
+        self.assertEqual(cold.count, 2)
+        self.load_catalog()
+        self.assertEqual((record.unit_name, record.code, record.type), (u'gram', u'g', 1))
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.name(Category, self.category.id), u'Pasta')
+            self.assertEqual(catalog.label(Country, self.country.id), u'Italian Republic')
+            self.assertEqual(catalog.instance(Unit, self.gram.id).unit_name, u'gram')
+            self.assertEqual(catalog.get(Unit, self.gram.id + 1000), None)
+
+    def test_changes_invalidate_snapshot(self):
+        food = Food.objects.get(name=u'Food 0 of Tajarin')
+        self.assertEqual(catalog.name(Food, food.id), u'Food 0 of Tajarin')
+        self.gram.unit_name = u'grams'
+        self.gram.save()
+        self.assertEqual(catalog.get(Unit, self.gram.id).unit_name, u'grams')
+        Ingredient.objects.filter(food=food).delete()
+        food.delete()
+        self.assertEqual(catalog.get(Food, food.id), None)
+        #bulk writers bump the version themselves
+        self.assertEqual(catalog.name(Category, self.category.id), u'Pasta')
+        Category.objects.filter(id=self.category.id).update(name=u'Fresh pasta')
+        self.assertEqual(catalog.name(Category, self.category.id), u'Pasta')
+        caching.bump_version('catalog')
+        self.assertEqual(catalog.name(Category, self.category.id), u'Fresh pasta')
+
+    def test_ingredients_and_tags_without_queries(self):
+        ingredients = list(Ingredient._base_manager.filter(recipe=self.recipe).order_by('order'))
+        recipe = Recipe.objects.get(id=self.recipe.id)
+        self.load_catalog()
+        with self.assertNumQueries(0):
+            self.assertEqual([unicode(ingredient) for ingredient in ingredients],
+                             [u'%d gram food %d of tajarin' % (100 + i, i) for i in range(3)])
+        with self.assertNumQueries(0):
+            self.assertEqual(Template('{% load cooktags %}{% get_catalog_name recipe "category" %} - '
+                                      '{% get_catalog_name recipe "country" %}').render(Context({'recipe': recipe})),
+                             u'Pasta - Italy')
+
+    def test_catalog_form_fields(self):
+        IngredientForm = modelform_factory(Ingredient, formfield_callback=catalog_formfield)
+        form = IngredientForm()
+        self.assertTrue(isinstance(form.fields['unit'], CatalogChoiceField))
+        self.assertFalse(isinstance(form.fields['recipe'], CatalogChoiceField))
+        self.load_catalog()
+        with self.assertNumQueries(0):
+            html = unicode(form['unit']) + unicode(form['food'])
+        self.assertTrue(u'<option value="%d">gram</option>' % self.gram.id in html)
+        food = Food.objects.get(name=u'Food 1 of Tajarin')
+        form = IngredientForm({'quantity': '3', 'unit': str(self.gram.id), 'recipe': str(self.recipe.id),
+                               'food': str(food.id), 'order': '9', 'is_published': 'on'})
+        self.assertTrue(form.is_valid(), form.errors)
+        ingredient = form.save()
+        self.assertEqual(unicode(Ingredient.objects.get(id=ingredient.id)), u'3 gram food 1 of tajarin')
+        form = IngredientForm({'quantity': '3', 'unit': str(self.gram.id + 1000), 'recipe': str(self.recipe.id),
+                               'food': str(food.id)})
+        self.assertEqual(form.errors.keys(), ['unit'])
+        grape = GrapeType.objects.create(name='Nebbiolo', origin='Piemonte')
+        field = CatalogMultipleChoiceField(GrapeType.objects.all())
+        self.wine.grape_type = field.clean([str(grape.id)])
+        self.assertEqual(list(self.wine.grape_type.all()), [grape])
+        self.assertRaises(ValidationError, field.clean, [str(grape.id + 1000)])
+
+    def test_catalog_form_fields_check_the_database(self):
+        cup = Unit.objects.create(unit_name='cup', code='c', type=2)
+        field = CatalogChoiceField(Unit.objects.all())
+        self.load_catalog()
+        #deleted by another process: the local cache does not tell this one
+        connection.cursor().execute('DELETE FROM %s WHERE id = %%s' % Unit._meta.db_table, [cup.id])
+        self.assertTrue(catalog.get(Unit, cup.id))
+        self.assertRaises(ValidationError, field.clean, str(cup.id))
+        self.assertRaises(ValidationError, CatalogMultipleChoiceField(Unit.objects.all()).clean, [str(cup.id)])
+        self.assertEqual(field.clean(str(self.gram.id)), self.gram)
+        #with a shared cache the snapshot is trusted, the database only read for the missing keys
+        location = tempfile.mkdtemp()
+        default_cache = caching.cache
+        caching.cache = get_cache('django.core.cache.backends.filebased.FileBasedCache', LOCATION=location)
+        try:
+            self.load_catalog()
+            with self.assertNumQueries(0):
+                self.assertEqual(field.clean(str(self.gram.id)).unit_name, u'gram')
+            connection.cursor().execute('INSERT INTO %s (id, unit_name, code, type, system) VALUES (%%s, %%s, %%s, %%s, %%s)'
+                                        % Unit._meta.db_table, [cup.id, 'cup', 'c', 2, 3])
+            with self.assertNumQueries(1):
+                self.assertEqual(field.clean(str(cup.id)).unit_name, u'cup')
+            with self.assertNumQueries(1):
+                self.assertEqual([unit.unit_name for unit in CatalogMultipleChoiceField(Unit.objects.all()).clean(
+                    [str(cup.id), str(self.gram.id)])], [u'cup', u'gram'])
+        finally:
+            caching.cache = default_cache
+            shutil.rmtree(location)
+
+class ChangesTest(CookbookTestCase):
+
+    def total_duration(self):
+        return Recipe.objects.get(id=self.recipe.id).total_duration
+
+    def add_steps(self, count, text='Braise'):
+        with QueryCounter() as counter:
+            for i in range(count):
+                RecipeStep.objects.create(recipe=self.recipe, text=text, order=10 + i, duration=1)
+        return counter.count
+
+    def test_refreshed_once_per_block(self):
+        unbatched = self.add_steps(20)
+        self.assertEqual(self.total_duration(), 30)
+        with changes.collect():
+            batched = self.add_steps(20, 'Stew')
+            self.assertEqual(self.total_duration(), 30)
+            self.assertEqual(search.search(u'stew'), [])
+        self.assertEqual(self.total_duration(), 50)
+        self.assertEqual([recipe.id for recipe in search.search(u'stew')], [self.recipe.id])
+        #one INSERT per step and a single refresh
+        self.assertTrue(batched < unbatched / 3, (batched, unbatched))
+
+    def test_middleware(self):
+        food_id = Food.objects.get(name='Food 0 of Tajarin').id
+        self.assertEqual([row[0] for row in pantry.cookable_with([food_id], 0.1)], [self.recipe.id])
+        middleware = changes.ChangesMiddleware()
+        middleware.process_request(None)
+        Ingredient.objects.filter(recipe=self.recipe).delete()
+        self.add_steps(1)
+        self.assertEqual([row[0] for row in pantry.cookable_with([food_id], 0.1)], [self.recipe.id])
+        self.assertEqual(self.total_duration(), 10)
+        response = HttpResponse()
+        self.assertTrue(middleware.process_response(None, response) is response)
+        self.assertEqual(pantry.cookable_with([food_id], 0.1), [])
+        self.assertEqual(self.total_duration(), 11)
+
+
+
+class TransactionsTest(TransactionTestCase):
+    """
+    The helpers called by the receivers and by the importer must not commit
+    the managed transaction they run in
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('cook', 'cook@example.com', 'cook')
+        self.country = Country.objects.create(iso_code='IT', iso3_code='ITA', num_code='380', name='Italy',
+                                              fullname='Italian Republic', continent='EU')
+        self.category = Category.objects.create(name='Pasta')
+        #the process indexes may hold the rows of the previous tests
+        cache.clear()
+        pantry.reset()
+        tagcloud.reset()
+
+    def test_index_recipes_rolled_back(self):
+        with transaction.commit_manually():
+            recipe = Recipe.objects.create(title='Tajarin', difficulty=2, category=self.category,
+                                           country=self.country, author=self.user)
+            search.index_recipes([recipe.id])
+            self.assertEqual([found.id for found in search.search(u'tajarin')], [recipe.id])
+            transaction.rollback()
+        self.assertEqual(Recipe.objects.count(), 0)
+        self.assertEqual(search.search_recipes(u'tajarin'), [])
+
+
+    def test_import_rolled_back(self):
+        line = json.dumps({'title': u'Plin', 'difficulty': 3, 'category': [u'Pasta', u'Ripiena'], 'country': u'IT',
+                           'author': u'chef', 'tags': u'pasta', 'steps': [{'order': 0, 'text': u'Pinch'}]})
+        self.assertEqual(tagcloud.tagged_ids(Recipe, [u'pasta']), [])
+        #the first batches are inserted before the last line is parsed
+        self.assertRaisesRegexp(ValueError, 'Line 3: title is missing', exchange.import_recipes,
+                                StringIO('\n'.join([line, line, '{"difficulty": 1}'])), batch_size=1, workers=0)
+        self.assertEqual((Recipe.objects.count(), RecipeStep.objects.count(), User.objects.count(),
+                          Category.objects.count()), (0, 0, 1, 1))
+        self.assertEqual(search.search_recipes(u'plin'), [])
+        self.assertEqual(tagcloud.tagged_ids(Recipe, [u'pasta']), [])
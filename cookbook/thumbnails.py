@@ -0,0 +1,174 @@
+# coding=utf-8
+"""
+Background thumbnail pipeline of the recipe, step and wine images.
+
+The thumbnails of the THUMBNAIL_ALIASES of an image field (the
+'cookbook.Recipe.image' target and its parents, 'cookbook.Recipe' and
+'cookbook') are generated ahead of time, with the THUMBNAIL_PROCESSORS of
+the settings. When an image is attached to a Recipe, RecipeStep or Wine
+(see cookbook.signals) it is queued as a PendingThumbnail row, in the
+transaction of the save: the generate_thumbnails --pending command (e.g.
+run by cron) generates the thumbnails of the queued images with a pool of
+processes, the web processes never fork. With DJANGO_CUISINE_THUMBNAIL_WORKERS
+set to 0 (e.g. in development) nothing is queued, they are generated in the
+calling process instead. The generate_thumbnails command without --pending
+backfills all the images.
+
+At render time thumbnail_url() never generates a thumbnail: a missing one
+is queued and the original image is served meanwhile.
+"""
+import logging
+
+from django.db import IntegrityError, connections, transaction
+from easy_thumbnails.alias import aliases
+from filer.models import Image
+
+import cookbook_settings
+from cookbook.models import PendingThumbnail, Recipe, RecipeStep, Wine
+
+logger = logging.getLogger('cookbook.thumbnails')
+
+#(model, field name) of the images with pre-generated thumbnails
+IMAGE_FIELDS = (
+    (Recipe, 'image'),
+    (RecipeStep, 'image'),
+    (Wine, 'image'),
+)
+
+
+def alias_options(model, field_name='image'):
+    """
+    Returns the {alias: thumbnail options} of an image field of model
+    """
+    return aliases.all(target='%s.%s.%s' % (model._meta.app_label, model.__name__, field_name),
+                       include_global=False)
+
+
+def image_options(image, options):
+    """
+    Returns the thumbnail options of a filer Image, with its subject location
+    (used by filer's scale_and_crop_with_subject_location processor)
+    """
+    options = dict(options)
+    options.setdefault('subject_location', image.subject_location)
+    return options
+
+
+def generate(image_id, options_list):
+    """
+    Generates the missing thumbnails of a filer Image, one per options.
+    Returns the number of thumbnails generated; it runs in the pool
+    processes of the generate_thumbnails command
+    """
+    try:
+        image = Image.objects.get(id=image_id)
+    except Image.DoesNotExist:
+        return 0
+    generated = 0
+    for options in options_list:
+        options = image_options(image, options)
+        try:
+            if image.file.get_thumbnail(options, generate=False) is None:
+                image.file.get_thumbnail(options)
+                generated += 1
+        except Exception:
+            logger.exception('Cannot generate the %s thumbnail of image %s', options, image_id)
+    return generated
+
+
+def generate_task(args):
+    """
+    generate() taking its arguments as a tuple, for Pool.imap
+    """
+    return generate(*args)
+
+
+def init_worker():
+    """
+    Pool process initializer: the database connections inherited from the
+    parent process are dropped (not closed, they are still the parent's)
+    """
+    for connection in connections.all():
+        connection.connection = None
+
+
+def schedule(image_id, options_list):
+    """
+    Queues the generation of the thumbnails of a filer Image for the
+    generate_thumbnails command, unless it is already queued. Without
+    workers they are generated right away
+    """
+    options_list = list(options_list)
+    if image_id is None or not options_list:
+        return
+    if not cookbook_settings.DJANGO_CUISINE_THUMBNAIL_WORKERS:
+        generate(image_id, options_list)
+        return
+    if PendingThumbnail.objects.filter(image=image_id).exists():
+        return
+    #a savepoint, where supported: a concurrent insert must not abort the caller's transaction
+    sid = transaction.savepoint()
+    try:
+        PendingThumbnail.objects.create(image_id=image_id)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+    else:
+        transaction.savepoint_commit(sid)
+
+
+def image_attached(instance, field_name='image'):
+    """
+    Queues the thumbnails of the image attached to a Recipe, RecipeStep or Wine
+    """
+    schedule(getattr(instance, '%s_id' % field_name), alias_options(instance.__class__, field_name).values())
+
+
+def thumbnail_url(obj, alias, field_name='image'):
+    """
+    Returns the URL of the alias thumbnail of the image of obj without
+    generating it: when it is missing it is queued and the URL of the
+    original image is returned
+    """
+    image = getattr(obj, field_name)
+    if image is None:
+        return ''
+    all_options = alias_options(obj.__class__, field_name)
+    if alias not in all_options:
+        return image.url
+    thumbnail = image.file.get_thumbnail(image_options(image, all_options[alias]), generate=False)
+    if thumbnail is not None:
+        return thumbnail.url
+    schedule(image.id, all_options.values())
+    return image.url
+
+
+def images_to_backfill(image_ids=None):
+    """
+    Returns the [(image id, [thumbnail options])] of all the images of
+    IMAGE_FIELDS, or of those among image_ids
+    """
+    options = {}
+    for model, field_name in IMAGE_FIELDS:
+        field_options = alias_options(model, field_name).values()
+        if not field_options:
+            continue
+        queryset = model.objects.exclude(**{field_name: None})
+        if image_ids is not None:
+            queryset = queryset.filter(**{'%s__in' % field_name: image_ids})
+        for image_id in queryset.values_list(field_name, flat=True).distinct().order_by():
+            known = options.setdefault(image_id, [])
+            known.extend(option for option in field_options if option not in known)
+    return sorted(options.items())
+
+
+def take_pending(limit=1000):
+    """
+    Removes at most limit images from the queue: returns their
+    [(image id, [thumbnail options])], as images_to_backfill()
+    """
+    image_ids = list(PendingThumbnail.objects.values_list('image', flat=True)[:limit])
+    if not image_ids:
+        return []
+    PendingThumbnail.objects.filter(image__in=image_ids).delete()
+    transaction.commit_unless_managed()
+    return images_to_backfill(image_ids)
@@ -0,0 +1,159 @@
+# coding=utf-8
+"""
+Unit conversion and recipe scaling.
+
+A Unit with a conversion factor can be converted to the base unit of its
+type (gram for weights, millilitre for volumes) and from there to any unit
+of the same type. Quantities are converted in batches: all the ingredient
+quantities of a set of recipes go through a single vectorized pass, with
+NumPy when it is installed and with a plain Python loop otherwise.
+Units without a factor (or of the Other type) are only scaled.
+"""
+import bisect
+import threading
+from collections import defaultdict, namedtuple
+from itertools import izip, repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from cookbook import caching
+from cookbook.models import Ingredient, Unit, VOLUME, WEIGHT
+
+#a quantity slightly below a unit factor because of float rounding still fits that unit
+TOLERANCE = 1e-9
+
+#names of the base units, used when no unit of the wanted system is defined
+BASE_UNIT_NAMES = {WEIGHT: u'g', VOLUME: u'ml'}
+
+ScaledIngredient = namedtuple('ScaledIngredient', 'id recipe_id food_id unit_id quantity')
+
+
+class UnitTable(object):
+    """
+    The types and conversion factors of all the units, loaded with one query.
+    For each (system, type) the units are sorted by factor: a converted
+    quantity is expressed in the largest unit not bigger than it
+    """
+
+    def __init__(self):
+        self.types = {}
+        self.factors = {}
+        self.names = {}
+        self.scales = defaultdict(lambda: ([], []))
+        rows = sorted(Unit.objects.values_list('factor', 'id', 'type', 'system', 'code', 'unit_name'),
+                      key=lambda row: row[:2])
+        for factor, unit_id, unit_type, system, code, name in rows:
+            self.types[unit_id] = unit_type
+            self.names[unit_id] = code or name
+            if factor and unit_type in (WEIGHT, VOLUME):
+                self.factors[unit_id] = factor
+                self.scales[(system, unit_type)][0].append(factor)
+                self.scales[(system, unit_type)][1].append(unit_id)
+        self.version = None
+        if numpy is not None:
+            #lookup arrays indexed by unit id, 0 standing for no (or an unknown) unit
+            self.size = max(self.types) + 1 if self.types else 1
+            self.type_array = numpy.zeros(self.size, dtype=int)
+            self.factor_array = numpy.full(self.size, numpy.nan)
+            for unit_id, unit_type in self.types.iteritems():
+                self.type_array[unit_id] = unit_type
+            for unit_id, factor in self.factors.iteritems():
+                self.factor_array[unit_id] = factor
+
+    def fit(self, base, unit_type, system):
+        """
+        Returns the (quantity, unit id) expressing base (grams or millilitres)
+        in the best fitting unit of system, or None if it has no such units
+        """
+        scale = self.scales.get((system, unit_type))
+        if scale:
+            pos = max(bisect.bisect_right(scale[0], base * (1 + TOLERANCE)) - 1, 0)
+            return base / scale[0][pos], scale[1][pos]
+
+    def convert_python(self, quantities, unit_ids, multipliers, system):
+        result_quantities, result_units = [], []
+        for quantity, unit_id, multiplier in izip(quantities, unit_ids, multipliers):
+            quantity *= multiplier
+            factor = self.factors.get(unit_id)
+            if factor:
+                quantity, unit_id = self.fit(quantity * factor, self.types[unit_id], system) or (quantity, unit_id)
+            result_quantities.append(quantity)
+            result_units.append(unit_id)
+        return result_quantities, result_units
+
+    def convert_numpy(self, quantities, unit_ids, multipliers, system):
+        quantities = numpy.asarray(quantities, dtype=float) * numpy.asarray(multipliers, dtype=float)
+        units = numpy.array([unit_id or 0 for unit_id in unit_ids], dtype=int)
+        if system is not None and len(units):
+            lookup = numpy.where(units < self.size, units, 0)
+            types = self.type_array[lookup]
+            base = quantities * self.factor_array[lookup]
+            for unit_type in (WEIGHT, VOLUME):
+                scale = self.scales.get((system, unit_type))
+                if not scale:
+                    continue
+                rows = numpy.flatnonzero((types == unit_type) & ~numpy.isnan(base))
+                factors = numpy.array(scale[0])
+                pos = numpy.maximum(numpy.searchsorted(factors, base[rows] * (1 + TOLERANCE), side='right') - 1, 0)
+                quantities[rows] = base[rows] / factors[pos]
+                units[rows] = numpy.array(scale[1])[pos]
+        return quantities.tolist(), [int(unit_id) or None for unit_id in units]
+
+
+_table = None
+_lock = threading.Lock()
+
+
+def get_table():
+    """
+    Returns the process unit table, reloading it after any Unit change
+    """
+    global _table
+    version = caching.get_version('units')
+    if _table is None or _table.version != version:
+        with _lock:
+            if _table is None or _table.version != version:
+                table = UnitTable()
+                table.version = version
+                _table = table
+    return _table
+
+
+def convert(quantities, unit_ids, multipliers=1.0, system=None):
+    """
+    Multiplies the quantities (expressed in the unit_ids units) by multipliers,
+    a number or a sequence with one multiplier per quantity, and converts
+    them to the best fitting unit of system (METRIC, IMPERIAL...) if given.
+    Returns the (quantities, unit ids) lists
+    """
+    table = get_table()
+    if numpy is not None:
+        return table.convert_numpy(quantities, unit_ids, multipliers, system)
+    if isinstance(multipliers, (int, long, float)):
+        multipliers = repeat(multipliers)
+    return table.convert_python(quantities, unit_ids, multipliers, system)
+
+
+def scale_recipes(recipes, multiplier=1.0, system=None):
+    """
+    Returns {recipe id: [ScaledIngredient]} for the given recipes (instances
+    or ids). multiplier is a number or a {recipe id: multiplier} dict, e.g. the
+    ratio between the wanted and the written servings of each recipe.
+    Ingredients are loaded with one query per 500 recipes
+    and converted all together
+    """
+    recipe_ids = sorted(set(int(getattr(recipe, 'pk', recipe)) for recipe in recipes))
+    rows = []
+    for start in range(0, len(recipe_ids), 500):
+        rows.extend(Ingredient.objects.filter(recipe__in=recipe_ids[start:start + 500]).values_list(
+            'id', 'recipe', 'food', 'unit', 'quantity'))
+    if isinstance(multiplier, dict):
+        multiplier = [multiplier.get(row[1], 1.0) for row in rows]
+    quantities, unit_ids = convert([row[4] for row in rows], [row[3] for row in rows], multiplier, system)
+    result = dict((recipe_id, []) for recipe_id in recipe_ids)
+    for row, quantity, unit_id in izip(rows, quantities, unit_ids):
+        result[row[1]].append(ScaledIngredient(row[0], row[1], row[2], unit_id, quantity))
+    return result
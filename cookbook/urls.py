@@ -1,12 +1,12 @@
 from django.conf.urls.defaults import patterns, url
 
-from django.views.generic import (ListView,
-                                 CreateView,
+from django.views.generic import (CreateView,
                                  UpdateView,
                                  DeleteView
                                  )
 
 from cookbook.forms import RecipeForm, WineForm
+from cookbook.views_helpers import ListView
 
 def cookbook_patterns(*forms, **kwargs):
     patterns_ = patterns('')
@@ -21,7 +21,8 @@ def cookbook_pattern(form, **kwargs):
     urls = []
 
     if 'list_view' not in kwargs or kwargs.get('list_view') is not None:
-        view = kwargs.get('list_view', ListView).as_view(model=model)
+        #e.g. list_options={'list_fields': ('title',)}, see cookbook.views_helpers.ListView
+        view = kwargs.get('list_view', ListView).as_view(model=model, **kwargs.get('list_options', {}))
         url_ = kwargs.get('list_view_url', r'^%s/$' % name)
         urls.append(cookbook_list(url_, view=view, name='%s_list' % name))
 
@@ -66,5 +67,16 @@ def cookbook_delete(url_, name, view=None, model=None):
         view = DeleteView.as_view(model=model)
     return url(url_, view, name=name)
 
-urlpatterns = cookbook_patterns(RecipeForm)
-urlpatterns += cookbook_patterns(WineForm)
+urlpatterns = cookbook_patterns(RecipeForm, list_options={'list_fields': ('title',), 'approximate_count': True})
+urlpatterns += cookbook_patterns(WineForm, list_options={'list_fields': ('name',), 'approximate_count': True})
+urlpatterns += patterns('cookbook.views',
+    url(r'^recipe/(?P<recipe_id>\d+)/view/$', 'recipe_detail', name='recipe_detail'),
+    url(r'^recipe/(?P<recipe_id>\d+)/fork/$', 'fork_recipe', name='recipe_fork'),
+    url(r'^recipe/search/$', 'search_recipes', name='recipe_search'),
+    url(r'^recipe/browse/$', 'browse_recipes', name='recipe_browse'),
+    url(r'^recipe/pantry/$', 'what_can_i_cook', name='recipe_pantry'),
+    url(r'^recipe/shopping-list/$', 'shopping_list', name='recipe_shopping_list'),
+    url(r'^(?P<kind>recipe|wine)/tags/$', 'browse_tags', name='tag_cloud'),
+    url(r'^(?P<kind>recipe|wine)/tags/(?P<tags>[^/]+)/$', 'browse_tags', name='tagged'),
+    url(r'^geo/(?P<kind>location|area|country)/lookup/$', 'geo_lookup', name='geo_lookup'),
+)
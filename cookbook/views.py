@@ -3,12 +3,13 @@ from django.contrib.auth.decorators import login_required
 from django.core.exceptions import MultipleObjectsReturned
 from django.core.urlresolvers import reverse
 from django.forms.models import inlineformset_factory
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext
-from cookbook.forms import FrontendRecipeEditForm
-from cookbook.models import Recipe, Ingredient, RecipeStep
-import datetime
+from django.utils import simplejson
+from cookbook.forms import FrontendRecipeEditForm, catalog_formfield
+from cookbook.models import Recipe, Ingredient, RecipeStep, Food, UNIT_SYSTEM, METRIC
+from cookbook import catalog, facets, forking, lookups, recipe_cache, search, shopping, tagcloud
 import cookbook_settings
 
 def homepage(request):
@@ -19,49 +20,175 @@ def homepage(request):
 
 
 
-def clone_element(el, pkval):
-    """
-    utility function: clone an object and save it, setting
-    its foreign key to pkval.
-    It's used for:
-    - RecipeIngredient
-    - RecipeStep
-    """
-    new_time = datetime.datetime.now()
-    el.created = new_time
-    el.updated = new_time
-    el.recipe = pkval
-    el.pk = None
-    return el.save()
-
 @login_required
 def fork_recipe(request, recipe_id):
     """
     This is a view to fork a Recipe with its steps and ingredients
+    The copy is made by the forking service (see cookbook.forking),
+    then the user is redirected to the update page of the fork
     """
     try:
         recipe_obj = Recipe.objects.get(id=recipe_id)
     except Recipe.DoesNotExist:
-        print 'Error, This Recipe does not exist'
-        return render_to_response("recipe_detail.html", {"unique_message": "Specific to a template"}, context_instance=RequestContext(request))
-    except Recipe.MultipleObjectsReturned:
-        print 'Error, more than one found'
-        return render_to_response("recipe_detail.html", {"unique_message": "Specific to a template"}, context_instance=RequestContext(request))
-    new_time = datetime.datetime.now()
-    #modify object attributes first
-    recipe_obj.created = new_time
-    recipe_obj.updated = new_time
-    recipe_obj.author = request.user
-    recipe_obj.fork_origin = recipe_obj.id
-    #set pk to None will save automatically another recipe instance
-    recipe_obj.pk = None
-    recipe_obj.save()
-    #now save recipe steps too, then for Ingredients
-    step_list = Recipe.recipestep_set.all()
-    new_step_list = map(clone_element, step_list, [recipe_obj for recipe_obj in len(step_list)])
-    ingredient_list = Recipe.ingredient_set.all()
-    new_ingredient_list = map(clone_element, ingredient_list, [recipe_obj for recipe_obj in len(ingredient_list)])
-    return render_to_response("recipe_detail.html", {"unique_message": "Specific to a template"}, context_instance=RequestContext(request))
+        raise Http404
+    fork_obj = forking.fork_recipe(recipe_obj, request.user)
+    return HttpResponseRedirect(reverse('cookbook_list:recipe_form', args=(fork_obj.id,)))
+
+
+def recipe_detail(request, recipe_id):
+    """
+    This is the recipe page, with its steps, ingredients and suggested wines
+    The assembled recipe is cached (see cookbook.recipe_cache); unpublished
+    recipes are only shown to their author
+    """
+    try:
+        recipe_obj = recipe_cache.get_recipe(int(recipe_id))
+    except Recipe.DoesNotExist:
+        raise Http404
+    if not recipe_obj.is_published and recipe_obj.author_id != request.user.id:
+        raise Http404
+    return render_to_response("cookbook/recipe_detail.html", {
+        "recipe": recipe_obj,
+        }, context_instance=RequestContext(request))
+
+
+def search_recipes(request):
+    """
+    This is the public recipe search view
+    Results come from the full-text index (see cookbook.search), best first
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    per_page = cookbook_settings.DJANGO_CUISINE_SEARCH_RESULTS_PER_PAGE
+    #one more result tells whether there is a next page
+    recipe_list = search.search(query, limit=per_page + 1, offset=(page - 1) * per_page) if query else []
+    return render_to_response("cookbook/search.html", {
+        "query": query,
+        "recipe_list": recipe_list[:per_page],
+        "page": page,
+        "has_next": len(recipe_list) > per_page,
+        }, context_instance=RequestContext(request))
+
+
+def browse_recipes(request):
+    """
+    This view lists the published recipes matching the selected facets
+    (duration, difficulty, category, country, vegan and vegetarian GET
+    parameters), with the recipe counts of every facet (see cookbook.facets)
+    """
+    filters = facets.parse_filters(request.GET)
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    per_page = cookbook_settings.DJANGO_CUISINE_BROWSE_PER_PAGE
+    #one more result tells whether there is a next page
+    recipe_list = list(facets.filter_recipes(filters).order_by('title', 'id')[
+        (page - 1) * per_page:page * per_page + 1])
+    return render_to_response("cookbook/browse.html", {
+        "facet_list": facets.get_facets(filters),
+        "filters": facets.urlencode_filters(filters),
+        "recipe_list": recipe_list[:per_page],
+        "page": page,
+        "has_next": len(recipe_list) > per_page,
+        }, context_instance=RequestContext(request))
+
+
+def what_can_i_cook(request):
+    """
+    This view lists the recipes that can be cooked with the foods
+    selected by the user (the food GET parameters), best coverage first.
+    min_coverage is the minimum percentage of the recipe foods to have
+    """
+    food_ids = [int(food_id) for food_id in request.GET.getlist('food') if food_id.isdigit()]
+    try:
+        min_coverage = min(max(float(request.GET['min_coverage']) / 100, 0), 1)
+    except (KeyError, ValueError):
+        min_coverage = cookbook_settings.DJANGO_CUISINE_PANTRY_MIN_COVERAGE
+    recipe_list = Recipe.objects.cookable_with(food_ids, min_coverage) if food_ids else []
+    #names of the missing foods of all the recipes, with one query
+    missing_ids = set(food_id for recipe in recipe_list for food_id in recipe.missing_food_ids)
+    food_names = dict(Food.objects.filter(id__in=missing_ids).values_list('id', 'name')) if missing_ids else {}
+    for recipe in recipe_list:
+        recipe.coverage_percent = int(round(recipe.coverage * 100))
+        recipe.missing_foods = [food_names[food_id] for food_id in recipe.missing_food_ids if food_id in food_names]
+    return render_to_response("cookbook/pantry.html", {
+        "food_list": catalog.records(Food),
+        "selected_food_ids": food_ids,
+        "min_coverage": int(round(min_coverage * 100)),
+        "recipe_list": recipe_list,
+        }, context_instance=RequestContext(request))
+
+
+def shopping_list(request):
+    """
+    This view builds the shopping list of the selected recipes (the recipe
+    GET parameters) as HTML, CSV or JSON (the format GET parameter).
+    The ingredients of all the recipes are loaded with a single query
+    """
+    recipe_ids = [int(recipe_id) for recipe_id in request.GET.getlist('recipe') if recipe_id.isdigit()]
+    try:
+        system = int(request.GET.get('system', METRIC))
+    except ValueError:
+        system = METRIC
+    items = shopping.build_shopping_list(recipe_ids, system=system)
+    output = request.GET.get('format', 'html')
+    if output == 'csv':
+        response = HttpResponse(shopping.iter_csv(items), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename=shopping-list.csv'
+        return response
+    if output == 'json':
+        return HttpResponse(shopping.iter_json(items), content_type='application/json')
+    return render_to_response("cookbook/shopping_list.html", {
+        "recipe_list": Recipe.objects.filter(id__in=recipe_ids),
+        "shopping_list": items,
+        "system": system,
+        "unit_systems": UNIT_SYSTEM,
+        }, context_instance=RequestContext(request))
+
+
+def geo_lookup(request, kind):
+    """
+    This view returns, as JSON, the [{id, label}] of the locations, areas or
+    countries (kind) whose name matches the q GET parameter,
+    for the autocompleted geo fields of the forms
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    found = lookups.search(kind, request.GET.get('q', ''), limit)
+    return HttpResponse(simplejson.dumps([{'id': obj_id, 'label': label} for obj_id, label in found]),
+                        content_type='application/json')
+
+
+def browse_tags(request, kind, tags=None):
+    """
+    This view shows the tag cloud of the recipes or wines (kind) and,
+    when tags are given (e.g. vegan+summer), the published ones tagged
+    with all of them, newest first (see cookbook.tagcloud)
+    """
+    model = tagcloud.TAGGED_MODELS[kind]
+    tag_names = tagcloud.parse_tags(tags or '')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    per_page = cookbook_settings.DJANGO_CUISINE_TAGGED_PER_PAGE
+    object_ids = tagcloud.tagged_ids(model, tag_names)[::-1] if tag_names else []
+    page_ids = object_ids[(page - 1) * per_page:page * per_page]
+    objects = model.objects.in_bulk(page_ids)
+    return render_to_response("cookbook/tags.html", {
+        "kind": kind,
+        "tag_names": tag_names,
+        "object_list": [objects[object_id] for object_id in page_ids if object_id in objects],
+        "object_count": len(object_ids),
+        "page": page,
+        "has_next": len(object_ids) > page * per_page,
+        }, context_instance=RequestContext(request))
 
 
 @login_required
@@ -97,7 +224,7 @@ def create_recipe(request):
     IngredientInlineFormSet = inlineformset_factory(Recipe, Ingredient,
                                                     extra = cookbook_settings.DJANGO_CUISINE_INGREDIENT_EXTRA,
                                                     max_num=cookbook_settings.DJANGO_CUISINE_INGREDIENT_MAX_NUM,
-                                                    can_delete=True)
+                                                    can_delete=True, formfield_callback=catalog_formfield)
     RecipeStepInlineFormSet = inlineformset_factory(Recipe, RecipeStep,
                                                     extra = cookbook_settings.DJANGO_CUISINE_RECIPE_STEPS_EXTRA,
                                                     max_num=cookbook_settings.DJANGO_CUISINE_RECIPE_STEPS_MAX_NUM,
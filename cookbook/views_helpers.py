@@ -2,6 +2,7 @@
 from django.core.urlresolvers import reverse
 
 from django.contrib import messages
+from django.http import Http404
 
 from django.views.generic import ListView as BaseListView
 
@@ -12,6 +13,8 @@ from django.views.generic.edit import (FormView as BaseFormView,
 
 from django.contrib.formtools.wizard.views import SessionWizardView as BaseSessionWizardView
 
+from cookbook import pagination
+
 
 class SessionWizardView(BaseSessionWizardView):
     def get_form_class(self):
@@ -52,11 +55,42 @@ class SessionWizardView(BaseSessionWizardView):
 
 
 class ListView(BaseListView):
+    """
+    List view paginated with keyset cursors (the after and before GET
+    parameters, see cookbook.pagination) along the model Meta.ordering.
+    list_fields restricts the columns loaded to the ones the template
+    shows, as model instances with only() or as dicts if list_values is
+    set; approximate_count adds a cheap total to the context
+    """
+    paginate_by = 25
+    list_fields = None
+    list_values = False
+    approximate_count = False
+
     def get_template_names(self):
         templates = super(ListView, self).get_template_names()
         templates.append('bootstrap/list.html')
+        templates.append('cookbook/list.html')
         return templates
 
+    def get_queryset(self):
+        queryset = super(ListView, self).get_queryset()
+        if self.list_fields:
+            #the keyset ordering columns are needed to build the cursors
+            fields = list(self.list_fields)
+            fields.extend(field.name for field, descending in pagination.keyset_ordering(queryset.model)
+                          if field.name not in fields)
+            queryset = queryset.values(*fields) if self.list_values else queryset.only(*fields)
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = pagination.KeysetPaginator(queryset, page_size)
+        try:
+            page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        except pagination.InvalidCursor:
+            raise Http404('Invalid page')
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def get_context_data(self, **kwargs):
         context = super(ListView, self).get_context_data(**kwargs)
 
@@ -65,6 +99,9 @@ class ListView(BaseListView):
         context['model_verbose_name'] = model_meta.verbose_name
         context['model_verbose_name_plural'] = model_meta.verbose_name_plural
 
+        if self.approximate_count:
+            context['approximate_count'] = pagination.approximate_count(self.model)
+
         #context['add_object_url'] = self._get_create_url()
 
         return context
@@ -0,0 +1,40 @@
+# coding=utf-8
+"""
+Form widgets of the cookbook application.
+"""
+from django import forms
+from django.core.urlresolvers import reverse
+from django.forms.util import flatatt
+from django.utils.encoding import force_unicode
+from django.utils.safestring import mark_safe
+
+from cookbook import lookups
+
+
+class GeoLookupWidget(forms.Widget):
+    """
+    Widget for a ForeignKey to a geo table (kind being location, area or
+    country, see cookbook.lookups): a text input autocompleted through the
+    geo_lookup view and a hidden input holding the selected id.
+    Unlike a Select, it never loads the whole table
+    """
+
+    class Media:
+        js = ('js/geo_lookup.js',)
+
+    def __init__(self, kind, attrs=None):
+        super(GeoLookupWidget, self).__init__(attrs)
+        self.kind = kind
+
+    def render(self, name, value, attrs=None):
+        final_attrs = self.build_attrs(attrs, type='hidden', name=name)
+        label = u''
+        if value not in (None, ''):
+            final_attrs['value'] = force_unicode(value)
+            label = lookups.label(self.kind, value) or u''
+        return mark_safe(u'<input%s /><input type="text" class="geo-lookup" autocomplete="off"%s />' % (
+            flatatt(final_attrs), flatatt({
+                'value': label,
+                'data-target': final_attrs.get('id', ''),
+                'data-url': reverse('cookbook_list:geo_lookup', args=(self.kind,)),
+            })))
@@ -26,6 +26,26 @@ DATABASES = {
     }
 }
 
+# The recipe detail cache (see cookbook.recipe_cache) is shared by the
+# processes only with a shared backend, e.g. memcached or FileBasedCache.
+# The cache versions bumped by cookbook.signals (see cookbook.caching) are
+# how the processes notice the changes made by the others: with this
+# per-process LocMemCache, the pantry, geo lookup, tag and catalog indexes
+# of a process only follow its own changes. Use a shared backend in
+# production whenever more than one process serves the site:
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#         'LOCATION': '127.0.0.1:11211',
+#     }
+# }
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'django-cuisine',
+    }
+}
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -102,11 +122,13 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'cookbook.instrumentation.InstrumentationMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'cookbook.changes.ChangesMiddleware',
 )
 
 ROOT_URLCONF = 'urls'
@@ -148,6 +170,10 @@ LOGGING = {
         'mail_admins': {
             'level': 'ERROR',
             'class': 'django.utils.log.AdminEmailHandler'
+        },
+        'console': {
+            'level': 'DEBUG',
+            'class': 'logging.StreamHandler'
         }
     },
     'loggers': {
@@ -156,6 +182,13 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        # per request queries, templates and size, see cookbook/instrumentation.py:
+        # INFO for every sampled request, WARNING for the ones with too many (or repeated) queries
+        'cookbook.instrumentation': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     }
 }
 
@@ -167,6 +200,20 @@ THUMBNAIL_PROCESSORS = (
     'easy_thumbnails.processors.filters',
     )
 
+# thumbnails generated in background when an image is attached (see cookbook/thumbnails.py)
+THUMBNAIL_ALIASES = {
+    'cookbook.Recipe.image': {
+        'list': {'size': (160, 120), 'crop': True},
+        'detail': {'size': (640, 480)},
+    },
+    'cookbook.RecipeStep.image': {
+        'step': {'size': (320, 240), 'crop': True},
+    },
+    'cookbook.Wine.image': {
+        'list': {'size': (90, 160), 'crop': True},
+    },
+}
+
 AUTHENTICATION_BACKENDS = (
     'social_auth.backends.twitter.TwitterBackend',
     'social_auth.backends.facebook.FacebookBackend',